@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息模型内存基准
+- 生成一个模拟的QQ导出文件（默认100万条消息，可用 --messages 10000000 测1000万条）
+- 分别在独立子进程里用旧的加载方式（整个文件读成行列表 + 每条消息三个新字符串的元组）
+  和新的流式解析 + Message 模型加载全部对话块，比较峰值RSS
+"""
+
+import argparse, os, random, re, resource, subprocess, sys, tempfile, time
+from datetime import datetime, timedelta
+
+USERS = [(str(1000000000 + k * 7919), name) for k, name in enumerate(
+    ["雷🐷🐷", "寻常摆渡", "神仙传", "杜预", "KE", "JIN", "格里戈里·拉斯普京", "帅气的阿雷",
+     "大胖🐷", "吴警官", "摩根", "汉将卢植", "嘟嘟雷", "开心农场", "心情复杂", "益智扫雷"])]
+COMMON_TEXTS = ["[图片]", "[表情]", "dds", "愚蠢", "太愚蠢了", "丢大师", "哈哈哈", "在吗", "呼哈哈哈哈"]
+CHARS = "的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会"
+
+def generate_export(path, count, seed=42):
+    """写一个格式与QQ导出相同的模拟文件"""
+    rng = random.Random(seed)
+    ts = datetime(2024, 1, 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\ufeff消息记录（此消息记录为文本格式，不支持重新导入）\n\n")
+        f.write("=" * 64 + "\n消息分组:我加入的群聊\n" + "=" * 64 + "\n消息对象:基准测试群\n" + "=" * 64 + "\n\n")
+        for _ in range(count):
+            ts += timedelta(seconds=rng.choice((5, 20, 60, 300, 3600)))
+            user_id, name = rng.choice(USERS)
+            if rng.random() < 0.5:
+                text = rng.choice(COMMON_TEXTS)
+            else:
+                text = ''.join(rng.choice(CHARS) for _ in range(rng.randint(2, 30)))
+            f.write(f"{ts.year}-{ts.month:02d}-{ts.day:02d} {ts.hour}:{ts.minute:02d}:{ts.second:02d} {name}({user_id})\n{text}\n\n")
+
+def load_legacy(path, gap_minutes=30):
+    """旧版 load_blocks 的内存结构：整个文件的行列表 + (user_id, username, message) 元组"""
+    timestamp_pattern = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{1,2}:\d{2}:\d{2})\s+')
+    user_pattern = re.compile(r'(.+?)\((\d+)\)\s*$')
+    lines = [l.rstrip() for l in open(path, encoding='utf-8')]
+    blocks, cur, prev_ts = [], [], None
+    i = 0
+    while i < len(lines):
+        ts_match = timestamp_pattern.match(lines[i].strip())
+        user_match = ts_match and user_pattern.match(lines[i].strip()[ts_match.end():])
+        if not user_match:
+            i += 1
+            continue
+        j = i + 1
+        while j < len(lines) and not timestamp_pattern.match(lines[j].strip()):
+            j += 1
+        message = '\n'.join(lines[i + 1:j]).strip()
+        dt = datetime.strptime(ts_match.group(1), '%Y-%m-%d %H:%M:%S')
+        if prev_ts and (dt - prev_ts).total_seconds() > gap_minutes * 60 and cur:
+            blocks.append((None, None, cur))
+            cur = []
+        cur.append((user_match.group(2), user_match.group(1).strip(), message))
+        prev_ts = dt
+        i = j
+    if cur:
+        blocks.append((None, None, cur))
+    return blocks
+
+def load_compact(path, gap_minutes=30):
+    from chat_parser import iter_blocks
+    return list(iter_blocks(path, gap_minutes))
+
+def run_child(mode, path):
+    """子进程：加载全部对话块后报告峰值RSS（MB）和耗时"""
+    start = time.perf_counter()
+    blocks = load_legacy(path) if mode == 'legacy' else load_compact(path)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    count = sum(len(b[2]) for b in blocks)
+    print(f"{peak_mb:.1f} {elapsed:.2f} {count}")
+
+def main():
+    parser = argparse.ArgumentParser(description="比较旧的元组表示和 Message 模型的峰值内存")
+    parser.add_argument("--messages", type=int, default=1000000, help="模拟消息条数")
+    parser.add_argument("--file", help="直接使用已有的导出文件，不生成模拟数据")
+    parser.add_argument("--child", choices=["legacy", "compact"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.file)
+        return
+
+    path = args.file
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        os.close(fd)
+        print(f"🧪 生成 {args.messages:,} 条模拟消息...")
+        generate_export(path, args.messages)
+    print(f"📁 文件大小: {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+
+    try:
+        results = {}
+        for mode in ("legacy", "compact"):
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, "--file", path],
+                                 check=True, capture_output=True, text=True).stdout.split()
+            results[mode] = (float(out[0]), float(out[1]), int(out[2]))
+            print(f"  {mode:8s}: 峰值RSS {results[mode][0]:8.1f} MB, 耗时 {results[mode][1]:.2f} 秒, {results[mode][2]:,} 条消息")
+        print(f"\n📉 峰值内存降低为原来的 1/{results['legacy'][0] / results['compact'][0]:.1f}")
+    finally:
+        if args.file is None:
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
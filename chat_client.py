@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chat Completions 客户端
+- 同步和异步调用共用一个 keep-alive 连接池（openai_http.make_session），回复不用每次重新建立 TCP/TLS 连接
+- 每个请求有连接超时和读取超时；429、5xx 和连接错误按退避重试
+- 异步调用把阻塞的 HTTP 请求放进专用线程池，线程数等于连接池大小，同时在途的请求数也就不超过它；
+  可选的每分钟请求数限制把请求均匀排开，吞吐量随并发线性增长，直到速率上限
+- 记录最近的请求耗时，stats() 给出 p50/p95
+"""
+
+import asyncio, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from openai_http import OPENAI_API_BASE, make_session, request_with_retry
+
+DEFAULT_CONCURRENCY = 32
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+CHAT_RETRIES = 2
+LATENCY_WINDOW = 1000
+
+class RateLimiter:
+    """每分钟最多 per_minute 个请求：按固定间隔预约发送时刻，允许 burst 个请求同时发出
+
+    只在预约时短暂加锁，同步调用 time.sleep、异步调用 asyncio.sleep 等待，和事件循环无关
+    """
+
+    def __init__(self, per_minute, burst=1):
+        self.interval = 60 / per_minute
+        self.burst = burst
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """预约一个发送时刻，返回还要等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next_time, now - (self.burst - 1) * self.interval)
+            self.next_time = start + self.interval
+            return max(0.0, start - now)
+
+class ChatClient:
+    """共用连接池的 /chat/completions 客户端，complete() 同步调用，acomplete() 可以 await
+
+    返回 requests.Response（状态码由调用方检查）；重试用完后连接错误和超时照常抛出
+    """
+
+    def __init__(self, api_key, base_url=OPENAI_API_BASE, max_concurrency=DEFAULT_CONCURRENCY,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), requests_per_minute=None, retries=CHAT_RETRIES):
+        self.url = f"{base_url.rstrip('/')}/chat/completions"
+        self.session = make_session(api_key, max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="chat")
+        self.timeout = timeout
+        self.retries = retries
+        self.limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def _post(self, payload):
+        start = time.perf_counter()
+        response = request_with_retry(self.session, "POST", self.url, retries=self.retries,
+                                      json=payload, timeout=self.timeout)
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    def complete(self, payload):
+        if self.limiter:
+            time.sleep(self.limiter.reserve())
+        return self._post(payload)
+
+    async def acomplete(self, payload):
+        if self.limiter:
+            await asyncio.sleep(self.limiter.reserve())
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._post, payload)
+
+    def stats(self):
+        """最近 LATENCY_WINDOW 个请求的耗时（秒）：{"count", "p50", "p95"}"""
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {"count": 0, "p50": None, "p95": None}
+        pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+        return {"count": len(latencies), "p50": pick(0.5), "p95": pick(0.95)}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
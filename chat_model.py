@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+紧凑的消息模型（两个处理脚本共用）
+- Message 使用 __slots__，没有实例字典
+- 用户ID、用户名以及"[图片]"这类高频短消息在整个进程内只保存一份
+- 时间戳为整数秒
+"""
+
+# 短消息驻留的长度上限和条目上限，避免把大量一次性的短句也留在内存里
+SHORT_TEXT_LIMIT = 8
+SHORT_TEXT_MAX_ENTRIES = 200000
+
+_user_ids = {}
+_names = {}
+_short_texts = {}
+
+def intern_user_id(user_id):
+    return _user_ids.setdefault(user_id, user_id)
+
+def intern_name(name):
+    return _names.setdefault(name, name)
+
+def intern_text(text):
+    """短消息驻留：[图片]、[表情]、哈哈哈 之类的内容只保存一份"""
+    if len(text) > SHORT_TEXT_LIMIT:
+        return text
+    cached = _short_texts.get(text)
+    if cached is not None:
+        return cached
+    if len(_short_texts) < SHORT_TEXT_MAX_ENTRIES:
+        _short_texts[text] = text
+    return text
+
+class Message:
+    """一条聊天消息：发言者QQ号、发言时的名字、消息内容、整数秒时间戳"""
+
+    __slots__ = ('user_id', 'username', 'text', 'ts')
+
+    def __init__(self, user_id, username, text, ts):
+        self.user_id = intern_user_id(user_id)
+        self.username = intern_name(username)
+        self.text = intern_text(text)
+        self.ts = ts
+
+    @classmethod
+    def from_list(cls, values):
+        """从检查点等 JSON 数据中恢复: [user_id, username, text, ts]"""
+        return cls(*values)
+
+    def to_list(self):
+        return [self.user_id, self.username, self.text, self.ts]
+
+    def __reduce__(self):
+        # 多进程传输时重新走构造函数，在接收方进程里重新驻留
+        return Message, (self.user_id, self.username, self.text, self.ts)
+
+    def __eq__(self, other):
+        if not isinstance(other, Message):
+            return NotImplemented
+        return (self.ts == other.ts and self.user_id == other.user_id
+                and self.username == other.username and self.text == other.text)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Message({self.user_id!r}, {self.username!r}, {self.text!r}, {self.ts!r})"
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式聊天记录解析器
+- 逐行读取QQ导出文本，内存占用与文件大小无关
+- 每行只用预编译的正则分类一次
+- 时间间隔超过 gap_minutes 时立即产出 (群组, 对象, 消息列表) 对话块
+"""
+
+import io, mmap, os, re, time
+from concurrent.futures import ProcessPoolExecutor
+from chat_model import Message
+from datetime import date
+
+# 时间戳行：2024-05-18 21:00:24 发言者(ID)，小时可能只有一位
+TIMESTAMP_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2}) (\d{1,2}):(\d{2}):(\d{2})\s+')
+SPEAKER_RE = re.compile(r'(.+?)\((\d+)\)\s*$')
+
+GROUP_PREFIX = '消息分组:'
+CHAT_PREFIX = '消息对象:'
+SEPARATOR_PREFIX = '===='
+SYSTEM_PREFIX = '系统消息'
+BREAK_PREFIXES = (GROUP_PREFIX, CHAT_PREFIX, SEPARATOR_PREFIX, SYSTEM_PREFIX)
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_day_cache = {}
+
+def parse_timestamp(match):
+    """把时间戳匹配结果转换为整数秒（按本地时间当作UTC计算），非法日期返回None"""
+    year, month, day, hour, minute, second = match.groups()
+    key = (year, month, day)
+    base = _day_cache.get(key)
+    if base is None:
+        try:
+            base = (date(int(year), int(month), int(day)).toordinal() - _EPOCH_ORDINAL) * 86400
+        except ValueError:
+            return None
+        _day_cache[key] = base
+    hour, minute, second = int(hour), int(minute), int(second)
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+    return base + hour * 3600 + minute * 60 + second
+
+def iter_blocks(path, gap_minutes=30, stats=None):
+    """逐行解析聊天记录，按时间间隔产出 (group, chat, messages) 对话块
+
+    messages 是 chat_model.Message 列表。
+    遇到新的消息分组/消息对象时，当前对话块会立即结束。
+    如果传入 stats 字典，解析结束后会写入行数、消息数和耗时。
+    """
+    counters = {}
+    start = time.perf_counter()
+    with open(path, encoding='utf-8') as f:
+        yield from parse_lines(f, gap_minutes, counters)
+    if stats is not None:
+        stats.update(counters)
+        _add_throughput(stats, time.perf_counter() - start)
+
+def parse_lines(lines, gap_minutes=30, counters=None, state=None):
+    """解析状态机：逐行分类并产出对话块
+
+    结束时把计数、最后的分组/对象以及收尾前的解析状态写入 counters；
+    传入 state（上次的 counters["state"]）可以从上次结束的位置继续解析。
+    """
+    if counters is None:
+        counters = {}
+    gap_seconds = gap_minutes * 60
+    current_group = None
+    current_chat = None
+    cur = []
+    prev_ts = None
+    pending = None  # 正在读取内容的消息: (ts, user_id, username, 内容行)
+    if state is not None:
+        current_group, current_chat = state["group"], state["chat"]
+        cur = [Message.from_list(m) for m in state["open_block"]]
+        prev_ts = state["prev_ts"]
+        if state["pending"] is not None:
+            ts, user_id, username, content = state["pending"]
+            pending = (ts, user_id, username, list(content))
+    line_count = message_count = block_count = 0
+
+    def finish(pending):
+        """把读取完的消息加入当前对话块，间隔过大时返回被关闭的旧对话块"""
+        nonlocal cur, prev_ts, message_count
+        ts, user_id, username, content = pending
+        if ts is None:  # 非法时间戳，丢弃整条消息
+            return None
+        closed = None
+        if prev_ts is not None and ts - prev_ts > gap_seconds and cur:
+            closed, cur = cur, []
+        cur.append(Message(user_id, username, '\n'.join(content).strip(), ts))
+        prev_ts = ts
+        message_count += 1
+        return closed
+
+    for raw in lines:
+        line_count += 1
+        line = raw.strip()
+
+        ts_match = TIMESTAMP_RE.match(line)
+        if ts_match is None and not line.startswith(BREAK_PREFIXES):
+            # 普通行：属于正在读取的消息内容（包括空行），否则忽略
+            if pending is not None:
+                pending[3].append(raw.rstrip())
+            continue
+
+        # 时间戳行、分组/对象标识、分隔线和系统消息行都会结束上一条消息
+        if pending is not None:
+            closed, pending = finish(pending), None
+            if closed:
+                yield current_group, current_chat, closed
+                block_count += 1
+
+        if ts_match is None:
+            if line.startswith(GROUP_PREFIX) or line.startswith(CHAT_PREFIX):
+                # 新的分组/对象：当前对话块立即结束
+                if cur:
+                    yield current_group, current_chat, cur
+                    block_count += 1
+                    cur = []
+                prev_ts = None
+                if line.startswith(GROUP_PREFIX):
+                    current_group = line[len(GROUP_PREFIX):]
+                else:
+                    current_chat = line[len(CHAT_PREFIX):]
+            continue
+
+        if '消息记录' in line:
+            continue
+        speaker = SPEAKER_RE.match(line, ts_match.end())
+        if speaker:
+            pending = (parse_timestamp(ts_match), speaker.group(2), speaker.group(1).strip(), [])
+
+    # 收尾前的状态：文件后续追加内容时可以从这里继续
+    end_state = {
+        "group": current_group,
+        "chat": current_chat,
+        "prev_ts": prev_ts,
+        "open_block": [m.to_list() for m in cur],
+        "pending": pending,
+    }
+    if pending is not None:
+        closed = finish(pending)
+        if closed:
+            yield current_group, current_chat, closed
+            block_count += 1
+    if cur:
+        yield current_group, current_chat, cur
+        block_count += 1
+
+    counters.update({
+        "lines": line_count,
+        "messages": message_count,
+        "blocks": block_count,
+        "group": current_group,
+        "chat": current_chat,
+        "last_ts": prev_ts,
+        "state": end_state,
+    })
+
+def _add_throughput(stats, elapsed):
+    stats["elapsed"] = elapsed
+    stats["lines_per_sec"] = stats["lines"] / elapsed if elapsed > 0 else float('inf')
+
+# ---------------- 多进程并行解析 ----------------
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024  # 每个分片约8MB，小文件不会被切分
+_NEWLINES_RE = re.compile(r'\r\n|\r|\n')
+
+def _classify_for_split(line):
+    """切分扫描用的行分类：返回 ('header', None)、('message', ts) 或 (None, None)"""
+    line = line.strip()
+    if line.startswith(GROUP_PREFIX) or line.startswith(CHAT_PREFIX):
+        return 'header', None
+    ts_match = TIMESTAMP_RE.match(line)
+    if ts_match is None or '消息记录' in line or not SPEAKER_RE.match(line, ts_match.end()):
+        return None, None
+    ts = parse_timestamp(ts_match)
+    return ('message', ts) if ts is not None else (None, None)
+
+def _next_split(mm, pos, gap_seconds):
+    """从 pos 之后的第一个行首开始扫描，返回下一个安全切分点的字节偏移，找不到返回None
+
+    安全切分点是分组/对象标识行，或者与上一条有效消息间隔超过 gap 的时间戳行：
+    串行解析在这两种位置都会关闭当前对话块，所以两边可以独立解析。
+    """
+    size = len(mm)
+    if pos > 0:
+        nl = mm.find(b'\n', pos - 1)
+        if nl < 0:
+            return None
+        pos = nl + 1
+    last_ts = None
+    while pos < size:
+        end = mm.find(b'\n', pos)
+        end = size if end < 0 else end + 1
+        # 与文本模式读取保持一致：单独的 \r 也算换行
+        parts = _NEWLINES_RE.split(mm[pos:end].decode('utf-8', errors='replace'))
+        for k, part in enumerate(parts):
+            kind, ts = _classify_for_split(part)
+            if kind == 'header':
+                if k == 0:
+                    return pos
+                last_ts = None
+            elif kind == 'message':
+                if k == 0 and last_ts is not None and ts - last_ts > gap_seconds:
+                    return pos
+                last_ts = ts
+        pos = end
+    return None
+
+def find_split_points(mm, gap_minutes=30, chunk_size=DEFAULT_CHUNK_SIZE):
+    """在内存映射的文件中寻找切分点，返回 [0, ..., 文件大小] 的偏移列表"""
+    size = len(mm)
+    points = [0]
+    while points[-1] + chunk_size < size:
+        pos = _next_split(mm, points[-1] + chunk_size, gap_minutes * 60)
+        if pos is None:
+            break
+        points.append(pos)
+    points.append(size)
+    return points
+
+def _parse_chunk(task):
+    """工作进程：解析文件的一个字节区间"""
+    path, start, end, gap_minutes = task
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+    counters = {}
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8')
+    blocks = list(parse_lines(lines, gap_minutes, counters))
+    return blocks, counters
+
+def load_blocks_parallel(path, gap_minutes=30, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, stats=None):
+    """多进程并行解析聊天记录，结果与 iter_blocks 串行解析完全一致
+
+    文件先做内存映射并在安全位置切分，各分片在进程池中独立解析，
+    最后按文件顺序合并。分片里出现在第一个分组/对象标识之前的对话块
+    沿用上一个分片结束时的分组/对象。
+    """
+    start_time = time.perf_counter()
+    if os.path.getsize(path) == 0:
+        points = [0, 0]
+    else:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            points = find_split_points(mm, gap_minutes, chunk_size)
+
+    tasks = [(path, points[k], points[k + 1], gap_minutes) for k in range(len(points) - 1)]
+    if len(tasks) == 1:
+        results = [_parse_chunk(tasks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_parse_chunk, tasks))
+
+    blocks = []
+    group = chat = None
+    totals = {"lines": 0, "messages": 0, "blocks": 0}
+    for chunk_blocks, counters in results:
+        for g, c, messages in chunk_blocks:
+            blocks.append((group if g is None else g, chat if c is None else c, messages))
+        if counters["group"] is not None:
+            group = counters["group"]
+        if counters["chat"] is not None:
+            chat = counters["chat"]
+        for key in totals:
+            totals[key] += counters[key]
+
+    if stats is not None:
+        stats.update(totals, group=group, chat=chat, chunks=len(tasks))
+        _add_throughput(stats, time.perf_counter() - start_time)
+    return blocks
+
+def format_throughput(stats):
+    """格式化解析速度信息"""
+    return (f"解析速度: {stats['lines_per_sec']:,.0f} 行/秒 "
+            f"({stats['lines']:,} 行, {stats['messages']:,} 条消息, {stats['elapsed']:.2f} 秒)")
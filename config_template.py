@@ -8,6 +8,14 @@ DEFAULT_MODEL = "gpt-3.5-turbo"
 DEFAULT_EPOCHS = 3
 MAX_TOKENS = 50
 
+# API 地址（可选）：本地测试时改为 mock_openai.py 启动的模拟服务器，例如 "http://127.0.0.1:8000/v1"
+OPENAI_API_BASE = "https://api.openai.com/v1"
+
+# 回复缓存（可选，默认关闭）：开启后 model_test.py 把回复存进 .response_cache.db，同样的上下文不重复调用 API；
+# 每个上下文先攒 CHAT_CACHE_SAMPLES 条不同的回复，之后从中随机复用
+CHAT_CACHE = False
+CHAT_CACHE_SAMPLES = 3
+
 # 使用说明：
 # 1. 将此文件复制为 config.py
 # 2. 将 OPENAI_API_KEY 替换为您的实际API密钥
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+滑动窗口上下文构建
+- 每条消息进入窗口时只格式化一次 "名字: 内容"
+- 窗口里保留格式化好的行和对话对象计数，移动窗口时增量更新
+- 每个样本直接拼接缓存的行，窗口开到20~50条时开销和 window=3 基本相同
+- 可选 token 预算：每行的 token 数在进入窗口时算一次，窗口从最新的行往前装，超出预算时移出最旧的行
+"""
+
+from collections import deque
+
+HISTORY_PREFIX = "对话历史:\n"
+REPLY_SUFFIX_TEMPLATE = "\n\n请以{name}的身份回复："
+REPLY_SUFFIX = REPLY_SUFFIX_TEMPLATE.format(name="雷🐷🐷")
+
+def reply_suffix(name):
+    return REPLY_SUFFIX_TEMPLATE.format(name=name)
+
+class ContextWindow:
+    """一个对话块内最近 window 条消息的上下文
+
+    format_line(msg) 返回这条消息在上下文中的一行，返回 None 表示不显示；
+    partner_of(msg) 返回对话对象的键（例如 (QQ号, 名字)），返回 None 表示不算对话对象。
+    window 为 None 时不限条数；token_budget 限制窗口内各行 token 数之和（不含换行和前后缀），
+    此时需要提供 count_tokens(line)。
+    """
+
+    def __init__(self, window, format_line, partner_of, token_budget=None, count_tokens=None):
+        self.window = window if window is not None else float('inf')
+        self.format_line = format_line
+        self.partner_of = partner_of
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self.lines = deque()
+        self._line_index = deque()
+        self._line_tokens = deque()
+        self.tokens = 0  # 窗口内各行的 token 数之和（只在有预算时统计）
+        self._budget_floor = -1  # 因超出预算被移出的最新一条消息的序号
+        self._partner_keys = deque()  # (消息序号, 对话对象键)
+        self._partners = {}  # 对话对象键 -> 窗口内出现次数，按首次出现排序
+        self._count = 0
+
+    def push(self, msg):
+        """把下一条消息放进窗口，超出 window 条或 token 预算的旧消息移出"""
+        index = self._count
+        self._count += 1
+        budget = self.token_budget
+        line = self.format_line(msg)
+        if line is not None:
+            self.lines.append(line)
+            self._line_index.append(index)
+            if budget is not None:
+                tokens = self.count_tokens(line)
+                self._line_tokens.append(tokens)
+                self.tokens += tokens
+        key = self.partner_of(msg)
+        if key is not None:
+            self._partner_keys.append((index, key))
+            self._partners[key] = self._partners.get(key, 0) + 1
+
+        oldest = self._count - self.window
+        while self._line_index and self._line_index[0] < oldest:
+            self._pop_line()
+        if budget is not None and self.tokens > budget:
+            while self.tokens > budget:
+                self._budget_floor = self._pop_line()
+            # 对话对象和显示的行保持同一个范围
+            oldest = max(oldest, self._budget_floor + 1)
+        while self._partner_keys and self._partner_keys[0][0] < oldest:
+            _, key = self._partner_keys.popleft()
+            if self._partners[key] == 1:
+                del self._partners[key]
+            else:
+                self._partners[key] -= 1
+
+    def _pop_line(self):
+        """移出最旧的一行，返回它的消息序号"""
+        self.lines.popleft()
+        if self.token_budget is not None:
+            self.tokens -= self._line_tokens.popleft()
+        return self._line_index.popleft()
+
+    def hit_budget(self):
+        """当前窗口是否因为 token 预算少装了消息（不限预算时本来还能放进窗口）"""
+        return self._budget_floor >= 0 and self._budget_floor >= self._count - self.window
+
+    def partners(self):
+        """窗口内的对话对象"""
+        return list(self._partners)
+
+    def user_content(self, suffix=REPLY_SUFFIX):
+        """拼好的 user 消息；窗口里没有可显示的行时返回 None"""
+        if not self.lines:
+            return None
+        return HISTORY_PREFIX + "\n".join(self.lines) + suffix
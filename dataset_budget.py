@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按预算挑选微调样本
+- 给定 token 或美元预算和训练轮数，在上传之前挑出装得进预算的样本子集，控制微调的时间和费用
+- 按 (群组, 对话对象) 分层：第一遍流式统计每层的 token 总量，按平方根比例分配预算
+  （小的层也能分到份额），用不完份额的层把剩余预算让给其他层
+- 层内是加权优先级抽样（A-Res，键 log(u)/w）：信息量越高的样本越容易被选中；
+  u 由这一行的内容哈希得到，同样的输入总是选出同样的子集
+- 信息量：回复里不同短语的个数，除以这条回复出现次数的平方根（Space-Saving 估计），
+  "[图片]" 这类高频回复权重很低
+- 每层一个最小堆，超出份额时弹出键最小的样本；内存里只保留选中样本的 (键, 偏移, token 数, 层)，
+  最后按原来的顺序把选中的行复制到输出文件
+"""
+
+import argparse, hashlib, heapq, json, math, os, re
+from context_builder import HISTORY_PREFIX
+from phrases import SpaceSaving, phrases
+from token_counter import (CachedTokenCounter, estimate_training_cost, DEFAULT_MODEL,
+                           TRAINING_COST_PER_1K_TOKENS, MIN_SAMPLES, MAX_SAMPLES)
+
+DEFAULT_EPOCHS = 3
+REPLY_SKETCH_CAPACITY = 1000
+GROUP_RE = re.compile(r"你在群组'(.*)'中聊天")
+SPEAKER_RE = re.compile(r"^([^:\n]{1,40}): ")
+PERSONA_RE = re.compile(r"请以(.+)的身份回复：$")
+
+def budget_tokens(tokens=None, usd=None, epochs=DEFAULT_EPOCHS):
+    """文件的 token 上限：tokens 和按 usd / 轮数换算出的 token 数取较小的一个"""
+    limits = []
+    if tokens is not None:
+        limits.append(tokens)
+    if usd is not None:
+        limits.append(int(usd / TRAINING_COST_PER_1K_TOKENS * 1000 / epochs))
+    if not limits:
+        raise ValueError("需要指定 token 预算或美元预算")
+    return min(limits)
+
+def sample_stratum(messages):
+    """样本所在的层 (群组, 对话对象)
+
+    群组来自系统消息（统一版没有群组，为 None）；对话对象是上下文里最后一个不是目标用户自己的发言者
+    """
+    group = partner = None
+    for message in messages:
+        content = message.get('content') or ''
+        if message.get('role') == 'system':
+            match = GROUP_RE.search(content)
+            if match:
+                group = match.group(1)
+        elif message.get('role') == 'user' and content.startswith(HISTORY_PREFIX):
+            persona = PERSONA_RE.search(content)
+            persona = persona.group(1) if persona else None
+            for line in reversed(content[len(HISTORY_PREFIX):].split('\n')):
+                match = SPEAKER_RE.match(line)
+                if match and match.group(1) != persona:
+                    partner = match.group(1)
+                    break
+    return group, partner
+
+def reply_text(messages):
+    return '\n'.join(message.get('content') or '' for message in messages if message.get('role') == 'assistant')
+
+def priority(line, weight):
+    """A-Res 优先级键 log(u)/w，u 是这一行内容哈希得到的 (0, 1) 均匀数"""
+    h = int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'big')
+    return math.log((h + 1) / (2 ** 64 + 1)) / weight
+
+def _iter_samples(path):
+    """流式读取 JSONL：(偏移, 原始行, messages)，跳过空行和无法解析的行"""
+    with open(path, 'rb') as f:
+        offset = 0
+        for line in f:
+            start, offset = offset, offset + len(line)
+            if not line.strip():
+                continue
+            try:
+                sample = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            messages = sample.get('messages') if isinstance(sample, dict) else None
+            if messages:
+                yield start, line, messages
+
+def allocate(totals, budget):
+    """按平方根比例分配预算 {层: token 上限}：份额 = min(层总量, λ·√层总量)，λ 使份额之和等于预算"""
+    if sum(totals.values()) <= budget:
+        return dict(totals)
+    # 按 √总量 从小到大，依次判断是否整层装得下（装得下的层份额就是它的总量）
+    remaining, weight = budget, sum(math.sqrt(t) for t in totals.values())
+    quotas = {}
+    for stratum, total in sorted(totals.items(), key=lambda x: x[1]):
+        root = math.sqrt(total)
+        if total > remaining * root / weight:
+            break
+        quotas[stratum] = total
+        remaining -= total
+        weight -= root
+    for stratum, total in totals.items():
+        if stratum not in quotas:
+            quotas[stratum] = remaining * math.sqrt(total) / weight
+    return quotas
+
+def select_within_budget(path, output=None, tokens=None, usd=None, epochs=DEFAULT_EPOCHS,
+                         max_samples=MAX_SAMPLES, model=DEFAULT_MODEL):
+    """从 JSONL 中挑出装得进预算的样本写到 output（默认 <文件名>.budget.jsonl），返回统计字典"""
+    budget = budget_tokens(tokens, usd, epochs)
+    count_tokens = CachedTokenCounter(model)
+    output = output or '{0}.budget{1}'.format(*os.path.splitext(path))
+
+    def sample_tokens(messages):
+        return sum(count_tokens(message.get('content') or '') for message in messages)
+
+    # 第一遍：每层的 token 总量和回复出现次数（有界的频繁项摘要）
+    totals, sizes = {}, {}
+    replies = SpaceSaving(REPLY_SKETCH_CAPACITY)
+    for _, _, messages in _iter_samples(path):
+        stratum = sample_stratum(messages)
+        totals[stratum] = totals.get(stratum, 0) + sample_tokens(messages)
+        sizes[stratum] = sizes.get(stratum, 0) + 1
+        replies.add(reply_text(messages))
+    quotas = allocate(totals, budget)
+
+    # 第二遍：层内加权优先级抽样，超出份额时弹出优先级最低的样本
+    heaps = {stratum: [] for stratum in totals}
+    used = dict.fromkeys(totals, 0)
+    for offset, line, messages in _iter_samples(path):
+        stratum = sample_stratum(messages)
+        reply = reply_text(messages)
+        weight = (len(phrases(reply)) + 1) / math.sqrt(replies.counts.get(reply, 1))
+        n_tokens = sample_tokens(messages)
+        heap = heaps[stratum]
+        heapq.heappush(heap, (priority(line, weight), offset, n_tokens, stratum))
+        used[stratum] += n_tokens
+        while used[stratum] > quotas[stratum]:
+            used[stratum] -= heapq.heappop(heap)[2]
+
+    selected = [item for heap in heaps.values() for item in heap]
+    if len(selected) > max_samples:
+        selected = heapq.nlargest(max_samples, selected, key=lambda item: item[0])
+    selected.sort(key=lambda item: item[1])
+
+    # 第三遍：按原顺序复制选中的行
+    with open(path, 'rb') as fin, open(output, 'wb') as fout:
+        for _, offset, _, _ in selected:
+            fin.seek(offset)
+            fout.write(fin.readline())
+
+    chosen = dict.fromkeys(totals, 0)
+    for item in selected:
+        chosen[item[3]] += 1
+    total_tokens = sum(item[2] for item in selected)
+    return {
+        "output": output,
+        "budget_tokens": budget,
+        "input_samples": sum(sizes.values()),
+        "input_tokens": sum(totals.values()),
+        "samples": len(selected),
+        "tokens": total_tokens,
+        "cost": estimate_training_cost(total_tokens, epochs),
+        "strata": {stratum: (chosen[stratum], sizes[stratum]) for stratum in totals},
+    }
+
+def stratum_label(stratum):
+    group, partner = stratum
+    return f"{group or '-'} / {partner or '（无对话对象）'}"
+
+def print_report(report, epochs=DEFAULT_EPOCHS):
+    print(f"📦 预算 {report['budget_tokens']:,} tokens（{epochs} 轮）: "
+          f"从 {report['input_samples']:,} 个样本（{report['input_tokens']:,} tokens）中选出 "
+          f"{report['samples']:,} 个样本（{report['tokens']:,} tokens）")
+    print(f"💰 估算训练成本: ${report['cost']:.2f} USD")
+    strata = sorted(report["strata"].items(), key=lambda x: -x[1][1])
+    print(f"分层（共 {len(strata)} 层，选中/总数）:")
+    for stratum, (chosen, size) in strata[:10]:
+        print(f"  - {stratum_label(stratum)}: {chosen}/{size}")
+    if report["samples"] < MIN_SAMPLES:
+        print(f"❌ 样本数量不足！OpenAI要求至少{MIN_SAMPLES}个训练样本，请提高预算")
+    print(f"✅ 已写入 {report['output']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按 token / 美元预算挑选微调样本")
+    parser.add_argument("filename", nargs="?", default="deepseek_data_final.jsonl", help="训练数据 JSONL（默认 deepseek_data_final.jsonl）")
+    parser.add_argument("--output", help="输出文件（默认 <文件名>.budget.jsonl）")
+    parser.add_argument("--tokens", type=int, help="训练文件的 token 上限")
+    parser.add_argument("--usd", type=float, help="训练费用上限（美元），按轮数换算成 token 上限")
+    parser.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS, help=f"训练轮数（默认{DEFAULT_EPOCHS}）")
+    parser.add_argument("--max-samples", type=int, default=MAX_SAMPLES, help=f"最多保留的样本数（默认{MAX_SAMPLES}）")
+    args = parser.parse_args()
+    if args.tokens is None and args.usd is None:
+        parser.error("需要指定 --tokens 或 --usd")
+
+    report = select_within_budget(args.filename, args.output, args.tokens, args.usd, args.epochs, args.max_samples)
+    print_report(report, args.epochs)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传前的训练数据检查
+- 在本地发现格式问题，不用等上传、排队之后才被 OpenAI 拒绝
+- 逐样本检查：UTF-8 编码、JSON 格式、messages 结构、角色（system 只能在开头，之后 user/assistant 交替，
+  以 assistant 结尾——只有 system+assistant 的样本就是缺了 user）、空内容、token 数上限、重复样本
+- 和 token_counter 一样按行切成分段交给进程池，复用它的编码器和 token 缓存；
+  每个分段返回有效样本的原始行，主进程按顺序去重（规范化 JSON 的哈希）并写出清理后的文件
+- 输出机器可读的报告（<文件名>.validation.json）和只包含有效样本的 <文件名>.clean.jsonl
+"""
+
+import argparse, glob, hashlib, json, os, time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import token_counter
+from token_counter import (split_points, distribution, format_distribution, DEFAULT_CHUNK_SIZE,
+                           DEFAULT_MAX_TOKENS, DEFAULT_MODEL, TOKEN_CACHE_FILE, MIN_SAMPLES)
+
+ROLES = ("system", "user", "assistant")
+EXAMPLES_PER_ISSUE = 5
+# 问题代码 -> 说明
+ISSUES = {
+    "invalid_utf8": "不是有效的 UTF-8",
+    "invalid_json": "JSON 解析失败",
+    "missing_messages": "没有 messages 列表或列表为空",
+    "bad_message": "消息不是对象、角色未知或 content 不是字符串",
+    "empty_content": "消息内容为空",
+    "role_order": "角色顺序错误（system 不在开头，或 user/assistant 没有交替）",
+    "no_user": "没有 user 消息",
+    "no_assistant": "没有 assistant 消息",
+    "last_not_assistant": "最后一条不是 assistant 消息",
+    "too_long": "token 数超过上限",
+    "duplicate": "和前面的样本重复",
+}
+
+def check_messages(messages):
+    """样本结构检查，返回问题代码列表（空列表表示没有问题）"""
+    if not isinstance(messages, list) or not messages:
+        return ["missing_messages"]
+    issues = []
+    if any(not isinstance(m, dict) or m.get("role") not in ROLES or not isinstance(m.get("content"), str)
+           for m in messages):
+        return ["bad_message"]
+    if any(not m["content"].strip() for m in messages):
+        issues.append("empty_content")
+    roles = [m["role"] for m in messages]
+    dialog = roles[1:] if roles[0] == "system" else roles
+    if "user" not in dialog:
+        issues.append("no_user")
+    if "assistant" not in dialog:
+        issues.append("no_assistant")
+    elif dialog[-1] != "assistant":
+        issues.append("last_not_assistant")
+    if "system" in dialog or (dialog and dialog[0] != "user" and "user" in dialog) \
+            or any(a == b for a, b in zip(dialog, dialog[1:])):
+        issues.append("role_order")
+    return issues
+
+def canonical_digest(sample):
+    """规范化 JSON（键排序、紧凑）的哈希，只差空白或键顺序的行也算重复"""
+    text = json.dumps(sample, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+def _validate_chunk(task):
+    """工作进程：检查文件一个字节区间内的样本
+
+    返回 lines（行数）、blank（空行数）、issues [(段内行号, [问题代码])]、
+    valid [(段内行号, 哈希, token 数, 原始行)]
+    """
+    path, start, end, max_tokens = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = data.split(b'\n')
+    if lines and not lines[-1]:
+        lines.pop()
+
+    blank = 0
+    issues, candidates = [], []
+    texts, owners = [], []
+    for line_num, line in enumerate(lines, 1):
+        if not line.strip():
+            blank += 1
+            continue
+        try:
+            sample = json.loads(line.decode('utf-8'))
+        except UnicodeDecodeError:
+            issues.append((line_num, ["invalid_utf8"]))
+            continue
+        except json.JSONDecodeError:
+            issues.append((line_num, ["invalid_json"]))
+            continue
+        problems = check_messages(sample.get("messages") if isinstance(sample, dict) else None)
+        if problems:
+            issues.append((line_num, problems))
+            continue
+        for message in sample["messages"]:
+            texts.append(message["content"])
+            owners.append(len(candidates))
+        candidates.append((line_num, canonical_digest(sample), line))
+
+    # 通过结构检查的样本一起编码（复用 token_counter 的缓存）
+    per_sample = [0] * len(candidates)
+    for owner, tokens in zip(owners, token_counter._cache.counts(token_counter._encoding, texts)):
+        per_sample[owner] += tokens
+    valid = []
+    for (line_num, digest, line), tokens in zip(candidates, per_sample):
+        if tokens > max_tokens:
+            issues.append((line_num, ["too_long"]))
+        else:
+            valid.append((line_num, digest, tokens, line))
+    issues.sort()
+    return {"lines": len(lines), "blank": blank, "issues": issues, "valid": valid}
+
+def validate_dataset(path, output=None, report_path=None, max_tokens=DEFAULT_MAX_TOKENS, workers=1,
+                     chunk_size=DEFAULT_CHUNK_SIZE, model=DEFAULT_MODEL, cache_path=TOKEN_CACHE_FILE):
+    """检查 JSONL 训练数据，写出清理后的文件和 JSON 报告，返回报告字典
+
+    output 默认 <文件名>.clean.jsonl，report_path 默认 <文件名>.validation.json；
+    workers 为 1 时在本进程逐段检查，否则交给进程池（None 为全部CPU核心）
+    """
+    stem, ext = os.path.splitext(path)
+    output = output or f"{stem}.clean{ext}"
+    report_path = report_path or f"{stem}.validation.json"
+    start_time = time.perf_counter()
+
+    points = split_points(path, chunk_size)
+    tasks = [(path, points[k], points[k + 1], max_tokens) for k in range(len(points) - 1)]
+    if workers == 1 or len(tasks) <= 1:
+        token_counter._init_worker(model, cache_path)
+        results, pool = map(_validate_chunk, tasks), None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=token_counter._init_worker,
+                                   initargs=(model, cache_path))
+        results = pool.map(_validate_chunk, tasks)
+
+    lines = blank = 0
+    issue_counts, examples = Counter(), {}
+    seen = set()
+    sample_tokens = Counter()
+    try:
+        with open(output, 'wb') as fout:
+            for result in results:
+                found = [(lines + line_num, codes) for line_num, codes in result["issues"]]
+                for line_num, digest, tokens, line in result["valid"]:
+                    if digest in seen:
+                        found.append((lines + line_num, ["duplicate"]))
+                        continue
+                    seen.add(digest)
+                    sample_tokens[tokens] += 1
+                    fout.write(line.rstrip(b'\r') + b'\n')
+                for line_num, codes in sorted(found):
+                    for code in codes:
+                        issue_counts[code] += 1
+                        if len(examples.setdefault(code, [])) < EXAMPLES_PER_ISSUE:
+                            examples[code].append(line_num)
+                lines += result["lines"]
+                blank += result["blank"]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        elif token_counter._cache is not None:
+            token_counter._cache.flush()
+
+    valid = sum(sample_tokens.values())
+    samples = lines - blank
+    report = {
+        "file": path,
+        "output": output,
+        "max_tokens": max_tokens,
+        "lines": lines,
+        "samples": samples,
+        "valid": valid,
+        "dropped": samples - valid,
+        "issues": dict(issue_counts.most_common()),
+        "examples": examples,
+        "tokens": sum(t * c for t, c in sample_tokens.items()),
+        "sample_tokens": distribution(sample_tokens) if sample_tokens else None,
+        "ok": valid >= MIN_SAMPLES,
+        "elapsed": round(time.perf_counter() - start_time, 3),
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    report["report"] = report_path
+    return report
+
+def print_report(report):
+    print(f"🔍 {report['file']}: {report['samples']:,} 个样本，有效 {report['valid']:,}，"
+          f"丢弃 {report['dropped']:,}（{report['elapsed']:.2f} 秒）")
+    for code, count in report["issues"].items():
+        lines = ', '.join(map(str, report["examples"][code]))
+        print(f"  ⚠️ {ISSUES[code]}: {count:,}（第 {lines} 行{' 等' if count > len(report['examples'][code]) else ''}）")
+    if report["sample_tokens"]:
+        print(f"  📐 每个样本: {format_distribution(report['sample_tokens'])}")
+    if report["ok"]:
+        print(f"✅ 已写入 {report['output']}，报告 {report['report']}")
+    else:
+        print(f"❌ 有效样本不足！OpenAI要求至少{MIN_SAMPLES}个训练样本（报告 {report['report']}）")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上传前检查微调训练数据，输出报告和清理后的文件")
+    parser.add_argument("filenames", nargs="*", help="JSONL 文件（默认当前目录的 deepseek_data_*.jsonl）")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS, help=f"单个样本的 token 上限（默认{DEFAULT_MAX_TOKENS}）")
+    parser.add_argument("--workers", type=int, default=1, help="并行检查的进程数（默认1为单进程，0为全部CPU核心）")
+    parser.add_argument("--no-cache", action="store_true", help=f"不读写磁盘上的 token 数缓存（{TOKEN_CACHE_FILE}）")
+    args = parser.parse_args()
+
+    filenames = args.filenames or sorted(name for name in glob.glob("deepseek_data_*.jsonl")
+                                         if not name.endswith((".clean.jsonl", ".budget.jsonl")))
+    if not filenames:
+        print("❌ 没有找到 deepseek_data_*.jsonl")
+        exit(1)
+    reports = []
+    for filename in filenames:
+        report = validate_dataset(filename, max_tokens=args.max_tokens, workers=args.workers or None,
+                                  cache_path=None if args.no_cache else TOKEN_CACHE_FILE)
+        print_report(report)
+        reports.append(report)
+    if not all(report["ok"] for report in reports):
+        exit(1)
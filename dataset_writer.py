@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式分片数据集写入
+- 对话块按批交给进程池：子进程生成样本、序列化、压缩，主进程只按顺序把字节写进分片
+- 内存里同时只有几批样本，和数据集大小无关
+- 输出按大小切成多个分片（可选 gzip / zstd 压缩），清单文件记录每个分片的路径、样本数和大小
+- 按样本内容哈希确定性地划分训练集/验证集，重跑或增量追加时同一个样本总是落在同一边
+- 可选近似去重：子进程计算 MinHash 签名，主进程按顺序判断去留后再压缩写出
+- 可选聊天模式累计量：子进程把互动记录汇总成 PatternAggregates，主进程只合并汇总结果
+"""
+
+import gzip, hashlib, io, json, os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+COMPRESSION_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+MANIFEST_SUFFIX = '.manifest.json'
+SPLITS = ('train', 'val')
+DEFAULT_BATCH_BLOCKS = 64
+
+def split_of(line, val_ratio):
+    """按序列化后的样本内容哈希决定它属于 train 还是 val"""
+    if val_ratio <= 0:
+        return 'train'
+    value = int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), 'big')
+    return 'val' if value < val_ratio * 2 ** 64 else 'train'
+
+def compress(data, compression):
+    """压缩一批数据；gzip 成员和 zstd 帧首尾相接仍然是合法的压缩流"""
+    if compression is None:
+        return data
+    if compression == 'gzip':
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0) as f:
+            f.write(data)
+        return buf.getvalue()
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("使用 zstd 压缩需要安装 zstandard: pip install zstandard")
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"不支持的压缩方式: {compression}")
+
+def serialize(sample):
+    # 只保存训练需要的字段，使用messages格式
+    return (json.dumps({"messages": sample["messages"]}, ensure_ascii=False) + '\n').encode('utf-8')
+
+def encode_lines(serialized, val_ratio=0.0, compression=None):
+    """把序列化好的样本按 train/val 分开压缩
+
+    返回 {split: (压缩后的字节, 样本数, 未压缩字节数)}
+    """
+    lines = {split: [] for split in SPLITS}
+    for line in serialized:
+        lines[split_of(line, val_ratio)].append(line)
+    encoded = {}
+    for split, split_lines in lines.items():
+        if split_lines:
+            data = b''.join(split_lines)
+            encoded[split] = (compress(data, compression), len(split_lines), len(data))
+    return encoded
+
+def encode_samples(samples, val_ratio=0.0, compression=None):
+    return encode_lines((serialize(sample) for sample in samples), val_ratio, compression)
+
+def _encode_batch(task):
+    """子进程：一批对话块 -> 压缩好的分片数据、互动记录（或其累计量）、统计
+
+    需要去重时不压缩，返回 [(序列化的样本, 签名, band 键, messages)]，由主进程判断去留
+    """
+    make_samples, blocks, skip, kwargs, val_ratio, compression, hasher, aggregate = task
+    stats = {}
+    samples, interactions = make_samples(blocks, skip=skip, stats=stats, **kwargs)
+    if aggregate:
+        from pattern_stats import PatternAggregates
+        interactions = PatternAggregates().update(interactions)
+    else:
+        # 互动记录里的上下文不参与聊天模式分析，不传回主进程
+        interactions = {friend: [{k: v for k, v in inter.items() if k != "context"} for inter in items]
+                        for friend, items in interactions.items()}
+    first = samples[0] if samples else None
+    if hasher is not None:
+        from dedupe import sample_text
+        encoded = [(serialize(sample),) + hasher.signature(sample_text(sample)) + (sample["messages"],)
+                   for sample in samples]
+    else:
+        encoded = encode_samples(samples, val_ratio, compression)
+    return encoded, interactions, stats, first
+
+class ShardedWriter:
+    """按大小切分的 JSONL 分片写入器，结束时写清单 <stem>.manifest.json
+
+    max_shard_bytes 按写到磁盘上的（压缩后）字节数计算，以批为单位切换分片，
+    只有单独一批就超过上限时分片才会超出。append=True 时保留清单里已有的分片，新数据写到新分片。
+    """
+
+    def __init__(self, output, max_shard_bytes=None, compression=None, append=False):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"不支持的压缩方式: {compression}")
+        self.stem = output[:-len('.jsonl')] if output.endswith('.jsonl') else output
+        self.manifest_path = manifest_path(output)
+        self.max_shard_bytes = max_shard_bytes
+        self.compression = compression
+        self.shards = []
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                old_shards = json.load(f)["shards"]
+            if append:
+                self.shards = old_shards
+            else:
+                # 完整重写：删掉上次的分片，避免留下过期数据
+                for shard in old_shards:
+                    try:
+                        os.remove(shard["path"])
+                    except FileNotFoundError:
+                        pass
+        self._open = {}  # split -> (文件, 清单条目)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _shard_for(self, split, size):
+        current = self._open.get(split)
+        if current is not None:
+            if self.max_shard_bytes is None or current[1]["bytes"] == 0 or current[1]["bytes"] + size <= self.max_shard_bytes:
+                return current
+            current[0].close()
+        index = sum(1 for shard in self.shards if shard["split"] == split)
+        path = f"{self.stem}.{split}-{index:05d}.jsonl{COMPRESSION_SUFFIXES[self.compression]}"
+        entry = {"split": split, "path": path, "samples": 0, "bytes": 0, "raw_bytes": 0}
+        self.shards.append(entry)
+        self._open[split] = (open(path, 'wb'), entry)
+        return self._open[split]
+
+    def write(self, encoded):
+        """写入 encode_samples 的结果"""
+        for split, (data, count, raw_bytes) in encoded.items():
+            f, entry = self._shard_for(split, len(data))
+            f.write(data)
+            entry["samples"] += count
+            entry["bytes"] += len(data)
+            entry["raw_bytes"] += raw_bytes
+
+    def totals(self):
+        """{split: (样本数, 磁盘字节数, 分片数)}"""
+        totals = {}
+        for shard in self.shards:
+            samples, size, count = totals.get(shard["split"], (0, 0, 0))
+            totals[shard["split"]] = (samples + shard["samples"], size + shard["bytes"], count + 1)
+        return totals
+
+    def close(self):
+        for f, _entry in self._open.values():
+            f.close()
+        self._open = {}
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"compression": self.compression, "shards": self.shards}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+def manifest_path(output):
+    stem = output[:-len('.jsonl')] if output.endswith('.jsonl') else output
+    return stem + MANIFEST_SUFFIX
+
+def _batches(blocks, batch_blocks):
+    blocks = iter(blocks)
+    while True:
+        batch = list(islice(blocks, batch_blocks))
+        if not batch:
+            return
+        yield batch
+
+def write_samples(blocks, make_samples, writer, workers=None, skip=0, val_ratio=0.0,
+                  batch_blocks=DEFAULT_BATCH_BLOCKS, stats=None, dedupe=None, aggregates=None, **kwargs):
+    """分批生成样本并写入分片，返回 (第一个样本, 互动记录)
+
+    dedupe: NearDuplicateIndex，传入时丢弃与已写出样本近似重复的样本
+    aggregates: PatternAggregates，传入时各批的互动记录在子进程里汇总后合并进来，返回的互动记录为空
+
+    make_samples(blocks, skip=..., stats=..., **kwargs) 返回 (samples, interactions)，
+    多进程时它和 kwargs 都需要能被 pickle。workers=1 时在当前进程里顺序执行。
+    结果按对话块顺序写出，输出与进程数无关。
+    """
+    first_sample = None
+    interactions = {}
+
+    def tasks():
+        nonlocal skip
+        for batch in _batches(blocks, batch_blocks):
+            yield (make_samples, batch, skip, kwargs, val_ratio, writer.compression, dedupe and dedupe.hasher,
+                   aggregates is not None)
+            skip = 0
+
+    def collect(result):
+        nonlocal first_sample
+        encoded, batch_interactions, batch_stats, first = result
+        if dedupe is not None:
+            kept = [line for line, signature, keys, messages in encoded if dedupe.add(signature, keys, messages)]
+            encoded = encode_lines(kept, val_ratio, writer.compression)
+        writer.write(encoded)
+        if first_sample is None:
+            first_sample = first
+        if aggregates is not None:
+            aggregates.merge(batch_interactions)
+        else:
+            for friend, items in batch_interactions.items():
+                interactions.setdefault(friend, []).extend(items)
+        if stats is not None:
+            for key, value in batch_stats.items():
+                stats[key] = stats.get(key, 0) + value
+
+    if workers == 1:
+        for task in tasks():
+            collect(_encode_batch(task))
+        return first_sample, interactions
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 限制同时在途的批数，保证内存占用不随数据量增长
+        limit = 2 * (workers or os.cpu_count() or 1)
+        pending = deque()
+        for task in tasks():
+            pending.append(pool.submit(_encode_batch, task))
+            if len(pending) >= limit:
+                collect(pending.popleft().result())
+        while pending:
+            collect(pending.popleft().result())
+    return first_sample, interactions
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+近似重复样本去重（MinHash + LSH）
+- 每个样本取 上下文 + 回复 的字符 shingle，用 numpy 批量计算 MinHash 签名
+- 签名按 band 切分后放进哈希桶，只和同桶里的代表样本比较，整体接近线性，不做两两比较
+- 逐个样本在线判断：与已保留的某个代表样本的估计相似度达到阈值就丢弃，否则成为新的代表
+- 签名计算可以放在子进程里，判断只需要签名和 band 键
+"""
+
+import numpy as np
+from context_builder import HISTORY_PREFIX, REPLY_SUFFIX_TEMPLATE
+
+MERSENNE_PRIME = (1 << 61) - 1
+SHINGLE_BASE = 1000003
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE = 3
+_SUFFIX_HEAD = REPLY_SUFFIX_TEMPLATE.split("{name}")[0]
+
+def sample_text(sample):
+    """样本中参与去重的文本：对话历史 + 回复（不含系统消息和固定的前后缀）"""
+    context, reply = "", ""
+    for message in sample["messages"]:
+        if message["role"] == "user":
+            context = message["content"]
+            if context.startswith(HISTORY_PREFIX):
+                # 去掉 "请以XX的身份回复："，不同目标用户的后缀不同
+                head, sep, _ = context[len(HISTORY_PREFIX):].rpartition(_SUFFIX_HEAD)
+                if sep:
+                    context = head
+        elif message["role"] == "assistant":
+            reply = message["content"]
+    return context + "\x00" + reply
+
+def lsh_params(threshold, num_perm):
+    """选择 (bands, rows)，使 S 曲线的拐点 (1/b)^(1/r) 最接近阈值"""
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+class MinHasher:
+    """字符 shingle 的 MinHash 签名和 LSH band 键；参数相同的实例结果相同，可以传给子进程"""
+
+    def __init__(self, threshold=0.8, num_perm=DEFAULT_NUM_PERM, shingle=DEFAULT_SHINGLE, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.seed = seed
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        # a, b < 2^31，保证 a*h+b 在 uint64 内不溢出（h < 2^32）
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)[:, None]
+        self._band_mix = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+    def __reduce__(self):
+        return MinHasher, (self.threshold, self.num_perm, self.shingle, self.seed)
+
+    def _shingle_hashes(self, text):
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype='<u4').astype(np.uint64)
+        if len(codes) < self.shingle:
+            codes = np.concatenate([codes, np.zeros(self.shingle - len(codes), dtype=np.uint64)])
+        count = len(codes) - self.shingle + 1
+        hashes = np.zeros(count, dtype=np.uint64)
+        for j in range(self.shingle):
+            hashes = hashes * np.uint64(SHINGLE_BASE) + codes[j:j + count]  # uint64 自然回绕
+        return (hashes * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)
+
+    def signature(self, text):
+        """返回 (签名 uint32 数组, band 键列表)"""
+        hashes = self._shingle_hashes(text)[None, :]
+        signature = ((self._a * hashes + self._b) % np.uint64(MERSENNE_PRIME)).min(axis=1).astype(np.uint32)
+        bands = signature[:self.bands * self.rows].reshape(self.bands, self.rows).astype(np.uint64)
+        keys = (bands * self._band_mix).sum(axis=1)
+        return signature, keys.tolist()
+
+class NearDuplicateIndex:
+    """在线去重索引：add() 返回 True 表示保留，False 表示是某个已保留样本的近似重复
+
+    count_tokens(text) 可选，用来统计被丢弃样本的 token 数。
+    """
+
+    def __init__(self, hasher, count_tokens=None):
+        self.hasher = hasher
+        self.count_tokens = count_tokens
+        self._buckets = [{} for _ in range(hasher.bands)]
+        # 只为保留下来的代表样本保存签名；低16位用于估计相似度，偶然相同的概率只有 1/65536
+        self._signatures = np.zeros((1024, hasher.num_perm), dtype=np.uint16)
+        self.kept = 0
+        self.dropped = 0
+        self.saved_chars = 0
+        self.saved_tokens = 0
+
+    def _similar(self, rep, signature):
+        return np.count_nonzero(self._signatures[rep] == signature) >= self.hasher.threshold * self.hasher.num_perm
+
+    def add(self, signature, keys, messages=()):
+        """判断一个样本；丢弃时把 messages 的字符数和 token 数计入节省量"""
+        signature = signature.astype(np.uint16)
+        checked = set()
+        for bucket, key in zip(self._buckets, keys):
+            rep = bucket.get(key)
+            if rep is not None and rep not in checked:
+                if self._similar(rep, signature):
+                    self.dropped += 1
+                    for message in messages:
+                        self.saved_chars += len(message["content"])
+                        if self.count_tokens is not None:
+                            self.saved_tokens += self.count_tokens(message["content"])
+                    return False
+                checked.add(rep)
+
+        rep = self.kept
+        if rep == len(self._signatures):
+            self._signatures = np.concatenate([self._signatures, np.zeros_like(self._signatures)])
+        self._signatures[rep] = signature
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, rep)
+        self.kept += 1
+        return True
+
+    def add_sample(self, sample):
+        signature, keys = self.hasher.signature(sample_text(sample))
+        return self.add(signature, keys, sample["messages"])
+
+    def report(self):
+        total = self.kept + self.dropped
+        if not total:
+            return "去重: 没有样本"
+        tokens = f"{self.saved_tokens:,} tokens" if self.count_tokens is not None else "token 数未统计"
+        return (f"去重(相似度≥{self.hasher.threshold}): 保留 {self.kept}/{total} 个样本，"
+                f"丢弃 {self.dropped} 个 ({self.dropped / total:.1%})，节省 {self.saved_chars:,} 字符，{tokens}")
+
+def dedupe_samples(samples, index):
+    """按顺序去重，返回保留的样本列表"""
+    return [sample for sample in samples if index.add_sample(sample)]
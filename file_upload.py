@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+训练文件上传
+- 通过共享的 keep-alive 会话上传；multipart 请求体边读文件边发送，不把整个文件读进内存
+- 临时错误（连接断开、超时、429、5xx）按指数退避重试，每次重试重新从磁盘读这一段
+- 大于 part_size 的文件用 Uploads 接口分片上传：创建上传 -> 逐片上传（每片单独确认，几片并发）-> 完成；
+  已确认的分片记在 .upload_state.json 里，中断后再上传同一个文件（路径、大小、修改时间都相同）时跳过这些分片
+- 上传时显示进度、速度和剩余时间
+"""
+
+import argparse, json, math, os, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from openai_http import OPENAI_API_BASE, MAX_RETRIES, make_session, request_with_retry
+
+PART_SIZE = 64 * 1024 * 1024  # Uploads 接口每片最大 64MB
+PART_WORKERS = 4
+UPLOAD_STATE_FILE = '.upload_state.json'
+PROGRESS_INTERVAL = 1.0
+MIME_TYPES = {'.jsonl': 'text/jsonl', '.json': 'application/json', '.txt': 'text/plain'}
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024 or unit == 'GB':
+            return f"{n:.1f} {unit}" if unit != 'B' else f"{n:.0f} B"
+        n /= 1024
+
+def format_eta(seconds):
+    if not math.isfinite(seconds):
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}" if minutes >= 60 else f"{minutes:02d}:{seconds:02d}"
+
+class Progress:
+    """线程安全的上传进度：已发送字节、速度、剩余时间，最多每 PROGRESS_INTERVAL 秒刷新一行"""
+
+    def __init__(self, total, done=0):
+        self.total = total
+        self.done = self.start_done = done
+        self.start = time.time()
+        self.shown = 0
+        self.lock = threading.Lock()
+
+    def rate(self):
+        elapsed = time.time() - self.start
+        return (self.done - self.start_done) / elapsed if elapsed > 0 else 0.0
+
+    def update(self, n):
+        with self.lock:
+            self.done += n
+            now = time.time()
+            if now - self.shown >= PROGRESS_INTERVAL:
+                self.shown = now
+                self._show()
+
+    def _show(self):
+        rate = self.rate()
+        eta = (self.total - self.done) / rate if rate > 0 else math.inf
+        print(f"\r📤 {self.done / max(self.total, 1):6.1%}  {format_bytes(self.done)}/{format_bytes(self.total)}  "
+              f"{format_bytes(rate)}/s  剩余 {format_eta(eta)}   ", end='', flush=True)
+
+    def finish(self):
+        with self.lock:
+            self._show()
+        print()
+
+class MultipartBody:
+    """multipart/form-data 请求体：若干表单字段加文件的一段 [offset, offset+length)，read() 时才读磁盘
+
+    有 __len__，requests 会据此设置 Content-Length，按块读取发送而不是先拼成一个大的 bytes
+    """
+
+    def __init__(self, boundary, fields, name, path, offset, length, filename, progress=None):
+        head = ''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'
+                       for key, value in fields.items())
+        head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n')
+        self.head = head.encode('utf-8')
+        self.tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        self.length = len(self.head) + length + len(self.tail)
+        self.remaining = length
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.progress = progress
+        self.sent = 0  # 已读出的文件字节（计入了进度）
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        out, self.head = self.head[:size], self.head[size:]
+        if len(out) < size and self.remaining:
+            chunk = self.file.read(min(size - len(out), self.remaining))
+            self.remaining -= len(chunk)
+            self.sent += len(chunk)
+            if self.progress:
+                self.progress.update(len(chunk))
+            out += chunk
+        if len(out) < size and not self.remaining:
+            out, self.tail = out + self.tail[:size - len(out)], self.tail[size - len(out):]
+        return out
+
+    def close(self):
+        self.file.close()
+
+def _print_retry(attempt, error):
+    print(f"\n⚠️ 上传中断（{error}），第 {attempt} 次重试...")
+
+def _post_multipart(session, url, fields, name, path, offset, length, progress, retries):
+    """流式 POST 文件的一段，临时错误时重新读这一段重试；返回响应 JSON，失败时抛出 requests 的异常"""
+    boundary = uuid.uuid4().hex
+    filename = os.path.basename(path)
+    bodies = []
+
+    def body():
+        if bodies:
+            # 重试：上一次已经计入进度的字节要退回去
+            progress.update(-bodies[-1].sent)
+            bodies[-1].close()
+        bodies.append(MultipartBody(boundary, fields, name, path, offset, length, filename, progress))
+        return bodies[-1]
+
+    try:
+        response = request_with_retry(session, "POST", url, retries=retries, body=body, on_retry=_print_retry,
+                                      headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    finally:
+        if bodies:
+            bodies[-1].close()
+    response.raise_for_status()
+    return response.json()
+
+def _load_state(state_file):
+    if state_file and os.path.exists(state_file):
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def _save_state(state_file, states):
+    if not state_file:
+        return
+    tmp_path = state_file + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(states, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_file)
+
+def upload_key(path):
+    """同一个文件的标识：绝对路径、大小、修改时间，文件改过之后不会续传旧的分片"""
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+def _upload_parts(session, base_url, path, purpose, part_size, workers, state_file, retries, resume=True):
+    size = os.path.getsize(path)
+    n_parts = math.ceil(size / part_size)
+    key = upload_key(path)
+    states = _load_state(state_file)
+    state = states.get(key)
+    resumed = resume and state is not None and state["part_size"] == part_size
+    if resumed:
+        print(f"🔁 继续上次的分片上传 {state['upload_id']}：已确认 {n_parts - state['parts'].count(None)}/{n_parts} 片")
+    else:
+        # 创建分片上传不幂等：读取超时后重发会多出一个没人用的上传，只重试肯定没被处理的请求
+        response = request_with_retry(session, "POST", f"{base_url}/uploads", retries=retries, idempotent=False, json={
+            "filename": os.path.basename(path),
+            "purpose": purpose,
+            "bytes": size,
+            "mime_type": MIME_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream'),
+        })
+        response.raise_for_status()
+        state = states[key] = {"upload_id": response.json()["id"], "part_size": part_size, "parts": [None] * n_parts}
+        _save_state(state_file, states)
+        print(f"📦 分片上传 {state['upload_id']}：{n_parts} 片，每片 {format_bytes(part_size)}")
+
+    upload_url = f"{base_url}/uploads/{state['upload_id']}"
+    todo = [i for i, part_id in enumerate(state["parts"]) if part_id is None]
+    progress = Progress(size, size - sum(min(part_size, size - i * part_size) for i in todo))
+    lock = threading.Lock()
+
+    def send_part(i):
+        offset = i * part_size
+        part = _post_multipart(session, f"{upload_url}/parts", {}, "data", path, offset,
+                               min(part_size, size - offset), progress, retries)
+        with lock:
+            state["parts"][i] = part["id"]
+            _save_state(state_file, states)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in as_completed([executor.submit(send_part, i) for i in todo]):
+                future.result()
+        response = request_with_retry(session, "POST", f"{upload_url}/complete", retries=retries,
+                                      json={"part_ids": state["parts"]})
+        response.raise_for_status()
+    except requests.HTTPError as e:
+        # 上传过期（一小时）或已取消：旧的分片不能用了，重新开始一次
+        if resumed and e.response.status_code in (400, 404):
+            print(f"\n⚠️ 上次的上传已失效（{e.response.status_code}），重新上传")
+            del states[key]
+            _save_state(state_file, states)
+            return _upload_parts(session, base_url, path, purpose, part_size, workers, state_file, retries, False)
+        raise
+    progress.finish()
+
+    del states[key]
+    _save_state(state_file, states)
+    return response.json()["file"]
+
+def upload_file(session, base_url, path, purpose="fine-tune", part_size=PART_SIZE, workers=PART_WORKERS,
+                state_file=UPLOAD_STATE_FILE, retries=MAX_RETRIES):
+    """上传文件，返回 OpenAI 的文件对象（字典，"id" 是文件ID）
+
+    不超过 part_size 的文件一次流式 POST 到 /files，更大的文件分片上传；失败时抛出 requests 的异常
+    """
+    base_url = base_url.rstrip('/')
+    size = os.path.getsize(path)
+    if size > part_size:
+        return _upload_parts(session, base_url, path, purpose, part_size, workers, state_file, retries)
+    progress = Progress(size)
+    result = _post_multipart(session, f"{base_url}/files", {"purpose": purpose}, "file", path, 0, size,
+                             progress, retries)
+    progress.finish()
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上传训练文件（流式、自动重试、大文件分片续传）")
+    parser.add_argument("filename", nargs="?", default="deepseek_data_final.jsonl", help="要上传的文件（默认 deepseek_data_final.jsonl）")
+    parser.add_argument("--base-url", default=OPENAI_API_BASE, help=f"API 地址（默认 {OPENAI_API_BASE}）")
+    parser.add_argument("--part-mb", type=int, default=PART_SIZE // (1024 * 1024), help="分片大小（MB），超过一片的文件分片上传")
+    parser.add_argument("--workers", type=int, default=PART_WORKERS, help=f"并发上传的分片数（默认{PART_WORKERS}）")
+    args = parser.parse_args()
+
+    try:
+        from config import OPENAI_API_KEY
+    except ImportError:
+        print("❌ 未找到config.py文件！")
+        print("请复制config_template.py为config.py并填入您的API密钥")
+        exit(1)
+
+    session = make_session(OPENAI_API_KEY, max(args.workers, 1))
+    start = time.time()
+    file = upload_file(session, args.base_url, args.filename, part_size=args.part_mb * 1024 * 1024, workers=args.workers)
+    elapsed = time.time() - start
+    print(f"✅ 文件上传成功，ID: {file['id']}（{format_bytes(file.get('bytes', 0))}，"
+          f"{elapsed:.1f} 秒，{format_bytes(file.get('bytes', 0) / max(elapsed, 1e-9))}/s）")
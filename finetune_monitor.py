@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步微调任务监控
+- 一个事件循环同时跟踪多个微调任务，每个任务一个协程；HTTP 请求放在线程里执行，共用一个
+  带连接池的会话（openai_http.make_session），并发数由信号量限制
+- 自适应轮询：校验文件和排队时间隔逐步拉长（退避），训练中有新事件时保持最短间隔，没有时慢慢放慢
+- 事件流按游标增量读取：只翻到上次看到的最后一个事件为止，新事件按时间顺序回调
+- 每次轮询后把任务状态（状态、事件游标、模型ID、轮询间隔）原子写入 .finetune_jobs.json，
+  进程重启后自动继续跟踪没有结束的任务
+- 401/403/404 等重试也不会成功的错误把任务标记为 lost 并从状态文件中删除；
+  网络错误、429 和 5xx 按退避重试，连续失败 MAX_FAILURES 次后停止跟踪（状态文件里保留，之后可以继续）
+- base_url 可以指向 mock_openai.py 的本地模拟服务器
+"""
+
+import argparse, asyncio, json, os, time
+import requests
+from openai_http import OPENAI_API_BASE, RETRY_STATUSES, make_session
+
+JOBS_FILE = '.finetune_jobs.json'
+# 查询任务时遇到不可重试的错误（任务不存在、密钥无效等），不再跟踪
+LOST = "lost"
+# 取消状态两种拼写都可能出现
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled", "canceled", LOST)
+# 各状态的轮询间隔（秒）：(最短, 最长)；状态变化或有新事件时回到最短，否则每次乘以 BACKOFF
+POLL_INTERVALS = {
+    "validating_files": (10, 120),
+    "queued": (15, 300),
+    "running": (5, 60),
+}
+DEFAULT_INTERVAL = (10, 120)
+BACKOFF = 1.5
+EVENTS_PAGE = 100
+MAX_CONCURRENCY = 8
+REQUEST_TIMEOUT = 30
+MAX_FAILURES = 10
+
+def next_interval(status, previous, active, intervals=POLL_INTERVALS):
+    """下一次轮询前等待的秒数；active 表示状态刚变化或有新事件"""
+    low, high = intervals.get(status, DEFAULT_INTERVAL)
+    if active or previous is None:
+        return low
+    return min(high, max(low, previous * BACKOFF))
+
+def print_event(job_id, event):
+    stamp = time.strftime('%H:%M:%S', time.localtime(event.get("created_at", time.time())))
+    print(f"📜 [{job_id}] {stamp} {event.get('message', '')}")
+
+def print_status(job_id, old, new):
+    print(f"📊 [{job_id}] 状态: {old or '未知'} -> {new}")
+
+def is_fatal(error):
+    """重试也不会成功的错误：429 和 RETRY_STATUSES 以外的 4xx"""
+    response = getattr(error, "response", None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code not in RETRY_STATUSES
+
+class JobMonitor:
+    """同时跟踪多个微调任务
+
+    on_event(job_id, event) 按时间顺序收到每个新事件，on_status(job_id, 旧状态, 新状态) 在状态变化时调用；
+    state_file 为 None 时不保存状态
+    """
+
+    def __init__(self, api_key, base_url=OPENAI_API_BASE, state_file=JOBS_FILE, max_concurrency=MAX_CONCURRENCY,
+                 intervals=POLL_INTERVALS, on_event=print_event, on_status=print_status):
+        self.base_url = base_url.rstrip('/')
+        self.state_file = state_file
+        self.intervals = intervals
+        self.on_event = on_event
+        self.on_status = on_status
+        self.session = make_session(api_key, max_concurrency)
+        self._limit = asyncio.Semaphore(max_concurrency)
+        # {任务ID: {"status", "cursor", "fine_tuned_model", "error", "interval", "updated"}}
+        self.jobs = {}
+        if state_file and os.path.exists(state_file):
+            with open(state_file, 'r', encoding='utf-8') as f:
+                self.jobs = json.load(f)["jobs"]
+
+    def track(self, job_id):
+        """开始跟踪一个任务（已经在跟踪的任务保留原来的游标）"""
+        return self.jobs.setdefault(job_id, {"status": None, "cursor": None, "fine_tuned_model": None,
+                                             "error": None, "interval": None, "updated": None})
+
+    def pending(self):
+        return [job_id for job_id, entry in self.jobs.items() if entry["status"] not in TERMINAL_STATUSES]
+
+    def save(self):
+        if not self.state_file:
+            return
+        tmp_path = self.state_file + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"jobs": self.jobs}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_file)
+
+    async def _get(self, path, params=None):
+        async with self._limit:
+            response = await asyncio.to_thread(self.session.get, self.base_url + path,
+                                               params=params, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    async def new_events(self, job_id, cursor):
+        """cursor 之后的新事件（按时间顺序）；事件接口按时间倒序分页，翻到 cursor 为止"""
+        events, after = [], None
+        while True:
+            params = {"limit": EVENTS_PAGE}
+            if after is not None:
+                params["after"] = after
+            page = await self._get(f"/fine_tuning/jobs/{job_id}/events", params)
+            data = page.get("data", [])
+            for event in data:
+                if event["id"] == cursor:
+                    return events[::-1]
+                events.append(event)
+            if not data or not page.get("has_more"):
+                return events[::-1]
+            after = data[-1]["id"]
+
+    async def watch(self, job_id):
+        """跟踪一个任务直到结束，返回它的状态记录
+
+        不可重试的错误返回 status 为 LOST 的记录（已从状态文件删除）；连续失败 MAX_FAILURES 次时
+        返回没有结束的记录，error 是最后一次的错误
+        """
+        entry = self.track(job_id)
+        failures = 0
+        while entry["status"] not in TERMINAL_STATUSES:
+            try:
+                job = await self._get(f"/fine_tuning/jobs/{job_id}")
+                events = await self.new_events(job_id, entry["cursor"])
+            except (requests.RequestException, ValueError) as e:
+                if is_fatal(e):
+                    print(f"❌ [{job_id}] 无法查询任务，停止跟踪: {e}")
+                    entry.update(status=LOST, error=str(e), updated=time.time())
+                    del self.jobs[job_id]
+                    self.save()
+                    return entry
+                failures += 1
+                print(f"⚠️ [{job_id}] 检查状态时出错（{failures}/{MAX_FAILURES}）: {e}")
+                if failures >= MAX_FAILURES:
+                    entry.update(error=str(e), updated=time.time())
+                    self.save()
+                    return entry
+                status = entry["status"]
+                entry["interval"] = next_interval(status, entry["interval"] or 0, False, self.intervals)
+            else:
+                failures = 0
+                for event in events:
+                    self.on_event(job_id, event)
+                if events:
+                    entry["cursor"] = events[-1]["id"]
+                status = job.get("status")
+                changed = status != entry["status"]
+                if changed:
+                    self.on_status(job_id, entry["status"], status)
+                entry.update(status=status, fine_tuned_model=job.get("fine_tuned_model"), error=job.get("error"),
+                             interval=next_interval(status, entry["interval"], changed or bool(events), self.intervals))
+            entry["updated"] = time.time()
+            self.save()
+            if entry["status"] in TERMINAL_STATUSES:
+                break
+            await asyncio.sleep(entry["interval"])
+        return entry
+
+    async def run(self, job_ids=(), resume=True):
+        """跟踪 job_ids 中没有结束的任务，全部结束后返回 {任务ID: 状态记录}
+
+        resume 为 True 时同时继续跟踪状态文件里所有没有结束的任务（命令行的用法）
+        """
+        for job_id in job_ids:
+            self.track(job_id)
+        pending = self.pending() if resume else [job_id for job_id in dict.fromkeys(job_ids)
+                                                 if self.jobs[job_id]["status"] not in TERMINAL_STATUSES]
+        results = await asyncio.gather(*(self.watch(job_id) for job_id in pending))
+        return dict(zip(pending, results))
+
+    def close(self):
+        self.session.close()
+
+def wait_for_jobs(api_key, job_ids, base_url=OPENAI_API_BASE, state_file=JOBS_FILE, resume=True, **options):
+    """同步接口：跟踪任务直到全部结束，返回 {任务ID: 状态记录}；resume 同 JobMonitor.run"""
+    monitor = JobMonitor(api_key, base_url, state_file, **options)
+    try:
+        return asyncio.run(monitor.run(job_ids, resume))
+    finally:
+        monitor.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="跟踪 OpenAI 微调任务，重启后从保存的状态继续")
+    parser.add_argument("job_ids", nargs="*", help="要跟踪的任务ID（不指定时继续跟踪状态文件里没有结束的任务）")
+    parser.add_argument("--base-url", default=OPENAI_API_BASE, help=f"API 地址（默认 {OPENAI_API_BASE}）")
+    parser.add_argument("--state", default=JOBS_FILE, help=f"任务状态文件（默认 {JOBS_FILE}）")
+    args = parser.parse_args()
+
+    try:
+        from config import OPENAI_API_KEY
+    except ImportError:
+        print("❌ 未找到config.py文件！")
+        print("请复制config_template.py为config.py并填入您的API密钥")
+        exit(1)
+
+    results = wait_for_jobs(OPENAI_API_KEY, args.job_ids, args.base_url, args.state)
+    if not results:
+        print("⏭️ 没有需要跟踪的任务")
+    for job_id, entry in results.items():
+        if entry["status"] == "succeeded":
+            print(f"🎉 [{job_id}] 训练完成！模型ID: {entry['fine_tuned_model']}")
+        elif entry["status"] not in TERMINAL_STATUSES:
+            print(f"⚠️ [{job_id}] 多次查询失败，稍后重新运行继续跟踪: {entry['error']}")
+        else:
+            print(f"❌ [{job_id}] {entry['status']}: {entry.get('error') or '未知错误'}")
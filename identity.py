@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化的用户身份库
+- 按源文件分别记录每个QQ号使用过的名字及次数，源文件没变时不重新统计，追加的内容只合并新消息
+- 每个QQ号保留改名时间线：连续使用同一个名字的一段记为一个区间 [开始时间, 结束时间, 名字]
+- 时间线按开始时间排序，"某个QQ号在时间 T 叫什么"用二分查找，O(log n)
+- 统一名字（出现次数最多的名字，次数相同时取最早出现的）与 build_user_mapping 的结果一致
+"""
+
+import bisect, json, os
+from collections import Counter
+
+IDENTITY_FILE = '.identity_store.json'
+
+class IdentityStore:
+    """用户身份库；path 为 None 时只在内存中使用"""
+
+    def __init__(self, path=IDENTITY_FILE):
+        self.path = path
+        # {源文件: {"version": 版本标识, "names": {QQ号: {名字: 次数}}, "runs": {QQ号: [[开始, 结束, 名字], ...]}}}
+        self.sources = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.sources = json.load(f)["sources"]
+        self._merged = None
+
+    def sync(self, source, blocks, version, skip=0, base=None):
+        """合并一个源文件的身份信息，返回是否有更新
+
+        blocks: 消息列表的列表；version: 源文件当前的版本标识（内容哈希或检查点的前缀哈希），
+        与已记录的相同时直接跳过。base 是增量解析时上一次的版本标识：与已记录的一致时只追加
+        blocks（第一块开头的 skip 条消息已经统计过），否则丢弃这个源文件的旧记录整份重建。
+        """
+        entry = self.sources.get(source)
+        if entry is not None and entry["version"] == version:
+            return False
+        if entry is None or base is None or entry["version"] != base:
+            entry = {"names": {}, "runs": {}}
+            skip = 0
+        entry["version"] = version
+        names, runs = entry["names"], entry["runs"]
+        for blk in blocks:
+            for msg in blk[skip:]:
+                if not (msg.username and msg.user_id):
+                    continue
+                counts = names.setdefault(msg.user_id, {})
+                counts[msg.username] = counts.get(msg.username, 0) + 1
+                user_runs = runs.setdefault(msg.user_id, [])
+                if user_runs and user_runs[-1][2] == msg.username:
+                    run = user_runs[-1]
+                    run[0], run[1] = min(run[0], msg.ts), max(run[1], msg.ts)
+                else:
+                    user_runs.append([msg.ts, msg.ts, msg.username])
+            skip = 0
+        self.sources[source] = entry
+        self._merged = None
+        return True
+
+    def prune(self, sources):
+        """只保留 sources 中的源文件，返回删掉的源文件列表"""
+        removed = [source for source in self.sources if source not in sources]
+        for source in removed:
+            del self.sources[source]
+        if removed:
+            self._merged = None
+        return removed
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"sources": self.sources}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _merge(self):
+        """合并各源文件：{QQ号: Counter(名字)} 和 {QQ号: (开始时间列表, 区间列表)}"""
+        if self._merged is None:
+            counts, runs = {}, {}
+            for entry in self.sources.values():
+                for user_id, names in entry["names"].items():
+                    counts.setdefault(user_id, Counter()).update(names)
+                for user_id, user_runs in entry["runs"].items():
+                    runs.setdefault(user_id, []).extend(user_runs)
+            timelines = {}
+            for user_id, user_runs in runs.items():
+                user_runs.sort(key=lambda run: run[0])
+                timelines[user_id] = ([run[0] for run in user_runs], user_runs)
+            self._merged = counts, timelines
+        return self._merged
+
+    def name_counts(self):
+        """{QQ号: Counter(名字)}"""
+        return self._merge()[0]
+
+    def mapping(self, verbose=True):
+        """{QQ号: 统一名字}；verbose 时打印有多个名字的用户"""
+        user_mapping = {}
+        for user_id, name_counts in self.name_counts().items():
+            user_mapping[user_id] = name_counts.most_common(1)[0][0]
+            if verbose and len(name_counts) > 1:
+                print(f"用户ID {user_id} 有多个名字: {dict(name_counts)} -> 统一为: {user_mapping[user_id]}")
+        return user_mapping
+
+    def timeline(self, user_id):
+        """按开始时间排序的改名区间 [[开始, 结束, 名字], ...]"""
+        timeline = self._merge()[1].get(user_id)
+        return timeline[1] if timeline else []
+
+    def name_at(self, user_id, ts):
+        """QQ号在时间 ts 使用的名字：开始时间不晚于 ts 的最后一个区间；ts 早于第一次发言时返回最早的名字"""
+        timeline = self._merge()[1].get(user_id)
+        if not timeline:
+            return None
+        starts, runs = timeline
+        return runs[max(bisect.bisect_right(starts, ts) - 1, 0)][2]
+
+    def names_at(self, queries):
+        """批量查询 [(QQ号, 时间)] -> [名字]"""
+        return [self.name_at(user_id, ts) for user_id, ts in queries]
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量聊天记录解析
+- QQ导出文件只会在末尾追加，每个源文件保存一个检查点：
+  字节偏移、最后时间戳、未关闭的对话块和前缀哈希
+- 再次运行时只解析追加的字节，只为新消息生成样本
+- 文件末尾的最后一条消息后面可能还会追加内容行，这次不输出它，留在检查点的解析状态里，
+  下次和追加的内容一起作为一条完整的消息输出（不会先写一条截断的样本、之后再写一条完整的）
+- 前缀被改写（哈希不一致、文件变短、参数变化）时回退到完整解析
+"""
+
+import hashlib, io, json, os
+from chat_parser import parse_lines
+
+CHECKPOINT_DIR = '.ingest_checkpoints'
+# 检查点格式版本：旧版本把末尾没结束的消息算作已输出，不能直接接着用
+CHECKPOINT_VERSION = 2
+HASH_BLOCK_SIZE = 1024 * 1024
+
+class _RangeReader(io.RawIOBase):
+    """只读取文件 [start, end) 区间的原始流，同时把读到的字节送入哈希"""
+
+    def __init__(self, f, end, digest):
+        self.f = f
+        self.remaining = end - f.tell()
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.remaining)
+        if n <= 0:
+            return 0
+        data = self.f.read(n)
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        self.digest.update(data)
+        return len(data)
+
+def checkpoint_path(source, output):
+    """检查点文件路径：每个 (输出文件, 源文件) 组合一个"""
+    output_stem = os.path.splitext(os.path.basename(output))[0]
+    return os.path.join(CHECKPOINT_DIR, f"{output_stem}__{os.path.basename(source)}.json")
+
+def load_checkpoint(source, output):
+    try:
+        with open(checkpoint_path(source, output), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_checkpoint(source, output, checkpoint):
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = checkpoint_path(source, output)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+def _complete_size(f):
+    """文件中最后一个完整行的结束位置，忽略可能正在写入的半行"""
+    size = f.seek(0, os.SEEK_END)
+    pos = size
+    while pos > 0:
+        step = min(HASH_BLOCK_SIZE, pos)
+        f.seek(pos - step)
+        nl = f.read(step).rfind(b'\n')
+        if nl >= 0:
+            return pos - step + nl + 1
+        pos -= step
+    return 0
+
+def _hash_prefix(f, end):
+    """从头哈希到 end，返回可以继续更新的哈希对象"""
+    digest = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    remaining = end
+    while remaining > 0:
+        data = f.read(min(HASH_BLOCK_SIZE, remaining))
+        if not data:
+            break
+        digest.update(data)
+        remaining -= len(data)
+    return digest
+
+def can_resume(source, checkpoint, params):
+    """检查点是否仍然有效：参数一致、文件没有变短、前缀哈希一致"""
+    if checkpoint is None or checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint.get("params") != params:
+        return False
+    try:
+        with open(source, 'rb') as f:
+            if _complete_size(f) < checkpoint["offset"]:
+                return False
+            return _hash_prefix(f, checkpoint["offset"]).hexdigest() == checkpoint["prefix_hash"]
+    except FileNotFoundError:
+        return False
+
+def seen_messages(checkpoint):
+    """检查点之前已经输出过的消息数（未关闭的对话块；最后一条还没结束的消息没有输出过）"""
+    if checkpoint is None:
+        return 0
+    return len(checkpoint["state"]["open_block"])
+
+def parse_source(source, params, checkpoint=None):
+    """解析源文件（有检查点时只解析追加部分）
+
+    返回 (blocks, skip, new_checkpoint)：blocks 开头的 skip 条消息上次已经生成过样本，
+    只作为上下文使用；文件末尾还没结束的消息不在 blocks 里，下次运行时再输出。
+    调用方应当先用 can_resume 确认检查点有效。
+    """
+    gap_minutes = params["gap_minutes"]
+    with open(source, 'rb') as f:
+        end = _complete_size(f)
+        if checkpoint is None:
+            start, state, skip = 0, None, 0
+            digest = hashlib.blake2b(digest_size=16)
+        else:
+            start, state = checkpoint["offset"], checkpoint["state"]
+            digest = _hash_prefix(f, start)
+            skip = seen_messages(checkpoint)
+        f.seek(start)
+        counters = {}
+        lines = io.TextIOWrapper(io.BufferedReader(_RangeReader(f, end, digest)), encoding='utf-8')
+        blocks = list(parse_lines(lines, gap_minutes, counters, state=state))
+
+    pending = counters["state"]["pending"]
+    if pending is not None and pending[0] is not None:
+        # 最后一条消息后面可能还会追加内容行：先不输出，下次从检查点的解析状态里接着读完
+        messages = blocks[-1][2]
+        messages.pop()
+        if not messages:
+            blocks.pop()
+
+    new_checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "params": params,
+        "offset": end,
+        "last_ts": counters["last_ts"],
+        "state": counters["state"],
+        "prefix_hash": digest.hexdigest(),
+    }
+    return blocks, skip, new_checkpoint
+
+def drop_processed(blocks, skip):
+    """去掉开头已经处理过的整块，返回 (blocks, 第一块中仍需跳过的消息数)"""
+    k = 0
+    while k < len(blocks) and skip >= len(blocks[k][2]):
+        skip -= len(blocks[k][2])
+        k += 1
+    return blocks[k:], skip
+
+def clear_checkpoints(sources, output):
+    """完整重写输出后，旧检查点已经和输出不一致，直接删除"""
+    for source in sources:
+        try:
+            os.remove(checkpoint_path(source, output))
+        except FileNotFoundError:
+            pass
+
+def plan_sources(sources, output, params, incremental):
+    """决定本次的解析方式
+
+    返回 (checkpoints, resume)：checkpoints 为 None 表示不使用增量模式；
+    否则是 {源文件: 检查点或None}。resume 为 True 时输出文件应当追加写入。
+    """
+    if not incremental:
+        clear_checkpoints(sources, output)
+        return None, False
+    checkpoints = {source: load_checkpoint(source, output) for source in sources}
+    if os.path.exists(output) and all(can_resume(source, checkpoints[source], params) for source in sources):
+        return checkpoints, True
+    if any(checkpoint is not None for checkpoint in checkpoints.values()):
+        print("⚠️ 检查点失效（源文件前缀被改写或参数已变化），回退到完整解析")
+    return {source: None for source in sources}, False
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+二进制列式消息缓存
+- 解析结果保存在导出文件旁边（1.txt -> 1.txt.msgcache），以源文件内容哈希为键
+- 时间戳存为 int64 秒，用户ID、用户名、分组/对象存为整数编码，消息文本放在同一个字符串池里
+- 加载时直接内存映射，按 gap_minutes 现场切分对话块，调整参数不需要重新解析文本
+"""
+
+import hashlib, json, mmap, os, struct, sys
+from array import array
+from chat_parser import iter_blocks
+from chat_model import Message
+
+MAGIC = b'QQMSGC01'
+CACHE_SUFFIX = '.msgcache'
+HASH_BLOCK_SIZE = 1024 * 1024
+# 列名 -> array 类型码：ts 秒、用户编码、用户名编码、分段编码、文本在字符串池中的结束偏移
+COLUMNS = (('ts', 'q'), ('user', 'i'), ('name', 'i'), ('section', 'i'), ('text_end', 'q'))
+
+def file_hash(path):
+    """源文件内容哈希"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+def _align8(pos):
+    return pos + (-pos % 8)
+
+def cache_path_for(source):
+    return source + CACHE_SUFFIX
+
+class MessageCache:
+    """内存映射的列式消息缓存，用 with 语句或 close() 释放映射"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"不是消息缓存文件: {path}")
+        header_len, = struct.unpack_from('<Q', self._mm, len(MAGIC))
+        body = len(MAGIC) + 8
+        self.header = json.loads(self._mm[body:body + header_len].decode('utf-8'))
+        data_start = _align8(body + header_len)
+        self.user_ids = self.header["user_ids"]
+        self.names = self.header["names"]
+        self.sections = [tuple(s) for s in self.header["sections"]]
+        self._view = memoryview(self._mm)
+        self._columns = {}
+        for name, typecode in COLUMNS:
+            start, end = self.header["columns"][name]
+            column = self._view[data_start + start:data_start + end].cast(typecode)
+            if self.header["byteorder"] != sys.byteorder:
+                column = array(typecode, column)
+                column.byteswap()
+            self._columns[name] = column
+        start, end = self.header["text_pool"]
+        self._pool = self._view[data_start + start:data_start + end]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for column in getattr(self, '_columns', {}).values():
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns = {}
+        if getattr(self, '_pool', None) is not None:
+            self._pool.release()
+            self._view.release()
+            self._pool = None
+        if not self._mm.closed:
+            self._mm.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.header["count"]
+
+    @property
+    def source_hash(self):
+        return self.header["source_hash"]
+
+    def column(self, name):
+        """返回某一列（memoryview 或 array），可以直接按下标访问"""
+        return self._columns[name]
+
+    def text(self, i):
+        ends = self._columns['text_end']
+        start = ends[i - 1] if i > 0 else 0
+        return str(self._pool[start:ends[i]], 'utf-8')
+
+    def iter_messages(self):
+        """按顺序产出 Message"""
+        ts, users, names, ends = (self._columns[c] for c in ('ts', 'user', 'name', 'text_end'))
+        pool, user_ids, name_table = self._pool, self.user_ids, self.names
+        start = 0
+        for i in range(len(self)):
+            end = ends[i]
+            yield Message(user_ids[users[i]], name_table[names[i]], str(pool[start:end], 'utf-8'), ts[i])
+            start = end
+
+    def iter_blocks(self, gap_minutes=30):
+        """按时间间隔切分对话块，结果与 chat_parser.iter_blocks 相同"""
+        gap_seconds = gap_minutes * 60
+        sections = self._columns['section']
+        cur, prev_ts, prev_section = [], None, None
+        for i, message in enumerate(self.iter_messages()):
+            section = sections[i]
+            if cur and (section != prev_section or message.ts - prev_ts > gap_seconds):
+                yield self.sections[prev_section] + (cur,)
+                cur = []
+            cur.append(message)
+            prev_ts, prev_section = message.ts, section
+        if cur:
+            yield self.sections[prev_section] + (cur,)
+
+def build_cache(source, cache_path=None, source_hash=None):
+    """解析源文件并写入缓存，返回缓存文件路径"""
+    cache_path = cache_path or cache_path_for(source)
+    source_hash = source_hash or file_hash(source)
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    pool = bytearray()
+    codes = {"user": {}, "name": {}}
+    sections = []
+
+    # gap 取无穷大：对话块只在分组/对象标识处切分，每块就是一个分段
+    for group, chat, messages in iter_blocks(source, gap_minutes=float('inf')):
+        section = len(sections)
+        sections.append((group, chat))
+        for message in messages:
+            columns['ts'].append(message.ts)
+            columns['user'].append(codes["user"].setdefault(message.user_id, len(codes["user"])))
+            columns['name'].append(codes["name"].setdefault(message.username, len(codes["name"])))
+            columns['section'].append(section)
+            pool += message.text.encode('utf-8')
+            columns['text_end'].append(len(pool))
+
+    header = {
+        "source": os.path.basename(source),
+        "source_hash": source_hash,
+        "count": len(columns['ts']),
+        "byteorder": sys.byteorder,
+        "user_ids": list(codes["user"]),
+        "names": list(codes["name"]),
+        "sections": sections,
+        "columns": {},
+    }
+    # 各列的偏移相对于头部之后的数据区，按8字节对齐
+    pos = 0
+    for name, _typecode in COLUMNS:
+        size = len(columns[name]) * columns[name].itemsize
+        header["columns"][name] = [pos, pos + size]
+        pos += size + (-size % 8)
+    header["text_pool"] = [pos, pos + len(pool)]
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = _align8(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name, _typecode in COLUMNS:
+            f.write(b'\0' * (data_start + header["columns"][name][0] - f.tell()))
+            columns[name].tofile(f)
+        f.write(b'\0' * (data_start + header["text_pool"][0] - f.tell()))
+        f.write(pool)
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+def load_cache(source, rebuild=False):
+    """打开源文件对应的缓存；缓存不存在或内容哈希不一致时重新解析并写入"""
+    cache_path = cache_path_for(source)
+    source_hash = file_hash(source)
+    if not rebuild and os.path.exists(cache_path):
+        try:
+            cache = MessageCache(cache_path)
+        except (ValueError, KeyError, json.JSONDecodeError):
+            cache = None
+        if cache is not None and cache.source_hash == source_hash:
+            return cache
+        if cache is not None:
+            cache.close()
+    build_cache(source, cache_path, source_hash)
+    return MessageCache(cache_path)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite 消息库（可选）
+- 解析结果写入 messages / users / groups / blocks 表，按源文件内容哈希判断是否需要重新导入
+- (user_id, ts) 和 (block_id, seq) 索引让"某人在某群对某人的回复"、"某条消息前后的上下文"变成索引查询
+- messages_fts 是消息文本的 FTS5 全文索引（trigram 分词，适合中文子串搜索）
+- store_blocks 按 load_blocks 的格式读出对话块，样本生成和聊天模式分析可以直接在库上运行
+"""
+
+import os, sqlite3
+from chat_parser import iter_blocks
+from message_cache import file_hash
+from chat_model import Message
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    hash TEXT NOT NULL,
+    gap_minutes REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    qq TEXT UNIQUE NOT NULL,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY,
+    group_name TEXT,
+    chat_name TEXT,
+    UNIQUE (group_name, chat_name)
+);
+-- UNIQUE 约束里 NULL 互不相等，没有群组的行靠这个索引去重（建在 open_store 里，旧库要先合并重复行）
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY,
+    source_id INTEGER NOT NULL REFERENCES sources(id),
+    group_id INTEGER NOT NULL REFERENCES groups(id),
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    block_id INTEGER NOT NULL REFERENCES blocks(id),
+    seq INTEGER NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    username TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_user_ts ON messages (user_id, ts);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_block_seq ON messages (block_id, seq);
+CREATE INDEX IF NOT EXISTS idx_blocks_source ON blocks (source_id);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+def open_store(path):
+    """打开（必要时创建）消息库"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                     "text, content='messages', content_rowid='id', tokenize='trigram')")
+    except sqlite3.OperationalError:
+        # 旧版 SQLite 没有 trigram 分词器
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                     "text, content='messages', content_rowid='id')")
+    conn.executescript(SCHEMA)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_groups_key'").fetchone() is None:
+        with conn:
+            # 旧库里没有群组（NULL）的行每次导入都会重复插入：对话块改指向最早的一行，删掉其余的
+            conn.execute("""
+                UPDATE blocks SET group_id = (
+                    SELECT MIN(g.id) FROM groups g JOIN groups old ON old.id = blocks.group_id
+                    WHERE g.group_name IS old.group_name AND g.chat_name IS old.chat_name)
+            """)
+            conn.execute("DELETE FROM groups WHERE id NOT IN (SELECT MIN(id) FROM groups GROUP BY group_name, chat_name)")
+            conn.execute("CREATE UNIQUE INDEX idx_groups_key ON groups (COALESCE(group_name, ''), COALESCE(chat_name, ''))")
+    return conn
+
+def _code(conn, cache, key, insert_sql, select_sql):
+    """查找或插入 users/groups 表的行，返回行ID（带进程内缓存）"""
+    row_id = cache.get(key)
+    if row_id is None:
+        conn.execute(insert_sql, key)
+        row_id = conn.execute(select_sql, key).fetchone()[0]
+        cache[key] = row_id
+    return row_id
+
+def ingest_source(conn, source, gap_minutes=30, force=False):
+    """把源文件导入消息库；内容哈希和 gap 都没变时跳过，返回是否重新导入"""
+    path = os.path.abspath(source)
+    source_hash = file_hash(source)
+    row = conn.execute("SELECT id, hash, gap_minutes FROM sources WHERE path = ?", (path,)).fetchone()
+    if row and not force and row[1] == source_hash and row[2] == gap_minutes:
+        return False
+
+    with conn:
+        if row:
+            source_id = row[0]
+            conn.execute("DELETE FROM messages WHERE block_id IN (SELECT id FROM blocks WHERE source_id = ?)", (source_id,))
+            conn.execute("DELETE FROM blocks WHERE source_id = ?", (source_id,))
+            conn.execute("UPDATE sources SET hash = ?, gap_minutes = ? WHERE id = ?", (source_hash, gap_minutes, source_id))
+        else:
+            source_id = conn.execute("INSERT INTO sources (path, hash, gap_minutes) VALUES (?, ?, ?)",
+                                     (path, source_hash, gap_minutes)).lastrowid
+
+        users, groups = {}, {}
+        for group, chat, messages in iter_blocks(source, gap_minutes):
+            group_id = _code(conn, groups, (group, chat),
+                             "INSERT OR IGNORE INTO groups (group_name, chat_name) VALUES (?, ?)",
+                             "SELECT id FROM groups WHERE group_name IS ? AND chat_name IS ?")
+            block_id = conn.execute(
+                "INSERT INTO blocks (source_id, group_id, start_ts, end_ts, size) VALUES (?, ?, ?, ?, ?)",
+                (source_id, group_id, messages[0].ts, messages[-1].ts, len(messages))).lastrowid
+            rows = []
+            for seq, message in enumerate(messages):
+                user_id = _code(conn, users, (message.user_id,),
+                                "INSERT OR IGNORE INTO users (qq) VALUES (?)",
+                                "SELECT id FROM users WHERE qq = ?")
+                rows.append((block_id, seq, user_id, message.username, message.ts, message.text))
+            conn.executemany(
+                "INSERT INTO messages (block_id, seq, user_id, username, ts, text) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+        # 每个用户的统一名字：出现次数最多的名字，次数相同时取最早出现的
+        conn.execute("""
+            UPDATE users SET name = (
+                SELECT username FROM messages WHERE messages.user_id = users.id
+                GROUP BY username ORDER BY COUNT(*) DESC, MIN(messages.id) LIMIT 1)
+        """)
+    return True
+
+def user_mapping(conn):
+    """{QQ号: 统一名字}，与 build_user_mapping 的结果格式相同"""
+    return dict(conn.execute("SELECT qq, name FROM users WHERE name IS NOT NULL ORDER BY id"))
+
+def store_blocks(conn, source=None):
+    """按文件顺序读出对话块，格式与 load_blocks 相同: (group, chat, messages)"""
+    sql = """
+        SELECT m.block_id, g.group_name, g.chat_name, u.qq, m.username, m.text, m.ts
+        FROM messages m
+        JOIN blocks b ON b.id = m.block_id
+        JOIN groups g ON g.id = b.group_id
+        JOIN users u ON u.id = m.user_id
+    """
+    params = ()
+    if source is not None:
+        sql += " WHERE b.source_id = (SELECT id FROM sources WHERE path = ?)"
+        params = (os.path.abspath(source),)
+    sql += " ORDER BY m.block_id, m.seq"
+
+    cur_id, cur = None, None
+    for block_id, group, chat, qq, username, text, ts in conn.execute(sql, params):
+        if block_id != cur_id:
+            if cur:
+                yield cur
+            cur_id, cur = block_id, (group, chat, [])
+        cur[2].append(Message(qq, username, text, ts))
+    if cur:
+        yield cur
+
+def replies_to(conn, replier_qq, partner_qq, chat_name=None, window=3):
+    """replier 在 partner 发言后 window 条消息以内的回复，返回 [(message_id, ts, text)]"""
+    sql = """
+        SELECT r.id, r.ts, r.text
+        FROM messages r
+        JOIN blocks b ON b.id = r.block_id
+        JOIN groups g ON g.id = b.group_id
+        WHERE r.user_id = (SELECT id FROM users WHERE qq = :replier)
+          AND (:chat IS NULL OR g.chat_name = :chat)
+          AND EXISTS (
+              SELECT 1 FROM messages c
+              WHERE c.block_id = r.block_id
+                AND c.seq BETWEEN r.seq - :window AND r.seq - 1
+                AND c.user_id = (SELECT id FROM users WHERE qq = :partner))
+        ORDER BY r.ts
+    """
+    return conn.execute(sql, {"replier": replier_qq, "partner": partner_qq,
+                              "chat": chat_name, "window": window}).fetchall()
+
+def context_window(conn, message_id, before=3, after=0):
+    """某条消息所在对话块中前 before 条、后 after 条消息，返回 [Message]"""
+    sql = """
+        SELECT u.qq, c.username, c.text, c.ts
+        FROM messages m
+        JOIN messages c ON c.block_id = m.block_id AND c.seq BETWEEN m.seq - ? AND m.seq + ?
+        JOIN users u ON u.id = c.user_id
+        WHERE m.id = ?
+        ORDER BY c.seq
+    """
+    return [Message(*row) for row in conn.execute(sql, (before, after, message_id))]
+
+def search_messages(conn, query, limit=20):
+    """全文搜索消息文本，返回 [(message_id, qq, username, ts, text)]"""
+    sql = """
+        SELECT m.id, u.qq, m.username, m.ts, m.text
+        FROM messages m JOIN users u ON u.id = m.user_id
+    """
+    if len(query) >= 3:
+        # trigram 索引至少需要3个字符
+        sql += " WHERE m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)"
+        query = '"' + query.replace('"', '""') + '"'
+    else:
+        # LIKE 的通配符 % 和 _ 按普通字符匹配
+        sql += " WHERE m.text LIKE '%' || ? || '%' ESCAPE '\\'"
+        query = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    sql += " ORDER BY m.ts LIMIT ?"
+    return conn.execute(sql, (query, limit)).fetchall()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟的 OpenAI API（只实现本项目用到的接口），不联网、不花钱地测试训练流程
+- POST /v1/files：multipart 上传文件
+- POST /v1/uploads、/v1/uploads/{id}/parts、/v1/uploads/{id}/complete：分片上传
+- POST /v1/fine_tuning/jobs：创建微调任务
+- POST /v1/chat/completions：等待 server.chat_latency 秒后返回一条固定格式的回复
+- GET  /v1/fine_tuning/jobs/{id}：任务状态，按创建后经过的时间推进：
+  validating_files -> queued -> running（每步一个事件）-> succeeded
+- GET  /v1/fine_tuning/jobs/{id}/events?after=&limit=：事件列表，和 OpenAI 一样按时间倒序分页
+- HTTP/1.1 keep-alive，客户端可以复用连接；server.connections 是建立过的连接数
+- 所有请求都要带 Authorization: Bearer ...，否则返回 401
+- 故障注入（测试重试）：server.fail_requests = N 让接下来 N 个 POST 返回 503，
+  server.drop_requests = N 让接下来 N 个 POST 读到一半直接断开连接
+
+用法：python mock_openai.py --port 8000，然后把 OPENAI_API_BASE 设为 http://127.0.0.1:8000/v1；
+脚本里可以用 start_server() 在后台线程启动，server.base_url 是接口地址
+"""
+
+import argparse, hashlib, json, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# 任务各阶段的默认时长（秒）
+VALIDATE_SECONDS = 2
+QUEUE_SECONDS = 5
+STEP_SECONDS = 1
+TRAINING_STEPS = 10
+CHAT_LATENCY = 0.05
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, validate_seconds=VALIDATE_SECONDS, queue_seconds=QUEUE_SECONDS,
+                 step_seconds=STEP_SECONDS, steps=TRAINING_STEPS, chat_latency=CHAT_LATENCY):
+        super().__init__(address, MockHandler)
+        self.timing = (validate_seconds, queue_seconds, step_seconds, steps)
+        self.jobs = {}
+        self.files = {}
+        self.uploads = {}
+        self.chat_latency = chat_latency
+        self.requests = 0  # 收到的请求数，测试时用来确认轮询频率
+        self.connections = 0
+        self.chats = 0
+        self.fail_requests = 0
+        self.drop_requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def create_file(self, filename, purpose, data):
+        with self.lock:
+            file_id = f"file-mock{len(self.files) + 1:04d}"
+            self.files[file_id] = {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                                   "filename": filename, "purpose": purpose, "status": "processed",
+                                   "md5": hashlib.md5(data).hexdigest()}  # md5 不是 OpenAI 的字段，测试时用来校验内容
+        return self.files[file_id]
+
+    def take_fault(self, name):
+        """故障计数大于 0 时减一并返回 True"""
+        with self.lock:
+            if getattr(self, name) > 0:
+                setattr(self, name, getattr(self, name) - 1)
+                return True
+        return False
+
+    def create_job(self, payload):
+        with self.lock:
+            job_id = f"ftjob-mock{len(self.jobs) + 1:04d}"
+            self.jobs[job_id] = {
+                "id": job_id,
+                "object": "fine_tuning.job",
+                "model": payload.get("model", "gpt-3.5-turbo"),
+                "training_file": payload.get("training_file"),
+                "hyperparameters": payload.get("hyperparameters", {}),
+                "created_at": time.time(),
+            }
+        return self.job_view(job_id)[0]
+
+    def job_view(self, job_id):
+        """按经过的时间算出任务当前的状态和已经发生的事件（按时间顺序）"""
+        job = self.jobs[job_id]
+        validate, queue, step, steps = self.timing
+        created = job["created_at"]
+        elapsed = time.time() - created
+        model = f"ft:{job['model']}:mock::{job_id[-4:]}"
+        timeline = [(0, "info", f"Validating training file: {job['training_file']}"),
+                    (validate, "info", "Files validated, moving job to queued state"),
+                    (validate + queue, "info", "Fine-tuning job started")]
+        for k in range(1, steps + 1):
+            loss = 2.0 / (1 + k)
+            timeline.append((validate + queue + k * step, "metrics", f"Step {k}/{steps}: training loss={loss:.4f}"))
+        done = validate + queue + (steps + 1) * step
+        timeline += [(done, "info", f"New fine-tuned model created: {model}"),
+                     (done, "info", "The job has successfully completed")]
+
+        if elapsed < validate:
+            status = "validating_files"
+        elif elapsed < validate + queue:
+            status = "queued"
+        elif elapsed < done:
+            status = "running"
+        else:
+            status = "succeeded"
+        events = [{"object": "fine_tuning.job.event", "id": f"ftevent-{job_id[-4:]}-{n:04d}",
+                   "created_at": int(created + offset), "level": level, "message": message}
+                  for n, (offset, level, message) in enumerate(timeline) if offset <= elapsed]
+        view = dict(job, status=status, created_at=int(created),
+                    fine_tuned_model=model if status == "succeeded" else None,
+                    finished_at=int(created + done) if status == "succeeded" else None)
+        return view, events
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "MockOpenAI/1.0"
+    protocol_version = "HTTP/1.1"
+    # 头和正文分两次写，keep-alive 连接上不关 Nagle 会碰上延迟确认，每个回复多等 40ms
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        # keep-alive 连接上没读完的请求体会被当成下一个请求，回复之前先读掉
+        if self.command == "POST" and not self._consumed:
+            self._read_body()
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message):
+        self._send(status, {"error": {"message": message, "type": "invalid_request_error"}})
+
+    def _authorized(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._error(401, "Missing bearer authentication")
+            return False
+        return True
+
+    def _read_body(self):
+        self._consumed = True
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _read_json(self):
+        return json.loads(self._read_body() or b'{}')
+
+    def _read_multipart(self):
+        """multipart/form-data -> {字段名: (文件名或 None, 内容 bytes)}"""
+        match = re.search(r'boundary="?([^";]+)"?', self.headers.get("Content-Type", ""))
+        if not match:
+            return {}
+        fields = {}
+        for part in self._read_body().split(b'--' + match.group(1).encode())[1:-1]:
+            head, _, data = part[2:].partition(b'\r\n\r\n')
+            head = head.decode('utf-8')
+            name = re.search(r'name="([^"]*)"', head).group(1)
+            filename = re.search(r'filename="([^"]*)"', head)
+            fields[name] = (filename and filename.group(1), data[:-2])
+        return fields
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if parts[:3] != ['v1', 'fine_tuning', 'jobs'] or len(parts) not in (4, 5):
+            return self._error(404, f"Unknown path {url.path}")
+        job_id = parts[3]
+        if job_id not in self.server.jobs:
+            return self._error(404, f"No such fine-tuning job: {job_id}")
+        view, events = self.server.job_view(job_id)
+        if len(parts) == 4:
+            return self._send(200, view)
+        if parts[4] != 'events':
+            return self._error(404, f"Unknown path {url.path}")
+
+        # 事件按时间倒序，after 是上一页最后一个事件的ID
+        query = parse_qs(url.query)
+        limit = int(query.get("limit", ["20"])[0])
+        events = events[::-1]
+        after = query.get("after", [None])[0]
+        if after is not None:
+            ids = [event["id"] for event in events]
+            events = events[ids.index(after) + 1:] if after in ids else []
+        self._send(200, {"object": "list", "data": events[:limit], "has_more": len(events) > limit})
+
+    def do_POST(self):
+        self._consumed = False
+        if not self._authorized():
+            return
+        path = urlparse(self.path).path.rstrip('/')
+        if self.server.take_fault("drop_requests"):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0) // 2)
+            self.close_connection = True
+            return
+        if self.server.take_fault("fail_requests"):
+            self._read_body()
+            return self._error(503, "The server is overloaded, please retry")
+
+        if path == '/v1/files':
+            fields = self._read_multipart()
+            if "file" not in fields:
+                return self._error(400, "file is required")
+            filename, data = fields["file"]
+            return self._send(200, self.server.create_file(filename, fields.get("purpose", (None, b''))[1].decode(), data))
+        if path == '/v1/uploads':
+            payload = self._read_json()
+            with self.server.lock:
+                upload_id = f"upload_mock{len(self.server.uploads) + 1:04d}"
+                upload = self.server.uploads[upload_id] = dict(payload, id=upload_id, object="upload",
+                                                               status="pending", parts={})
+            return self._send(200, {k: v for k, v in upload.items() if k != "parts"})
+        match = re.fullmatch(r'/v1/uploads/([^/]+)/(parts|complete)', path)
+        if match:
+            upload = self.server.uploads.get(match.group(1))
+            if upload is None or upload["status"] != "pending":
+                self._read_body()
+                return self._error(404, f"No pending upload: {match.group(1)}")
+            if match.group(2) == 'parts':
+                fields = self._read_multipart()
+                if "data" not in fields:
+                    return self._error(400, "data is required")
+                with self.server.lock:
+                    part_id = f"part_{upload['id'][-4:]}_{len(upload['parts']) + 1:04d}"
+                    upload["parts"][part_id] = fields["data"][1]
+                return self._send(200, {"id": part_id, "object": "upload.part", "upload_id": upload["id"]})
+            part_ids = self._read_json().get("part_ids", [])
+            if any(part_id not in upload["parts"] for part_id in part_ids):
+                return self._error(400, "Unknown part id")
+            data = b''.join(upload["parts"][part_id] for part_id in part_ids)
+            if len(data) != upload["bytes"]:
+                return self._error(400, f"Upload has {len(data)} bytes, expected {upload['bytes']}")
+            upload["status"] = "completed"
+            file = self.server.create_file(upload["filename"], upload["purpose"], data)
+            return self._send(200, dict({k: v for k, v in upload.items() if k != "parts"}, file=file))
+
+        if path == '/v1/chat/completions':
+            payload = self._read_json()
+            time.sleep(self.server.chat_latency)
+            prompt = (payload.get("messages") or [{}])[-1].get("content", "")
+            with self.server.lock:
+                self.server.chats += 1
+                completion_id = f"chatcmpl-mock{self.server.chats:06d}"
+            return self._send(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": f"dds {len(prompt)}"}}],
+                "usage": {"prompt_tokens": len(prompt), "completion_tokens": 2, "total_tokens": len(prompt) + 2},
+            })
+        if path == '/v1/fine_tuning/jobs':
+            payload = self._read_json()
+            if not payload.get("training_file"):
+                return self._error(400, "training_file is required")
+            return self._send(200, self.server.create_job(payload))
+        self._error(404, f"Unknown path {path}")
+
+def start_server(host="127.0.0.1", port=0, **timing):
+    """在后台线程启动模拟服务器（port=0 时随机选择端口），返回服务器对象，用完调用 shutdown()"""
+    server = MockOpenAIServer((host, port), **timing)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--validate-seconds", type=float, default=VALIDATE_SECONDS, help="校验文件阶段的时长")
+    parser.add_argument("--queue-seconds", type=float, default=QUEUE_SECONDS, help="排队阶段的时长")
+    parser.add_argument("--step-seconds", type=float, default=STEP_SECONDS, help="每个训练步的时长")
+    parser.add_argument("--steps", type=int, default=TRAINING_STEPS, help="训练步数")
+    parser.add_argument("--chat-latency", type=float, default=CHAT_LATENCY, help="聊天接口每次回复的延迟（秒）")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer((args.host, args.port), args.validate_seconds, args.queue_seconds,
+                              args.step_seconds, args.steps, args.chat_latency)
+    print(f"🧪 模拟 OpenAI API 已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 已停止")
@@ -5,13 +5,14 @@
 用于测试已训练好的模型的聊天效果
 """
 
-from model_train import OpenAIChatBot
-import json
+from model_train import OpenAIChatBot, API_BASE
+from response_cache import ResponseCache, RESPONSE_CACHE_FILE
+import asyncio, json
 
 # 从配置文件读取API密钥
 try:
-    from config import OPENAI_API_KEY
-    API_KEY = OPENAI_API_KEY
+    import config
+    API_KEY = config.OPENAI_API_KEY
 except ImportError:
     print("❌ 未找到config.py文件！")
     print("请复制config_template.py为config.py并填入您的API密钥")
@@ -20,10 +21,15 @@ except ImportError:
 # 已训练好的模型ID
 TRAINED_MODEL_ID = "ft:gpt-3.5-turbo-0125:personal::BiA2Eytr"
 
+# 回复缓存（默认关闭，在 config.py 里设置 CHAT_CACHE = True 开启）：同样的上下文不重复付费调用；
+# 每个上下文先攒 CHAT_CACHE_SAMPLES 条不同的回复，之后从中随机复用
+CACHE_SAMPLES = getattr(config, "CHAT_CACHE_SAMPLES", 3)
+chat_cache = ResponseCache(RESPONSE_CACHE_FILE, samples_per_key=CACHE_SAMPLES) if getattr(config, "CHAT_CACHE", False) else None
+
 def test_chat():
     """测试聊天功能"""
     # 创建聊天机器人实例
-    bot = OpenAIChatBot(API_KEY)
+    bot = OpenAIChatBot(API_KEY, API_BASE, cache=chat_cache)
     bot.fine_tuned_model_id = TRAINED_MODEL_ID
     
     print(f"🤖 使用模型: {TRAINED_MODEL_ID}")
@@ -58,9 +64,13 @@ def test_chat():
         }
     ]
     
-    for i, case in enumerate(test_cases, 1):
+    # 所有场景的请求同时发出，共用一个连接池
+    async def run_cases():
+        return await asyncio.gather(*(bot.achat(case["group"], case["history"], case["friend"]) for case in test_cases))
+    responses = asyncio.run(run_cases())
+
+    for i, (case, response) in enumerate(zip(test_cases, responses), 1):
         print(f"\n--- 测试场景 {i} ---")
-        response = bot.chat(case["group"], case["history"], case["friend"])
         print(f"群组: {case['group']}")
         print(f"对话对象: {case['friend'] or '未知'}")
         print(f"历史: {case['history']}")
@@ -69,7 +79,7 @@ def test_chat():
 
 def interactive_chat():
     """交互式聊天"""
-    bot = OpenAIChatBot(API_KEY)
+    bot = OpenAIChatBot(API_KEY, API_BASE, cache=chat_cache)
     bot.fine_tuned_model_id = TRAINED_MODEL_ID
     
     print("🎯 进入交互式聊天模式")
@@ -135,7 +145,7 @@ def interactive_chat():
 
 def test_specific_friends():
     """测试与特定朋友的对话模式"""
-    bot = OpenAIChatBot(API_KEY)
+    bot = OpenAIChatBot(API_KEY, API_BASE, cache=chat_cache)
     bot.fine_tuned_model_id = TRAINED_MODEL_ID
     
     print("🎯 测试与特定朋友的对话模式")
@@ -209,3 +219,5 @@ if __name__ == "__main__":
         print("\n👋 再见！")
     except Exception as e:
         print(f"❌ 出错了: {e}")
+    if chat_cache is not None:
+        print(f"🗃️ {chat_cache.report()}")
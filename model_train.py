@@ -1,13 +1,21 @@
-import requests, time, json
+import argparse, asyncio, requests, json
+from openai_http import OPENAI_API_BASE, make_session, request_with_retry
+from file_upload import upload_file
+from finetune_monitor import JobMonitor, JOBS_FILE, TERMINAL_STATUSES
+from chat_client import ChatClient, DEFAULT_CONCURRENCY
+from response_cache import response_key
 
 # OpenAI GPT-3.5-turbo 聊天机器人类
 class OpenAIChatBot:
-    def __init__(self, api_key):
+    def __init__(self, api_key, base_url=OPENAI_API_BASE, max_concurrency=DEFAULT_CONCURRENCY, requests_per_minute=None,
+                 cache=None):
         self.api_key = api_key
-        self.headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+        self.base_url = base_url.rstrip('/')
+        # 上传和创建任务共用一个 keep-alive 连接池；聊天（同步和异步）共用 ChatClient 的连接池
+        self.session = make_session(api_key)
+        self.client = ChatClient(api_key, self.base_url, max_concurrency, requests_per_minute=requests_per_minute)
+        # 可选的回复缓存（response_cache.ResponseCache），同样的请求不重复调用 API
+        self.cache = cache
         self.fine_tuned_model_id = None
         self.chat_patterns = {}
         
@@ -24,28 +32,15 @@ class OpenAIChatBot:
         print(f"📤 上传训练数据文件: {filename}")
         
         try:
-            with open(filename, "rb") as f:
-                files = {"file": f}
-                data = {"purpose": "fine-tune"}
-                
-                response = requests.post(
-                    "https://api.openai.com/v1/files", 
-                    headers={"Authorization": f"Bearer {self.api_key}"},
-                    files=files,
-                    data=data
-                )
-                
-            if response.status_code == 200:
-                file_id = response.json()["id"]
-                print(f"✅ 文件上传成功，ID: {file_id}")
-                return file_id
-            else:
-                print(f"❌ 文件上传失败: {response.status_code} - {response.text}")
-                return None
-                
+            file = upload_file(self.session, self.base_url, filename)
+            print(f"✅ 文件上传成功，ID: {file['id']}")
+            return file["id"]
         except FileNotFoundError:
             print(f"❌ 找不到训练数据文件: {filename}")
             return None
+        except requests.HTTPError as e:
+            print(f"❌ 文件上传失败: {e.response.status_code} - {e.response.text}")
+            return None
         except Exception as e:
             print(f"❌ 上传过程中出错: {e}")
             return None
@@ -61,11 +56,19 @@ class OpenAIChatBot:
             }
         }
         
-        response = requests.post(
-            "https://api.openai.com/v1/fine_tuning/jobs", 
-            headers=self.headers, 
-            json=payload
-        )
+        # 创建任务不幂等：服务器已经接受但响应超时的请求再发一次就是第二个（要付费的）任务，
+        # 所以只重试连接没建立起来和 429 限流的情况
+        try:
+            response = request_with_retry(
+                self.session, "POST",
+                f"{self.base_url}/fine_tuning/jobs", 
+                json=payload,
+                idempotent=False
+            )
+        except requests.RequestException as e:
+            print(f"❌ 微调任务创建失败: {e}")
+            print("请求可能已经被服务器接受，重新创建之前请先在 OpenAI 控制台确认没有重复的任务")
+            return None
         
         if response.status_code == 200:
             ft_id = response.json()["id"]
@@ -75,45 +78,32 @@ class OpenAIChatBot:
             print(f"❌ 微调任务创建失败: {response.status_code} - {response.text}")
             return None
     
-    def wait_for_completion(self, ft_id):
-        """等待训练完成"""
+    def wait_for_completion(self, ft_id, state_file=JOBS_FILE):
+        """等待训练完成：异步监控任务状态并实时打印训练事件，进程中断后重新调用会从保存的状态继续
+
+        只等待 ft_id 这一个任务；状态文件里其他没有结束的任务用 finetune_monitor.py 继续跟踪
+        """
         print("⏳ 等待训练完成...")
-        check_count = 0
-        
-        while True:
-            try:
-                response = requests.get(
-                    f"https://api.openai.com/v1/fine_tuning/jobs/{ft_id}", 
-                    headers=self.headers
-                )
-                
-                if response.status_code == 200:
-                    job_data = response.json()
-                    status = job_data["status"]
-                    
-                    print(f"📊 当前状态: {status} (检查次数: {check_count + 1})")
-                    
-                    if status == "succeeded":
-                        model_id = job_data.get("fine_tuned_model")
-                        self.fine_tuned_model_id = model_id
-                        print(f"🎉 训练完成！模型ID: {model_id}")
-                        return model_id
-                    elif status == "failed":
-                        error = job_data.get("error", "未知错误")
-                        print(f"❌ 训练失败: {error}")
-                        return None
-                    elif status in ["cancelled", "canceled"]:
-                        print("⚠️ 训练被取消")
-                        return None
-                        
-                else:
-                    print(f"⚠️ 检查状态失败: {response.status_code}")
-                    
-            except Exception as e:
-                print(f"⚠️ 检查状态时出错: {e}")
-            
-            check_count += 1
-            time.sleep(60)  # 每分钟检查一次
+        monitor = JobMonitor(self.api_key, self.base_url, state_file)
+        try:
+            job = asyncio.run(monitor.watch(ft_id))
+        finally:
+            monitor.close()
+
+        status = job["status"]
+        if status == "succeeded":
+            model_id = job["fine_tuned_model"]
+            self.fine_tuned_model_id = model_id
+            print(f"🎉 训练完成！模型ID: {model_id}")
+            return model_id
+        elif status in ("cancelled", "canceled"):
+            print("⚠️ 训练被取消")
+        elif status not in TERMINAL_STATUSES:
+            print(f"⚠️ 多次查询失败: {job.get('error')}")
+            print(f"稍后运行 python finetune_monitor.py {ft_id} 继续等待")
+        else:
+            print(f"❌ 训练失败: {job.get('error') or '未知错误'}")
+        return None
     
     def generate_context_prompt(self, chat_group, conversation_history, target_friend=None):
         """根据聊天对象和历史生成上下文提示"""
@@ -132,69 +122,127 @@ class OpenAIChatBot:
             
         return system_content, user_content
     
+    def _chat_payload(self, chat_group, conversation_history, target_friend, max_tokens):
+        system_content, user_content = self.generate_context_prompt(chat_group, conversation_history, target_friend)
+        return {
+            "model": self.fine_tuned_model_id,
+            "messages": [
+                {"role": "system", "content": system_content},
+                {"role": "user", "content": user_content}
+            ],
+            "max_tokens": max_tokens,
+            "temperature": 0.8,
+            "stop": ["\n", ":", "："]
+        }
+
+    def _cache_lookup(self, payload):
+        """(缓存键, 缓存的回复)；没有开启缓存时都是 None"""
+        if self.cache is None:
+            return None, None
+        key = response_key(payload)
+        return key, self.cache.get(key)
+
+    def _cache_store(self, key, reply):
+        if key is not None and reply:
+            self.cache.put(key, reply)
+
+    def _reply(self, response):
+        if response.status_code == 200:
+            return response.json()["choices"][0]["message"]["content"].strip()
+        print(f"❌ 生成回复失败: {response.status_code} - {response.text}")
+        return None
+
     def chat(self, chat_group, conversation_history, target_friend=None, max_tokens=50):
-        """智能聊天回复"""
+        """智能聊天回复（同步，和 achat 共用连接池）"""
         if not self.fine_tuned_model_id:
             print("❌ 请先完成模型微调")
             return None
         
-        system_content, user_content = self.generate_context_prompt(chat_group, conversation_history, target_friend)
-        
+        payload = self._chat_payload(chat_group, conversation_history, target_friend, max_tokens)
+        key, reply = self._cache_lookup(payload)
+        if reply is not None:
+            return reply
         try:
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=self.headers,
-                json={
-                    "model": self.fine_tuned_model_id,
-                    "messages": [
-                        {"role": "system", "content": system_content},
-                        {"role": "user", "content": user_content}
-                    ],
-                    "max_tokens": max_tokens,
-                    "temperature": 0.8,
-                    "stop": ["\n", ":", "："]
-                }
-            )
-            
-            if response.status_code == 200:
-                return response.json()["choices"][0]["message"]["content"].strip()
-            else:
-                print(f"❌ 生成回复失败: {response.status_code} - {response.text}")
-                return None
-                
+            reply = self._reply(self.client.complete(payload))
+        except Exception as e:
+            print(f"❌ 聊天时出错: {e}")
+            return None
+        self._cache_store(key, reply)
+        return reply
+
+    async def achat(self, chat_group, conversation_history, target_friend=None, max_tokens=50):
+        """智能聊天回复（异步）：多个群的回复可以同时在途，例如 await asyncio.gather(*(bot.achat(...) for ...))"""
+        if not self.fine_tuned_model_id:
+            print("❌ 请先完成模型微调")
+            return None
+
+        payload = self._chat_payload(chat_group, conversation_history, target_friend, max_tokens)
+        key, reply = self._cache_lookup(payload)
+        if reply is not None:
+            return reply
+        try:
+            reply = self._reply(await self.client.acomplete(payload))
         except Exception as e:
             print(f"❌ 聊天时出错: {e}")
             return None
+        self._cache_store(key, reply)
+        return reply
 
 # 从配置文件读取API密钥
 try:
-    from config import OPENAI_API_KEY
-    API_KEY = OPENAI_API_KEY
+    import config
+    API_KEY = config.OPENAI_API_KEY
+    API_BASE = getattr(config, "OPENAI_API_BASE", OPENAI_API_BASE)
 except ImportError:
     print("❌ 未找到config.py文件！")
     print("请复制config_template.py为config.py并填入您的API密钥")
     exit(1)
 
-bot = OpenAIChatBot(API_KEY)
+bot = OpenAIChatBot(API_KEY, API_BASE)
 
 # 完整的训练流程
-def train_chatbot():
-    """完整的训练流程"""
+def train_chatbot(data_file="deepseek_data_final.jsonl", n_epochs=3, budget_tokens=None, budget_usd=None, validate=True):
+    """完整的训练流程
+
+    validate: 上传前先用 dataset_validator 在本地检查数据，只上传清理后的有效样本
+    budget_tokens / budget_usd: 指定时先用 dataset_budget 按预算挑选样本，只上传选中的子集
+    """
     print("🎯 开始训练雷🐷🐷聊天机器人 (使用GPT-3.5-turbo)...")
+
+    # 0. 本地检查数据格式，不等上传、排队之后才被拒绝
+    if validate:
+        from dataset_validator import validate_dataset, print_report as print_validation
+        try:
+            report = validate_dataset(data_file)
+        except FileNotFoundError:
+            print(f"❌ 找不到训练数据文件: {data_file}")
+            return None
+        print_validation(report)
+        if not report["ok"]:
+            print("❌ 训练终止：数据检查未通过")
+            return None
+        data_file = report["output"]
+
+    # 1. 按预算挑选样本，在上传之前控制训练费用和时间
+    if budget_tokens is not None or budget_usd is not None:
+        from dataset_budget import select_within_budget, print_report
+        report = select_within_budget(data_file, tokens=budget_tokens, usd=budget_usd, epochs=n_epochs)
+        print_report(report, n_epochs)
+        data_file = report["output"]
     
-    # 1. 上传训练数据
-    file_id = bot.upload_training_data("deepseek_data_final.jsonl")
+    # 2. 上传训练数据
+    file_id = bot.upload_training_data(data_file)
     if not file_id:
         print("❌ 训练终止：文件上传失败")
         return None
     
-    # 2. 创建微调任务
-    ft_id = bot.create_fine_tune(file_id, model="gpt-3.5-turbo", n_epochs=3)
+    # 3. 创建微调任务
+    ft_id = bot.create_fine_tune(file_id, model="gpt-3.5-turbo", n_epochs=n_epochs)
     if not ft_id:
         print("❌ 训练终止：微调任务创建失败")
         return None
     
-    # 3. 等待训练完成
+    # 4. 等待训练完成
     model_id = bot.wait_for_completion(ft_id)
     if model_id:
         print("🎉 训练完成！现在可以开始聊天了")
@@ -212,12 +260,20 @@ def train_chatbot():
 # 注意：聊天测试功能已移至 model_test.py 文件
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="微调聊天机器人")
+    parser.add_argument("--data", default="deepseek_data_final.jsonl", help="训练数据文件（默认 deepseek_data_final.jsonl）")
+    parser.add_argument("--epochs", type=int, default=3, help="训练轮数（默认3）")
+    parser.add_argument("--budget-tokens", type=int, help="训练文件的 token 上限，超出时按预算挑选样本")
+    parser.add_argument("--budget-usd", type=float, help="训练费用上限（美元），超出时按预算挑选样本")
+    parser.add_argument("--no-validate", action="store_true", help="上传前不检查数据格式")
+    args = parser.parse_args()
+
     print("🤖 OpenAI GPT-3.5-turbo 聊天机器人训练系统")
     print("=" * 50)
     
     # 直接开始训练
     print("🚀 自动开始训练...")
-    model_id = train_chatbot()
+    model_id = train_chatbot(args.data, args.epochs, args.budget_tokens, args.budget_usd, not args.no_validate)
     
     if model_id:
         print(f"\n🎉 训练完成！模型ID: {model_id}")
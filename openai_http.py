@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenAI API 的 HTTP 公共部分
+- make_session：带连接池的 keep-alive 会话，同一进程里的请求复用 TCP/TLS 连接
+- request_with_retry：连接错误、超时和 408/409/429/5xx 按指数退避重试（带随机抖动，
+  服务器给了 Retry-After 时按它等待）；请求体是只能读一次的流时，传入生成请求体的函数，每次尝试重新生成
+- 不幂等的请求（创建微调任务、创建分片上传）传 idempotent=False：只在确定服务器没有处理时重试
+  （连接没有建立起来，或者被 429 限流拒绝），读取超时、5xx 之后重发可能重复创建
+"""
+
+import random, time
+import requests
+from requests.adapters import HTTPAdapter
+
+OPENAI_API_BASE = "https://api.openai.com/v1"
+POOL_SIZE = 8
+RETRY_STATUSES = (408, 409, 429, 500, 502, 503, 504)
+# 不幂等的请求只重试这些：请求肯定没有被处理
+SAFE_RETRY_STATUSES = (429,)
+SAFE_RETRY_ERRORS = (requests.ConnectTimeout,)
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60
+REQUEST_TIMEOUT = 60
+
+def make_session(api_key, pool_size=POOL_SIZE):
+    """带认证头和连接池（每个主机最多保持 pool_size 个连接）的会话"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Authorization"] = f"Bearer {api_key}"
+    return session
+
+def retry_delay(attempt, response=None, backoff=BACKOFF_SECONDS):
+    """第 attempt 次（从 0 开始）失败后等待的秒数"""
+    if response is not None:
+        try:
+            return min(float(response.headers["Retry-After"]), MAX_BACKOFF_SECONDS)
+        except (KeyError, ValueError):
+            pass
+    return min(MAX_BACKOFF_SECONDS, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def request_with_retry(session, method, url, retries=MAX_RETRIES, backoff=BACKOFF_SECONDS,
+                       body=None, on_retry=None, idempotent=True, **kwargs):
+    """发送请求，遇到临时错误时重试，返回最后一次的响应（不检查状态码）
+
+    body: 返回请求体的函数（流式读取的文件这类只能读一次的请求体），每次尝试调用一次
+    on_retry(第几次重试, 错误): 每次重试之前调用
+    idempotent: 为 False 时只重试连接超时和 429（SAFE_RETRY_ERRORS / SAFE_RETRY_STATUSES）
+    重试用完后（或不能重试的）连接错误照常抛出
+    """
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    statuses = RETRY_STATUSES if idempotent else SAFE_RETRY_STATUSES
+    errors = (requests.ConnectionError, requests.Timeout) if idempotent else SAFE_RETRY_ERRORS
+    for attempt in range(retries + 1):
+        if body is not None:
+            kwargs["data"] = body()
+        try:
+            response = session.request(method, url, **kwargs)
+        except errors as e:
+            if attempt == retries:
+                raise
+            error, response = e, None
+        else:
+            if response.status_code not in statuses or attempt == retries:
+                return response
+            error = f"HTTP {response.status_code}"
+        if on_retry:
+            on_retry(attempt + 1, error)
+        time.sleep(retry_delay(attempt, response, backoff))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量化、可累加的聊天模式统计
+- 互动记录先展开成扁平数组：朋友编码、群组编码、回复长度、标记数（[ 🐷 愚蠢）、小时
+- 一批互动记录用 bincount 一次算出所有朋友的次数、和、24 小时分布、分群组统计
+- 每个朋友保存可合并的累计量：次数、和、平方和（整数，方差可以精确合并）、长度直方图（精确分位数）、常用短语摘要
+- 常用短语没有向量化：切短语仍是 Python 逐条处理（同一批里相同的回复只切一次），是 update 剩下的主要耗时；
+  计数交给 Counter，每个朋友每批只和累计的摘要合并一次，不再逐条调用 SpaceSaving.add
+- 累计量保存在 chat_patterns_*.json 旁边，新的一批互动记录只需要合并这一批；
+  子进程的部分结果合并后与一次算完的结果一致
+- 回复时延和轮次长度（reply_timing.py）来自对话块，随累计量一起保存、合并
+"""
+
+import json, os
+import numpy as np
+from collections import Counter
+from itertools import chain, repeat
+from operator import itemgetter
+from phrases import SpaceSaving, phrases, DEFAULT_CAPACITY
+from reply_timing import ReplyTiming
+
+# emoji_usage 统计的标记（沿用原来的三个 str.count）
+MARKERS = ('[', '🐷', '愚蠢')
+QUANTILES = (0.25, 0.5, 0.75, 0.9)
+AGGREGATES_SUFFIX = '.aggregates.json'
+TOP_WORDS = 5
+
+def _text_columns(texts):
+    """回复长度和标记数；numpy 2 的变长字符串数组可以直接在 C 里计数"""
+    if hasattr(np, 'strings'):
+        arr = np.array(texts, dtype=np.dtypes.StringDType())
+        lengths = np.strings.str_len(arr).astype(np.int64)
+        markers = sum(np.strings.count(arr, marker) for marker in MARKERS).astype(np.int64)
+    else:
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        markers = np.fromiter((sum(text.count(marker) for marker in MARKERS) for text in texts),
+                              dtype=np.int64, count=len(texts))
+    return lengths, markers
+
+def interaction_arrays(user_interactions):
+    """{朋友: [互动记录]} -> (朋友列表, 群组列表, 列数组字典)
+
+    互动记录需要 "response"，可选 "group" 和 "ts"（没有时小时记为 -1）
+    """
+    friends = list(user_interactions)
+    sizes = np.fromiter(map(len, user_interactions.values()), dtype=np.int64, count=len(friends))
+    # 展开时只用 map + C 实现的函数，避免逐条执行 Python 字节码
+    records = list(chain.from_iterable(user_interactions.values()))
+    group_names = list(map(dict.get, records, repeat("group")))
+    groups = {group: code for code, group in enumerate(dict.fromkeys(group_names))}
+    group_codes = np.fromiter(map(groups.__getitem__, group_names), dtype=np.int64, count=len(records))
+    lengths, markers = _text_columns(list(map(itemgetter("response"), records)))
+    ts = np.fromiter(map(dict.get, records, repeat("ts"), repeat(-1)), dtype=np.int64, count=len(records))
+    columns = {
+        "friend": np.repeat(np.arange(len(friends)), sizes),
+        "group": group_codes,
+        "length": lengths,
+        "markers": markers,
+        "hour": np.where(ts >= 0, ts // 3600 % 24, -1),
+    }
+    return friends, list(groups), columns
+
+def histogram_quantiles(histogram, quantiles=QUANTILES):
+    """{值: 次数} 的分位数（线性插值，与 np.quantile 默认方法一致）"""
+    values = np.array(sorted(histogram), dtype=np.float64)
+    cumulative = np.cumsum([histogram[v] for v in sorted(histogram)])
+    n = cumulative[-1]
+    result = []
+    for q in quantiles:
+        pos = q * (n - 1)
+        low = int(np.floor(pos))
+        high = min(low + 1, n - 1)
+        at = np.searchsorted(cumulative, [low, high], side='right')
+        result.append(float(values[at[0]] + (values[at[1]] - values[at[0]]) * (pos - low)))
+    return result
+
+def variance(n, total, squares):
+    """由整数的 (次数, 和, 平方和) 算总体方差
+
+    回复长度都是整数，三个累计量用整数精确相加，再一次性算出方差；
+    相当于 Welford / Chan 并行合并公式的精确版本，按什么顺序、分几批合并结果都完全相同。
+    """
+    return (n * squares - total * total) / (n * n)
+
+class PatternAggregates:
+    """所有朋友的聊天模式累计量，update() 合并一批互动记录，merge() 合并另一份累计量"""
+
+    def __init__(self, words_capacity=DEFAULT_CAPACITY):
+        self.words_capacity = words_capacity
+        self.friends = []
+        self.groups = []
+        self._friend_codes = {}
+        self._group_codes = {}
+        self.count = np.zeros(0, dtype=np.int64)
+        self.length_sum = np.zeros(0, dtype=np.int64)
+        self.marker_sum = np.zeros(0, dtype=np.int64)
+        self.length_squares = np.zeros(0, dtype=np.int64)
+        self.hourly = np.zeros((0, 24), dtype=np.int64)
+        self.cells = np.zeros((0, 0, 3), dtype=np.int64)  # [朋友, 群组, (次数, 长度和, 标记和)]
+        self.length_hist = []  # 每个朋友 {回复长度: 次数}
+        self.words = []  # 每个朋友一个 SpaceSaving
+        self.timing = ReplyTiming()  # 回复时延和轮次长度（来自对话块，不是互动记录）
+
+    def _codes(self, friends, groups):
+        """把名字映射到编码，新出现的朋友和群组追加在末尾"""
+        for name in friends:
+            if name not in self._friend_codes:
+                self._friend_codes[name] = len(self.friends)
+                self.friends.append(name)
+                self.length_hist.append({})
+                self.words.append(SpaceSaving(self.words_capacity))
+        for name in groups:
+            if name not in self._group_codes:
+                self._group_codes[name] = len(self.groups)
+                self.groups.append(name)
+        n_friends, n_groups = len(self.friends), len(self.groups)
+        grow = n_friends - len(self.count)
+        if grow:
+            self.count, self.length_sum, self.marker_sum, self.length_squares = (
+                np.concatenate([a, np.zeros(grow, dtype=np.int64)])
+                for a in (self.count, self.length_sum, self.marker_sum, self.length_squares))
+            self.hourly = np.concatenate([self.hourly, np.zeros((grow, 24), dtype=np.int64)])
+        if self.cells.shape[:2] != (n_friends, n_groups):
+            cells = np.zeros((n_friends, n_groups, 3), dtype=np.int64)
+            cells[:self.cells.shape[0], :self.cells.shape[1]] = self.cells
+            self.cells = cells
+        return (np.array([self._friend_codes[name] for name in friends], dtype=np.int64),
+                np.array([self._group_codes[name] for name in groups], dtype=np.int64))
+
+    def update(self, user_interactions):
+        """合并一批互动记录 {朋友: [互动记录]}，耗时只和这一批的大小有关，返回 self"""
+        friends, groups, col = interaction_arrays(user_interactions)
+        if not len(col["length"]):
+            return self
+        friend_map, group_map = self._codes(friends, groups)
+        friend, group = friend_map[col["friend"]], group_map[col["group"]]
+        length, markers = col["length"], col["markers"]
+        n_friends, n_groups = len(self.friends), len(self.groups)
+
+        # bincount 的浮点权重和在 2^53 以内是精确的整数
+        self.count += np.bincount(friend, minlength=n_friends)
+        for total, weights in ((self.length_sum, length), (self.marker_sum, markers), (self.length_squares, length * length)):
+            total += np.rint(np.bincount(friend, weights=weights, minlength=n_friends)).astype(np.int64)
+
+        timed = col["hour"] >= 0
+        self.hourly += np.bincount(friend[timed] * 24 + col["hour"][timed], minlength=n_friends * 24).reshape(n_friends, 24)
+        cell = friend * n_groups + group
+        for k, weights in enumerate((None, length, markers)):
+            self.cells[:, :, k] += np.rint(np.bincount(cell, weights=weights, minlength=n_friends * n_groups)
+                                           ).astype(np.int64).reshape(n_friends, n_groups)
+
+        base = int(length.max()) + 1
+        pairs, pair_counts = np.unique(friend * base + length, return_counts=True)
+        for code, value, count in zip((pairs // base).tolist(), (pairs % base).tolist(), pair_counts.tolist()):
+            histogram = self.length_hist[code]
+            histogram[value] = histogram.get(value, 0) + count
+
+        # 常用短语：每个不同的回复只切一次短语；每个朋友这一批的短语先用 Counter 精确计数，
+        # 再作为一个摘要合并进累计的摘要（和合并子进程结果的方式一样），不逐条调用 SpaceSaving.add
+        cut = {}
+        for name, code in zip(friends, friend_map.tolist()):
+            responses = list(map(itemgetter("response"), user_interactions[name]))
+            cut.update((text, phrases(text)) for text in dict.fromkeys(responses) if text not in cut)
+            counts = Counter(chain.from_iterable(map(cut.__getitem__, responses)))
+            self.words[code] = self.words[code] + SpaceSaving.from_counts(counts, self.words_capacity)
+        return self
+
+    def merge(self, other):
+        """合并另一份累计量（例如子进程的部分结果），返回 self"""
+        friend_map, group_map = self._codes(other.friends, other.groups)
+        if not len(friend_map):
+            return self
+        self.count[friend_map] += other.count
+        self.length_sum[friend_map] += other.length_sum
+        self.marker_sum[friend_map] += other.marker_sum
+        self.length_squares[friend_map] += other.length_squares
+        self.hourly[friend_map] += other.hourly
+        self.cells[np.ix_(friend_map, group_map)] += other.cells
+        for code, histogram, sketch in zip(friend_map.tolist(), other.length_hist, other.words):
+            mine = self.length_hist[code]
+            for length, count in histogram.items():
+                mine[length] = mine.get(length, 0) + count
+            self.words[code] = self.words[code] + sketch
+        self.timing.merge(other.timing)
+        return self
+
+    def add_timing(self, timing):
+        """合并一份 ReplyTiming（可以为 None），返回 self"""
+        if timing:
+            self.timing.merge(timing)
+        return self
+
+    def patterns(self, min_interactions=3, top_words=TOP_WORDS):
+        """生成 chat_patterns_*.json 的内容 {朋友: 统计}"""
+        has_groups = any(group is not None for group in self.groups)
+        patterns = {}
+        for code in np.flatnonzero(self.count >= min_interactions).tolist():
+            n = int(self.count[code])
+            pattern = {
+                "interaction_count": n,
+                "avg_response_length": int(self.length_sum[code]) / n,
+                "emoji_usage": int(self.marker_sum[code]) / n,
+                "common_words": self.words[code].top(top_words),
+            }
+            present = np.flatnonzero(self.cells[code, :, 0]).tolist()
+            if has_groups:
+                pattern["groups"] = [self.groups[g] for g in present]
+            quantiles = histogram_quantiles(self.length_hist[code])
+            pattern["response_length_quantiles"] = {f"p{round(q * 100)}": v for q, v in zip(QUANTILES, quantiles)}
+            pattern["response_length_std"] = variance(n, int(self.length_sum[code]), int(self.length_squares[code])) ** 0.5
+            if self.hourly[code].any():
+                pattern["hourly_histogram"] = self.hourly[code].tolist()
+                pattern["peak_hour"] = int(self.hourly[code].argmax())
+            if has_groups:
+                pattern["by_group"] = {
+                    self.groups[g]: {
+                        "interaction_count": int(self.cells[code, g, 0]),
+                        "avg_response_length": int(self.cells[code, g, 1]) / int(self.cells[code, g, 0]),
+                        "emoji_usage": int(self.cells[code, g, 2]) / int(self.cells[code, g, 0]),
+                    }
+                    for g in present
+                }
+            timing = self.timing.summary(self.friends[code])
+            if timing is not None:
+                pattern["reply_timing"] = timing
+            patterns[self.friends[code]] = pattern
+        return patterns
+
+    def to_dict(self):
+        return {
+            "words_capacity": self.words_capacity,
+            "friends": self.friends,
+            "groups": self.groups,
+            "count": self.count.tolist(),
+            "length_sum": self.length_sum.tolist(),
+            "marker_sum": self.marker_sum.tolist(),
+            "length_squares": self.length_squares.tolist(),
+            "hourly": self.hourly.tolist(),
+            "cells": self.cells.tolist(),
+            # JSON 的键只能是字符串，直方图保存为 [[长度, 次数], ...]
+            "length_hist": [sorted(histogram.items()) for histogram in self.length_hist],
+            "words": [sketch.to_dict() for sketch in self.words],
+            "timing": self.timing.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregates = cls(data["words_capacity"])
+        aggregates._codes(data["friends"], data["groups"])
+        aggregates.count = np.array(data["count"], dtype=np.int64)
+        aggregates.length_sum = np.array(data["length_sum"], dtype=np.int64)
+        aggregates.marker_sum = np.array(data["marker_sum"], dtype=np.int64)
+        aggregates.length_squares = np.array(data["length_squares"], dtype=np.int64)
+        aggregates.hourly = np.array(data["hourly"], dtype=np.int64).reshape(-1, 24)
+        aggregates.cells = np.array(data["cells"], dtype=np.int64).reshape(len(data["friends"]), len(data["groups"]), 3)
+        aggregates.length_hist = [dict(map(tuple, histogram)) for histogram in data["length_hist"]]
+        aggregates.words = [SpaceSaving.from_dict(sketch) for sketch in data["words"]]
+        aggregates.timing = ReplyTiming.from_dict(data.get("timing", []))
+        return aggregates
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """读取保存的累计量，文件不存在时返回 None"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+
+def aggregates_path(patterns_file):
+    """累计量文件：chat_patterns_final.json -> chat_patterns_final.aggregates.json"""
+    stem, _ = os.path.splitext(patterns_file)
+    return stem + AGGREGATES_SUFFIX
+
+def analyze_interactions(user_interactions, min_interactions=3):
+    """一次性分析 {朋友: [互动记录]}，返回 {朋友: 统计}"""
+    return PatternAggregates().update(user_interactions).patterns(min_interactions)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多目标用户（人设）配置
+- 默认目标是雷🐷🐷，其他用户用通用描述，名字取导出记录里最常用的名字
+- 可以用 JSON 文件覆盖每个目标的名字、描述、系统提示词模板和输出文件:
+  {"QQ号": {"name": "...", "description": "...", "system": "你是{name}...{chat}", "output": "xxx.jsonl"}}
+- 两个处理脚本共用的多目标样本生成和每个目标的数据集写出
+"""
+
+import json, os
+from collections import Counter, defaultdict
+from chat_parser import SYSTEM_PREFIX
+from context_builder import ContextWindow, reply_suffix
+from phrases import PhraseCounter
+
+DEFAULT_TARGET = '3159852227'
+DEFAULT_DESCRIPTION = "一个QQ群聊天用户"
+BUILTIN_PERSONAS = {
+    DEFAULT_TARGET: {"name": "雷🐷🐷", "description": "一个喜欢说'dds'、'愚蠢'、'丢大师'等词汇的QQ群聊天用户"},
+}
+# --targets all 时只为发言数不少于此值的用户生成数据集
+DEFAULT_MIN_MESSAGES = 20
+
+def speaker_names(message_lists):
+    """{QQ号: Counter(名字)}，按发言统计"""
+    names = defaultdict(Counter)
+    for messages in message_lists:
+        for msg in messages:
+            names[msg.user_id][msg.username] += 1
+    return names
+
+def select_targets(spec, names, min_messages=DEFAULT_MIN_MESSAGES):
+    """解析 --targets：逗号分隔的QQ号，或 all 表示所有发言数足够的用户（按发言数从多到少）"""
+    if spec == 'all':
+        # QQ 的系统提示（入群、撤回等）也带有发言者QQ号，不作为目标
+        counts = {user_id: sum(c.values()) for user_id, c in names.items() if SYSTEM_PREFIX not in c}
+        return [user_id for user_id, count in sorted(counts.items(), key=lambda x: -x[1]) if count >= min_messages]
+    return [target.strip() for target in spec.split(',') if target.strip()]
+
+def load_personas(targets, names, path=None):
+    """为每个目标生成人设 {QQ号: {"name", "description", ...}}
+
+    names: {QQ号: 名字} 或 {QQ号: Counter(名字)}，配置文件里没有名字时使用
+    """
+    config = {}
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    personas = {}
+    for target in targets:
+        persona = {"description": DEFAULT_DESCRIPTION}
+        persona.update(BUILTIN_PERSONAS.get(target, {}))
+        persona.update(config.get(target, {}))
+        if "name" not in persona:
+            name = names.get(target)
+            if isinstance(name, Counter):
+                name = name.most_common(1)[0][0] if name else None
+            persona["name"] = name or target
+        personas[target] = persona
+    return personas
+
+def system_prompt(persona, chat=None):
+    """目标用户的系统消息；chat 不为 None 时加上所在群组"""
+    template = persona.get("system")
+    if template:
+        return template.format(name=persona["name"], chat=chat or '')
+    content = f"你是{persona['name']}，{persona['description']}。"
+    if chat is not None:
+        content += f"你在群组'{chat}'中聊天。"
+    return content
+
+def persona_output(persona, target, output_file):
+    """目标的输出文件：配置里的 output，否则 <输出文件名>.<QQ号>.jsonl"""
+    if persona.get("output"):
+        return persona["output"]
+    stem, ext = os.path.splitext(output_file)
+    return f"{stem}.{target}{ext}"
+
+def make_multi_target_samples(blocks, personas, window=3, skip=0, token_budget=None, count_tokens=None,
+                              stats=None, user_mapping=None):
+    """一次遍历对话块，同时为多个目标用户生成样本
+
+    blocks: [(群组, 对象, 消息列表)]；personas: {目标QQ号: 人设}（见 load_personas），所有目标共用同一个
+    上下文窗口，每条消息只格式化一次。返回 ({目标: 样本列表}, {目标: {对话对象名: 互动记录}})
+    user_mapping 为 None 时使用解析出的用户名，系统消息、样本元数据和互动记录带群组信息，
+    传入 stats 时 stats["group_phrases"] 累加每个 (目标, 群组) 的回复短语频率（PhraseCounter）；
+    传入 {QQ号: 统一名字} 时是统一格式：名字取映射（映射里没有的发言者不进上下文），不带群组信息
+    """
+    grouped = user_mapping is None
+    samples = {target: [] for target in personas}
+    group_phrases = PhraseCounter()
+    user_interactions = {target: defaultdict(list) for target in personas}  # 记录目标用户与每个人的对话
+    suffixes = {target: reply_suffix(persona["name"]) for target, persona in personas.items()}
+    if grouped:
+        render = lambda c: f"{c.username}: {c.text}" if c.text.strip() else None
+        partner = lambda c: (c.user_id, c.username)
+    else:
+        render = lambda c: f"{user_mapping[c.user_id]}: {c.text}" if c.text.strip() and c.user_id in user_mapping else None
+        partner = lambda c: (c.user_id, user_mapping[c.user_id]) if c.user_id in user_mapping else None
+        # 系统消息，不包含群组信息
+        system_contents = {target: system_prompt(persona) for target, persona in personas.items()}
+
+    for group_name, chat_name, blk in blocks:
+        if grouped:
+            # 系统消息，包含群组和角色信息（每个对话块每个目标只生成一次）
+            system_contents = {}
+
+        # 滑动窗口：每条消息只格式化一次
+        ctx = ContextWindow(window, render, partner, token_budget, count_tokens)
+
+        # 提取目标用户与其他用户的对话模式
+        for i, msg in enumerate(blk):
+            text = msg.text
+            target = msg.user_id
+            persona = personas.get(target)
+            if persona is not None and text.strip() and i >= skip:  # 目标用户的发言
+                # 分析对话对象（不包括发言者自己）
+                conversation_partners = [key for key in ctx.partners() if key[0] != target]
+
+                system_content = system_contents.get(target)
+                if system_content is None:
+                    system_content = system_contents[target] = system_prompt(persona, chat_name or '未知群组')
+
+                # 构建messages格式的训练样本
+                messages = [{"role": "system", "content": system_content}]
+
+                # 添加对话历史作为用户消息
+                user_content = ctx.user_content(suffixes[target])
+                if user_content is not None:
+                    messages.append({"role": "user", "content": user_content})
+
+                # 助手回复（目标用户的实际回复）
+                messages.append({"role": "assistant", "content": text})
+
+                # 创建样本
+                metadata = {"group": group_name, "chat": chat_name} if grouped else {}
+                metadata.update(partners=conversation_partners, timestamp=msg.ts)
+                samples[target].append({"messages": messages, "metadata": metadata})
+                if stats is not None:
+                    stats["samples"] = stats.get("samples", 0) + 1
+                    stats["budget_hits"] = stats.get("budget_hits", 0) + ctx.hit_budget()
+                    stats["context_tokens"] = stats.get("context_tokens", 0) + ctx.tokens
+                    if grouped:
+                        group_phrases.add((target, chat_name or '未知群组'), text)
+
+                # 记录与特定用户的互动模式
+                if conversation_partners:
+                    context_msgs = list(ctx.lines)
+                    for partner_id, partner_name in conversation_partners:
+                        record = {"context": context_msgs, "response": text}
+                        if grouped:
+                            record["group"] = chat_name
+                        record["ts"] = msg.ts
+                        user_interactions[target][partner_name].append(record)
+            ctx.push(msg)
+        skip = 0
+
+    if stats is not None and group_phrases.keys():
+        stats["group_phrases"] = stats.get("group_phrases", 0) + group_phrases
+    return samples, user_interactions
+
+def write_persona_datasets(blocks, personas, output_file, window=3, token_budget=None,
+                           count_tokens=None, dedupe=None, stats=None, user_mapping=None):
+    """多目标模式：一次生成所有目标的样本，每个目标写一个 JSONL 文件，返回 {目标: 输出文件}
+
+    blocks、user_mapping 同 make_multi_target_samples；
+    dedupe: NearDuplicateIndex，提供时按它的参数为每个目标单独去重
+    """
+    samples, _ = make_multi_target_samples(blocks, personas, window, 0, token_budget, count_tokens, stats, user_mapping)
+    outputs = {}
+    for target, persona in personas.items():
+        target_samples = samples[target]
+        report = ""
+        if dedupe is not None:
+            from dedupe import NearDuplicateIndex, dedupe_samples
+            index = NearDuplicateIndex(dedupe.hasher, dedupe.count_tokens)
+            target_samples = dedupe_samples(target_samples, index)
+            report = f"，去重丢弃 {index.dropped} 个"
+        outputs[target] = persona_output(persona, target, output_file)
+        with open(outputs[target], 'w', encoding='utf-8') as fout:
+            for sample in target_samples:
+                fout.write(json.dumps({"messages": sample["messages"]}, ensure_ascii=False) + '\n')
+        print(f"  - {persona['name']}({target}): {len(target_samples)} 个样本{report} -> {outputs[target]}")
+    return outputs
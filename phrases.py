@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式短语频率统计（内存有上限）
+- 一条消息切成中文 2~3 字片段、英文单词/数字和 [图片]、[表情] 这类方括号标记，每条消息内同一短语只计一次
+- 每个键（朋友、群组……）一个 Space-Saving 摘要，最多保留 2×capacity 个候选，超出时只留计数最高的 capacity 个
+- 估计值只会偏大，误差不超过该短语记录的 error；摘要可以相加，跨文件、跨进程合并后再查询 top-k
+"""
+
+import re
+
+DEFAULT_CAPACITY = 1000
+DEFAULT_NGRAMS = (2, 3)
+
+BRACKET_RE = re.compile(r'\[[^\[\]\s]{1,8}\]')
+CJK_RE = re.compile(r'[\u4e00-\u9fff]+')
+WORD_RE = re.compile(r'[A-Za-z0-9]{2,}')
+
+def phrases(text, ngrams=DEFAULT_NGRAMS):
+    """消息中的短语（按首次出现的顺序去重）"""
+    found = dict.fromkeys(BRACKET_RE.findall(text))
+    text = BRACKET_RE.sub(' ', text)
+    found.update(dict.fromkeys(word.lower() for word in WORD_RE.findall(text)))
+    for run in CJK_RE.findall(text):
+        for n in ngrams:
+            for i in range(len(run) - n + 1):
+                found[run[i:i + n]] = None
+    return list(found)
+
+class SpaceSaving:
+    """Space-Saving 频繁项摘要
+
+    不在表中的项真实次数不超过 floor；新项以 floor 为起点计数，并记下这部分误差。
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+        self.total = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, item, count=1):
+        self.total += count
+        current = self.counts.get(item)
+        if current is not None:
+            self.counts[item] = current + count
+            return
+        self.counts[item] = self.floor + count
+        self.errors[item] = self.floor
+        if len(self.counts) >= 2 * self.capacity:
+            self._prune()
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    @classmethod
+    def from_counts(cls, counts, capacity=DEFAULT_CAPACITY):
+        """由一批精确计数 {项: 次数} 建摘要（误差为 0，超出 capacity 时只留计数最高的）"""
+        sketch = cls(capacity)
+        sketch.counts = dict(counts)
+        sketch.errors = dict.fromkeys(sketch.counts, 0)
+        sketch.total = sum(sketch.counts.values())
+        if len(sketch.counts) > capacity:
+            sketch._prune()
+        return sketch
+
+    def _prune(self):
+        """只保留计数最高的 capacity 项，被淘汰的最大计数成为新的 floor"""
+        ranked = sorted(self.counts.items(), key=lambda x: -x[1])
+        if len(ranked) > self.capacity:
+            self.floor = max(self.floor, ranked[self.capacity][1])
+            ranked = ranked[:self.capacity]
+        self.counts = dict(ranked)
+        self.errors = {item: self.errors[item] for item in self.counts}
+
+    def top(self, k=5):
+        """[(短语, 估计次数)]，按次数从高到低；次数相同时按短语排序，结果与合并顺序无关"""
+        return sorted(self.counts.items(), key=lambda x: (-x[1], x[0]))[:k]
+
+    def to_dict(self):
+        """可以写入 JSON 的状态"""
+        return {"capacity": self.capacity, "floor": self.floor, "total": self.total,
+                "items": [[item, count, self.errors[item]] for item, count in self.counts.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["capacity"])
+        sketch.floor, sketch.total = data["floor"], data["total"]
+        for item, count, error in data["items"]:
+            sketch.counts[item] = count
+            sketch.errors[item] = error
+        return sketch
+
+    def __add__(self, other):
+        if not isinstance(other, SpaceSaving):
+            return NotImplemented
+        merged = SpaceSaving(max(self.capacity, other.capacity))
+        for item in list(self.counts) + [item for item in other.counts if item not in self.counts]:
+            merged.counts[item] = self.counts.get(item, self.floor) + other.counts.get(item, other.floor)
+            merged.errors[item] = self.errors.get(item, self.floor) + other.errors.get(item, other.floor)
+        merged.floor = self.floor + other.floor
+        merged.total = self.total + other.total
+        if len(merged.counts) > merged.capacity:
+            merged._prune()
+        return merged
+
+    def __radd__(self, other):
+        # 支持 sum() 和 stats.get(key, 0) + 摘要 这样的累加
+        if other == 0:
+            return self
+        return NotImplemented
+
+class PhraseCounter:
+    """按键分组的短语频率，每个键一个 SpaceSaving 摘要"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, ngrams=DEFAULT_NGRAMS):
+        self.capacity = capacity
+        self.ngrams = ngrams
+        self.sketches = {}
+
+    def add(self, key, text):
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = SpaceSaving(self.capacity)
+        sketch.update(phrases(text, self.ngrams))
+
+    def keys(self):
+        return self.sketches.keys()
+
+    def top(self, key, k=5):
+        sketch = self.sketches.get(key)
+        return sketch.top(k) if sketch is not None else []
+
+    def __add__(self, other):
+        if not isinstance(other, PhraseCounter):
+            return NotImplemented
+        merged = PhraseCounter(max(self.capacity, other.capacity), self.ngrams)
+        merged.sketches = dict(self.sketches)
+        for key, sketch in other.sketches.items():
+            merged.sketches[key] = merged.sketches[key] + sketch if key in merged.sketches else sketch
+        return merged
+
+    def __radd__(self, other):
+        if other == 0:
+            return self
+        return NotImplemented
+
+def common_phrases(texts, k=5, capacity=DEFAULT_CAPACITY):
+    """一组消息里最常见的 k 个短语 [(短语, 次数)]"""
+    sketch = SpaceSaving(capacity)
+    for text in texts:
+        sketch.update(phrases(text))
+    return sketch.top(k)
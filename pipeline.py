@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+带缓存的处理阶段
+- 每个阶段的结果按 (阶段名, 参数, 上游阶段的键 / 源文件内容哈希) 算出一个键，pickle 保存在 .stage_cache 下
+- 键没变的阶段直接读缓存；只改了 window 之类的参数时，解析等上游阶段不会重新运行
+- --force 可以强制重跑全部或指定阶段，被强制的阶段的下游也会跟着重跑
+- 两个处理脚本共用的解析阶段和输出写入
+"""
+
+import hashlib, json, os, pickle, time
+from message_cache import file_hash
+
+CACHE_DIR = '.stage_cache'
+# 阶段结果的格式变化时加一，旧缓存自动失效
+CACHE_VERSION = 3
+
+class StageCache:
+    """阶段结果缓存
+
+    namespace: 区分不同脚本的缓存目录；force: True 表示全部重跑，或需要重跑的阶段名集合
+    """
+
+    def __init__(self, namespace, cache_dir=CACHE_DIR, force=()):
+        self.root = os.path.join(cache_dir, namespace)
+        self.force = force
+        self._forced_keys = set()
+
+    def key(self, name, params, inputs=()):
+        """阶段的缓存键：参数和所有输入键的哈希
+
+        被强制重跑的阶段的键会被记下来，即使这个阶段本身因为下游命中缓存而没有运行，
+        以它为输入的下游阶段也会重跑（下游重跑时再按需运行它）。
+        """
+        payload = json.dumps([CACHE_VERSION, name, params, list(inputs)], ensure_ascii=False, sort_keys=True)
+        key = hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+        if self.force is True or name in self.force or any(k in self._forced_keys for k in inputs):
+            self._forced_keys.add(key)
+        return key
+
+    def _path(self, name, key):
+        return os.path.join(self.root, name, key + '.pkl')
+
+    def run(self, name, params, fn, inputs=(), check=None):
+        """运行或读取一个阶段，返回 (结果, 键)
+
+        fn() 计算结果；check(结果) 返回 False 时缓存视为失效（例如输出文件已被删除或改动）
+        """
+        key = self.key(name, params, inputs)
+        path = self._path(name, key)
+        if key not in self._forced_keys and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+                value = None
+            else:
+                if check is None or check(value):
+                    print(f"  ⏩ 阶段 {name} 使用缓存")
+                    return value, key
+
+        start = time.perf_counter()
+        value = fn()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        print(f"  ▶️ 阶段 {name} 完成 ({time.perf_counter() - start:.2f} 秒)")
+        return value, key
+
+def parse_stage(stages, load_blocks, filename, gap_minutes=30, **load_options):
+    """解析阶段：以源文件内容哈希为输入缓存 load_blocks(filename, gap_minutes, **load_options) 的结果，
+    返回 (对话块, 键)"""
+    return stages.run("parse", {"gap_minutes": gap_minutes},
+                      lambda: load_blocks(filename, gap_minutes, **load_options), [file_hash(filename)])
+
+def write_samples_jsonl(path, samples, append=False):
+    """保存训练数据，只保留训练需要的 messages 字段"""
+    with open(path, 'a' if append else 'w', encoding='utf-8') as fout:
+        for sample in samples:
+            fout.write(json.dumps({"messages": sample["messages"]}, ensure_ascii=False) + '\n')
+
+def write_analyses(analyses):
+    """写分析结果 {文件: 数据}；PatternAggregates 这类带 save() 的对象自己保存"""
+    for path, data in analyses.items():
+        if hasattr(data, 'save'):
+            data.save(path)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+
+def outputs_unchanged(hashes):
+    """输出阶段的缓存检查：{文件: 内容哈希} 里的文件都还在且没有被改动"""
+    return all(os.path.exists(path) and file_hash(path) == digest for path, digest in hashes.items())
@@ -1,258 +1,322 @@
-import re, json
-from datetime import datetime
+import argparse, sys, time
 from collections import defaultdict
+from chat_parser import iter_blocks, load_blocks_parallel, format_throughput
+from incremental import plan_sources, parse_source, drop_processed, save_checkpoint
+from message_cache import load_cache, file_hash
+from message_store import open_store, ingest_source, store_blocks
+from personas import (load_personas, speaker_names, select_targets, make_multi_target_samples, write_persona_datasets,
+                      DEFAULT_MIN_MESSAGES)
+from dataset_writer import ShardedWriter, write_samples, manifest_path
+from pipeline import StageCache, parse_stage, write_samples_jsonl, write_analyses, outputs_unchanged
+from pattern_stats import PatternAggregates, analyze_interactions, aggregates_path
+from reply_timing import ReplyTiming
 
-def load_blocks(path, gap_minutes=30):
-    """加载聊天记录并按时间间隔分组 - 修复多行消息格式"""
-    lines = [l.rstrip() for l in open(path, encoding='utf-8')]  # 保留空行，只去除右侧空白
-    blocks, cur = [], []
-    prev_ts = None
-    current_group = None
-    current_chat = None
-    
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # 检查是否是消息分组或对象标识
-        if line.startswith('消息分组:'):
-            current_group = line[5:]
-            i += 1
-            continue
-        elif line.startswith('消息对象:'):
-            current_chat = line[5:]
-            i += 1
-            continue
-        elif line.startswith('====') or '消息记录' in line or not line:
-            i += 1
-            continue
-        elif line.startswith('系统消息'):
-            i += 1
-            continue
-        
-        # 🔧 修复时间戳和消息解析逻辑
-        # 检查是否是时间戳行
-        timestamp_pattern = r'^(\d{4}-\d{2}-\d{2} \d{1,2}:\d{2}:\d{2})\s+'
-        ts_match = re.match(timestamp_pattern, line)
-        
-        if ts_match:
-            timestamp = ts_match.group(1)
-            rest = line[ts_match.end():]
-            
-            # 匹配用户信息：发言者(ID)
-            user_match = re.match(r'(.+?)\((\d+)\)\s*$', rest)
-            if user_match:
-                username = user_match.group(1).strip()
-                user_id = user_match.group(2)
-                
-                # 🔧 关键修复：读取下一行(们)作为消息内容
-                message_lines = []
-                j = i + 1
-                
-                # 继续读取直到遇到下一个时间戳行或文件结束
-                while j < len(lines):
-                    next_line = lines[j].strip()
-                    
-                    # 如果遇到下一个时间戳行，停止
-                    if re.match(timestamp_pattern, next_line):
-                        break
-                    # 如果遇到分组/对象标识，停止
-                    if (next_line.startswith('消息分组:') or 
-                        next_line.startswith('消息对象:') or 
-                        next_line.startswith('====') or
-                        next_line.startswith('系统消息')):
-                        break
-                    
-                    # 添加消息行（包括空行）
-                    message_lines.append(lines[j].rstrip())
-                    j += 1
-                
-                # 合并消息内容
-                message = '\n'.join(message_lines).strip()
-                
-                # 调试前几个解析结果
-                if len(blocks) < 2:
-                    print(f"调试解析: 时间戳='{timestamp}', 用户名='{username}', ID={user_id}")
-                    print(f"  消息内容: '{message}' (长度: {len(message)})")
-                
-                # 处理时间和分组
-                try:
-                    dt = datetime.fromisoformat(timestamp)
-                    if prev_ts and (dt - prev_ts).total_seconds() > gap_minutes*60:
-                        if cur:
-                            blocks.append((current_group, current_chat, cur))
-                        cur = []
-                    cur.append((user_id, username, message))
-                    prev_ts = dt
-                except:
-                    pass
-                
-                # 跳到消息结束位置
-                i = j
-                continue
-        
-        i += 1
-    
-    if cur:
-        blocks.append((current_group, current_chat, cur))
+STAGES = ("parse", "samples", "dedupe", "patterns", "output")
+
+def load_blocks(path, gap_minutes=30, workers=1, use_cache=False, store=None):
+    """加载聊天记录并按时间间隔分组 - 流式解析，保留群组信息"""
+    if store is not None:
+        # SQLite 消息库：源文件内容没变时直接从库里读出对话块
+        start = time.perf_counter()
+        if ingest_source(store, path, gap_minutes):
+            print(f"  已导入消息库 ({time.perf_counter() - start:.2f} 秒)")
+        blocks = list(store_blocks(store, path))
+        print(f"  从消息库读取 {sum(len(b[2]) for b in blocks):,} 条消息 ({time.perf_counter() - start:.3f} 秒)")
+        return blocks
+
+    if use_cache:
+        # 列式缓存：源文件内容没变时直接内存映射加载，不再解析文本
+        start = time.perf_counter()
+        with load_cache(path) as cache:
+            blocks = list(cache.iter_blocks(gap_minutes))
+            print(f"  从缓存加载 {len(cache):,} 条消息 ({time.perf_counter() - start:.3f} 秒)")
+        return blocks
+
+    stats = {}
+    if workers == 1:
+        blocks = list(iter_blocks(path, gap_minutes, stats=stats))
+    else:
+        blocks = load_blocks_parallel(path, gap_minutes, workers=workers, stats=stats)
+    print(f"  {format_throughput(stats)}")
     return blocks
 
-def make_enhanced_samples(blocks, target='3159852227', window=3):
-    """创建增强的训练样本，包含群组信息和对话者关系"""
-    samples = []
-    user_interactions = defaultdict(list)  # 记录目标用户与每个人的对话
-    
+
+def make_enhanced_samples(blocks, target='3159852227', window=3, skip=0,
+                          token_budget=None, count_tokens=None, stats=None):
+    """创建增强的训练样本，包含群组信息和对话者关系
+
+    skip: 第一个对话块开头已经生成过样本的消息数（增量模式），只作为上下文
+    token_budget: 上下文各行 token 数之和的上限，从最新的消息往前装（window 为 None 时不限条数）
+    stats: 传入字典时累加 samples / budget_hits / context_tokens / group_phrases / reply_timing
+    """
     # 用户名解析已修复，不再需要映射表
     print("✅ 使用修复后的用户名解析")
-    
-    for group_name, chat_name, blk in blocks:
-        # 提取目标用户与其他用户的对话模式
-        for i, (uid, username, text) in enumerate(blk):
-            if uid == target and text.strip():  # 目标用户的发言
-                # 获取上下文
-                ctx = blk[max(0, i-window):i]
-                
-                # 分析对话对象
-                conversation_partners = set()
-                for c_uid, c_username, c_text in ctx:
-                    if c_uid != target:
-                        # 直接使用解析出的用户名
-                        conversation_partners.add((c_uid, c_username))
-                
-                # 构建messages格式的训练样本
-                messages = []
-                
-                # 系统消息，包含群组和角色信息
-                system_content = f"你是雷🐷🐷，一个喜欢说'dds'、'愚蠢'、'丢大师'等词汇的QQ群聊天用户。你在群组'{chat_name or '未知群组'}'中聊天。"
-                messages.append({"role": "system", "content": system_content})
-                
-                # 添加对话历史作为用户消息
-                if ctx:
-                    context_msgs = []
-                    for c_uid, c_username, c_text in ctx:
-                        if c_text.strip():
-                            # 直接使用解析出的用户名
-                            context_msgs.append(f"{c_username}: {c_text}")
-                    
-                    if context_msgs:
-                        user_content = "对话历史:\n" + "\n".join(context_msgs) + "\n\n请以雷🐷🐷的身份回复："
-                        messages.append({"role": "user", "content": user_content})
-                
-                # 助手回复（目标用户的实际回复）
-                messages.append({"role": "assistant", "content": text})
-                
-                # 创建样本
-                sample = {
-                    "messages": messages,
-                    "metadata": {
-                        "group": group_name,
-                        "chat": chat_name,
-                        "partners": list(conversation_partners),
-                        "timestamp": blk[i][0] if i < len(blk) else None
-                    }
-                }
-                samples.append(sample)
-                
-                # 记录与特定用户的互动模式
-                for partner_id, partner_name in conversation_partners:
-                    user_interactions[partner_name].append({
-                        "context": context_msgs if 'context_msgs' in locals() else [],
-                        "response": text,
-                        "group": chat_name
-                    })
-    
-    return samples, user_interactions
-
-def analyze_chat_patterns(user_interactions):
-    """分析用户对不同朋友的聊天模式"""
-    patterns = {}
-    for friend, interactions in user_interactions.items():
-        if len(interactions) >= 3:  # 至少要有3次互动才分析
-            responses = [inter["response"] for inter in interactions]
-            
-            # 分析特征
-            avg_length = sum(len(r) for r in responses) / len(responses)
-            emoji_count = sum(r.count('[') + r.count('🐷') + r.count('愚蠢') for r in responses)
-            
-            patterns[friend] = {
-                "interaction_count": len(interactions),
-                "avg_response_length": avg_length,
-                "emoji_usage": emoji_count / len(responses),
-                "common_words": extract_common_words(responses),
-                "groups": list(set(inter["group"] for inter in interactions))
-            }
-    
-    return patterns
-
-def extract_common_words(responses):
-    """提取常用词汇"""
-    words = []
-    for response in responses:
-        # 简单的词汇提取
-        words.extend([w for w in response if len(w) > 1])
-    
-    from collections import Counter
-    return Counter(words).most_common(5)
+
+    samples, interactions = make_multi_target_samples(blocks, load_personas([target], {}), window, skip,
+                                                      token_budget, count_tokens, stats)
+    if stats is not None:
+        timing = ReplyTiming().update([blk for _, _, blk in blocks], target, skip)
+        stats["reply_timing"] = stats.get("reply_timing", 0) + timing
+    return samples[target], interactions[target]
+
+def analyze_chat_patterns(user_interactions, min_interactions=3):
+    """分析用户对不同朋友的聊天模式（可累加的向量化统计见 pattern_stats.py）"""
+    return analyze_interactions(user_interactions, min_interactions)
+
+def samples_stage(stages, filename, params, load_options, count_tokens=None):
+    """样本阶段：输入为解析阶段的键，返回 ((样本, 互动记录, 统计), 键)；缓存命中时不需要解析"""
+    parse_key = stages.key("parse", {"gap_minutes": params["gap_minutes"]}, [file_hash(filename)])
+
+    def build():
+        blocks, _ = parse_stage(stages, load_blocks, filename, params["gap_minutes"], **load_options)
+        print(f"  从 {filename} 解析出 {len(blocks)} 个对话块")
+        stats = {}
+        samples, interactions = make_enhanced_samples(blocks, params["target"], params["window"],
+                                                      token_budget=params["token_budget"], count_tokens=count_tokens, stats=stats)
+        return samples, dict(interactions), stats
+
+    sample_params = {name: params[name] for name in ("target", "window", "token_budget")}
+    return stages.run("samples", sample_params, build, [parse_key])
+
+def write_outputs(output_file, samples, analyses):
+    """输出阶段：写训练数据和分析结果，返回 {文件: 内容哈希}"""
+    write_samples_jsonl(output_file, samples)
+    write_analyses(analyses)
+    return {path: file_hash(path) for path in [output_file, *analyses]}
+
+def top_group_phrases(group_phrases, target, k=20):
+    """{群组: [(短语, 次数)]}：目标用户在每个群里最常用的短语"""
+    if not group_phrases:
+        return {}
+    return {group: group_phrases.top((user_id, group), k) for user_id, group in group_phrases.keys() if user_id == target}
 
 # 🔧 修复并处理数据
-print("正在处理聊天记录...")
-
-all_samples = []
-all_interactions = defaultdict(list)
-
-for filename in ['1.txt', '2.txt']:
-    print(f"处理文件: {filename}")
-    blocks = load_blocks(filename)
-    print(f"  从 {filename} 解析出 {len(blocks)} 个对话块")
-    
-    samples, interactions = make_enhanced_samples(blocks)
-    all_samples.extend(samples)
-    
-    # 合并互动数据
-    for friend, friend_interactions in interactions.items():
-        all_interactions[friend].extend(friend_interactions)
-
-print(f"\n📊 数据统计:")
-print(f"总共生成了 {len(all_samples)} 个训练样本")
-
-# 验证样本质量
-if all_samples:
-    sample = all_samples[0]
-    print(f"\n📝 第一个训练样本预览:")
-    print(f"系统消息: {sample['messages'][0]['content']}")
-    if len(sample['messages']) > 1:
-        print(f"用户消息: {sample['messages'][1]['content'][:100]}...")
-    if len(sample['messages']) > 2:
-        print(f"助手回复: {sample['messages'][2]['content'][:50]}...")
-else:
-    print("\n❌ 没有生成任何训练样本")
-
-# 分析聊天模式
-patterns = analyze_chat_patterns(all_interactions)
-print(f"\n👥 发现与 {len(patterns)} 个朋友的聊天模式")
-
-# 显示主要对话伙伴
-if patterns:
-    sorted_friends = sorted(patterns.items(), key=lambda x: x[1]['interaction_count'], reverse=True)
-    print("主要对话伙伴:")
-    for friend, data in sorted_friends[:5]:
-        print(f"  - {friend}: {data['interaction_count']}次互动")
-
-# 保存训练数据  
-with open('deepseek_data_final.jsonl', 'w', encoding='utf-8') as fout:
-    for sample in all_samples:
-        # 只保存训练需要的字段，使用messages格式
-        training_sample = {
-            "messages": sample["messages"]
-        }
-        fout.write(json.dumps(training_sample, ensure_ascii=False) + '\n')
-
-# 保存分析结果
-with open('chat_patterns_final.json', 'w', encoding='utf-8') as f:
-    json.dump(patterns, f, ensure_ascii=False, indent=2)
-
-print("\n✅ 数据处理完成！")
-print("生成文件:")
-print("- deepseek_data_final.jsonl: 最终修复的训练数据")
-print("- chat_patterns_final.json: 聊天模式分析")
-print("\n🎯 目标用户(雷🐷🐷)的训练样本已准备就绪！") 
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="处理聊天记录，生成训练数据")
+    parser.add_argument("--workers", type=int, default=1, help="并行解析的进程数（默认1为串行，0为全部CPU核心）")
+    parser.add_argument("--incremental", action="store_true", help="增量模式：只解析源文件新追加的部分，追加新样本")
+    parser.add_argument("--cache", action="store_true", help="使用导出文件旁边的列式消息缓存（内容变化时自动重建）")
+    parser.add_argument("--store", metavar="DB", help="把解析结果导入 SQLite 消息库，并从库中读取对话块")
+    parser.add_argument("--window", type=int, help="每个样本包含的上下文消息条数（默认3；指定 --token-budget 时默认不限条数）")
+    parser.add_argument("--token-budget", type=int, help="每个样本上下文的 token 预算，从最新的消息往前尽量多装")
+    parser.add_argument("--shard-mb", type=float, help="流式分片写出，每个分片的大小上限（MB）")
+    parser.add_argument("--compress", choices=["gzip", "zstd"], help="流式分片写出，并压缩分片")
+    parser.add_argument("--val-ratio", type=float, default=0.0, help="流式分片写出，按内容哈希划分验证集的比例")
+    parser.add_argument("--dedupe", type=float, nargs="?", const=0.8, metavar="THRESHOLD",
+                        help="MinHash/LSH 近似去重，相似度达到阈值（默认0.8）的样本只保留第一个")
+    parser.add_argument("--targets", help="多目标模式：逗号分隔的QQ号，或 all（发言数不少于 --min-messages 的所有用户）")
+    parser.add_argument("--personas", metavar="JSON", help="多目标模式的人设配置（名字、描述、系统提示词、输出文件）")
+    parser.add_argument("--min-messages", type=int, default=DEFAULT_MIN_MESSAGES,
+                        help=f"--targets all 时的最少发言数（默认{DEFAULT_MIN_MESSAGES}）")
+    parser.add_argument("--min-interactions", type=int, default=3, help="聊天模式分析中每个朋友至少需要的互动次数（默认3）")
+    parser.add_argument("--force", nargs="*", choices=STAGES, metavar="STAGE",
+                        help=f"忽略阶段缓存重新运行，不带参数为全部阶段（{' '.join(STAGES)}），下游阶段会跟着重跑")
+    args = parser.parse_args()
+    # 指定任一分片选项时，样本按批在进程池里生成并直接写入分片，不在内存里保留全部样本
+    stream = args.shard_mb is not None or args.compress is not None or args.val_ratio > 0
+    if args.window is None and args.token_budget is None:
+        args.window = 3
+    if args.targets and (args.incremental or stream):
+        parser.error("--targets 暂不支持和 --incremental 或分片选项一起使用")
+    workers = args.workers or None
+    store = open_store(args.store) if args.store else None
+    stages = StageCache('final', force=True if args.force == [] else set(args.force or ()))
+    load_options = {"workers": workers, "use_cache": args.cache, "store": store}
+
+    print("正在处理聊天记录...")
+
+    sources = ['1.txt', '2.txt']
+    output_file = 'deepseek_data_final.jsonl'
+    params = {"gap_minutes": 30, "target": '3159852227', "window": args.window,
+              "token_budget": args.token_budget, "dedupe": args.dedupe}
+    if stream:
+        params.update(compress=args.compress, val_ratio=args.val_ratio)
+    count_tokens = None
+    if args.token_budget is not None:
+        from token_counter import CachedTokenCounter
+        count_tokens = CachedTokenCounter()
+    sample_stats = {}
+    dedupe = None
+    if args.dedupe is not None:
+        from dedupe import MinHasher, NearDuplicateIndex, dedupe_samples
+        try:
+            from token_counter import CachedTokenCounter
+            saved_counter = count_tokens or CachedTokenCounter()
+        except (ImportError, OSError) as e:
+            print(f"⚠️ 无法加载 tokenizer，去重只统计节省的字符数: {e}")
+            saved_counter = None
+        dedupe = NearDuplicateIndex(MinHasher(args.dedupe), saved_counter)
+
+    if args.targets:
+        # 多目标模式：一次遍历对话块，为每个目标用户分别生成数据集
+        blocks = []
+        for filename in sources:
+            print(f"处理文件: {filename}")
+            blocks.extend(parse_stage(stages, load_blocks, filename, params["gap_minutes"], **load_options)[0])
+        names = speaker_names(blk for _, _, blk in blocks)
+        personas = load_personas(select_targets(args.targets, names, args.min_messages), names, args.personas)
+        print(f"\n为 {len(personas)} 个目标用户生成训练样本:")
+        start = time.perf_counter()
+        write_persona_datasets(blocks, personas, output_file, params["window"], params["token_budget"],
+                               count_tokens, dedupe, sample_stats)
+        print(f"\n📊 总共生成了 {sample_stats.get('samples', 0)} 个训练样本 ({time.perf_counter() - start:.2f} 秒)")
+        sys.exit(0)
+
+    # 流式模式以分片清单代替单个输出文件
+    progress_file = manifest_path(output_file) if stream else output_file
+    checkpoints, resume = plan_sources(sources, progress_file, params, args.incremental)
+    # 完整生成单个输出文件时走阶段缓存：解析 -> 样本 -> 去重 -> 聊天模式 -> 输出
+    staged = checkpoints is None and not stream
+    new_checkpoints = {}
+    patterns_file = 'chat_patterns_final.json'
+    # 聊天模式累计量：增量模式下只把新的互动记录合并进上次保存的累计量
+    aggregates = PatternAggregates.load(aggregates_path(patterns_file)) if resume else PatternAggregates()
+    writer = None
+    if stream:
+        writer = ShardedWriter(output_file, args.shard_mb and int(args.shard_mb * 1024 * 1024),
+                               args.compress, append=resume)
+    first_sample = None
+    sample_keys = []  # 各源文件样本阶段的键
+
+    all_samples = []
+    all_interactions = defaultdict(list)
+
+    for filename in sources:
+        print(f"处理文件: {filename}")
+        skip = 0
+        if staged:
+            (samples, interactions, file_stats), key = samples_stage(
+                stages, filename, params, load_options, count_tokens)
+            sample_keys.append(key)
+            for name, value in file_stats.items():
+                sample_stats[name] = sample_stats.get(name, 0) + value
+            all_samples.extend(samples)
+        else:
+            if checkpoints is None:
+                blocks = parse_stage(stages, load_blocks, filename, params["gap_minutes"], **load_options)[0]
+            else:
+                blocks, skip, new_checkpoints[filename] = parse_source(filename, params, checkpoints[filename])
+                blocks, skip = drop_processed(blocks, skip)
+            print(f"  从 {filename} 解析出 {len(blocks)} 个{'新' if resume else ''}对话块")
+
+            if stream:
+                first, interactions = write_samples(blocks, make_enhanced_samples, writer, workers=workers, skip=skip,
+                                                    val_ratio=args.val_ratio, stats=sample_stats, target=params["target"],
+                                                    window=params["window"], token_budget=params["token_budget"],
+                                                    count_tokens=count_tokens, dedupe=dedupe, aggregates=aggregates)
+                first_sample = first_sample or first
+            else:
+                samples, interactions = make_enhanced_samples(blocks, params["target"], params["window"], skip=skip,
+                                                              token_budget=params["token_budget"], count_tokens=count_tokens, stats=sample_stats)
+                if dedupe is not None:
+                    samples = dedupe_samples(samples, dedupe)
+                all_samples.extend(samples)
+
+        # 合并互动数据
+        for friend, friend_interactions in interactions.items():
+            all_interactions[friend].extend(friend_interactions)
+
+    output_keys = sample_keys
+    dedupe_report = None
+    if dedupe is not None:
+        dedupe_report = dedupe.report()
+        if staged:
+            # 去重需要按顺序看到所有文件的样本，单独作为一个阶段
+            (all_samples, dedupe_report), dedupe_key = stages.run(
+                "dedupe", {"threshold": args.dedupe},
+                lambda: (dedupe_samples(all_samples, dedupe), dedupe.report()), sample_keys)
+            output_keys = [dedupe_key]
+    if not stream:
+        first_sample = all_samples[0] if all_samples else None
+
+    if writer is not None:
+        writer.close()
+
+    print(f"\n📊 数据统计:")
+    print(f"总共生成了 {sample_stats.get('samples', 0)} 个训练样本")
+    if writer is not None:
+        for split, (count, size, shards) in writer.totals().items():
+            print(f"  {split}: {count} 个样本，{shards} 个分片，{size / (1024 * 1024):.1f} MB")
+    if args.token_budget is not None and sample_stats.get("samples"):
+        hits = sample_stats["budget_hits"]
+        print(f"上下文 token 预算 {args.token_budget}: {hits} 个样本达到预算 ({hits / sample_stats['samples']:.1%})，"
+              f"上下文共 {sample_stats['context_tokens']:,} tokens")
+
+    if dedupe_report is not None:
+        print(dedupe_report)
+
+    # 验证样本质量
+    if first_sample:
+        sample = first_sample
+        print(f"\n📝 第一个训练样本预览:")
+        print(f"系统消息: {sample['messages'][0]['content']}")
+        if len(sample['messages']) > 1:
+            print(f"用户消息: {sample['messages'][1]['content'][:100]}...")
+        if len(sample['messages']) > 2:
+            print(f"助手回复: {sample['messages'][2]['content'][:50]}...")
+    else:
+        print("\n❌ 没有生成任何训练样本")
+
+    # 分析聊天模式：累计互动记录（流式模式已经在子进程里汇总），--min-interactions 只影响最后的筛选
+    patterns_key = None
+    if staged:
+        aggregates, patterns_key = stages.run(
+            "patterns", {},
+            lambda: PatternAggregates().update(all_interactions).add_timing(sample_stats.get("reply_timing")), sample_keys)
+    elif aggregates is not None:
+        if not stream:
+            aggregates.update(all_interactions)
+        aggregates.add_timing(sample_stats.get("reply_timing"))
+    patterns = {}
+    if aggregates is None:
+        print("\n⏭️ 没有找到上次的聊天模式累计量，增量模式下不更新聊天模式分析（去掉 --incremental 可完整重新生成）")
+    else:
+        patterns = aggregates.patterns(args.min_interactions)
+        print(f"\n👥 发现与 {len(patterns)} 个朋友的聊天模式")
+
+    # 显示主要对话伙伴
+    if patterns:
+        sorted_friends = sorted(patterns.items(), key=lambda x: x[1]['interaction_count'], reverse=True)
+        print("主要对话伙伴:")
+        for friend, data in sorted_friends[:5]:
+            print(f"  - {friend}: {data['interaction_count']}次互动")
+        timing = aggregates.timing.summary()
+        if timing is not None and "reply_latency" in timing:
+            latency = timing["reply_latency"]
+            print(f"⏱️ 回复时延中位数 {latency['p50']:.0f} 秒（p90 {latency['p90']:.0f} 秒，共 {latency['count']} 次回复），"
+                  f"平均每轮 {timing['turn_messages']['mean']:.1f} 条消息")
+
+    # 各群组常用短语（增量续写时只统计了新消息，跳过）
+    group_phrases = {} if resume else top_group_phrases(sample_stats.get("group_phrases"), params["target"])
+    for group, top in group_phrases.items():
+        print(f"💬 {group} 常用短语: {'、'.join(phrase for phrase, _ in top[:5])}")
+    analyses = {}
+    if aggregates is not None:
+        analyses = {patterns_file: patterns, aggregates_path(patterns_file): aggregates}
+    if not resume:
+        analyses['chat_phrases_final.json'] = group_phrases
+
+    # 保存训练数据和分析结果（增量模式下追加新样本；流式模式已经写入分片）
+    if staged:
+        # 输出阶段：输出文件还在且内容没变时不重写
+        stages.run("output", {"files": [output_file, *analyses], "min_interactions": args.min_interactions},
+                   lambda: write_outputs(output_file, all_samples, analyses),
+                   output_keys + [patterns_key], check=outputs_unchanged)
+    else:
+        if not stream:
+            write_samples_jsonl(output_file, all_samples, append=resume)
+        write_analyses(analyses)
+
+    # 保存增量检查点
+    for filename, checkpoint in new_checkpoints.items():
+        save_checkpoint(filename, progress_file, checkpoint)
+
+    print("\n✅ 数据处理完成！")
+    print("生成文件:")
+    if stream:
+        print(f"- {writer.manifest_path}: 训练数据分片清单")
+    else:
+        print("- deepseek_data_final.jsonl: 最终修复的训练数据")
+    print("- chat_patterns_final.json: 聊天模式分析（累计量保存在 chat_patterns_final.aggregates.json，供增量更新）")
+    print("- chat_phrases_final.json: 各群组常用短语")
+    print("\n🎯 目标用户(雷🐷🐷)的训练样本已准备就绪！")
@@ -7,227 +7,286 @@
 - 统一使用最常用的名字
 """
 
-import re, json
-from datetime import datetime
-from collections import defaultdict, Counter
+import argparse, json, sys, time
+from collections import defaultdict
+from chat_parser import iter_blocks, load_blocks_parallel, format_throughput
+from incremental import plan_sources, parse_source, drop_processed, save_checkpoint
+from message_cache import load_cache, file_hash
+from message_store import open_store, ingest_source, store_blocks
+from personas import (load_personas, speaker_names, select_targets, make_multi_target_samples, write_persona_datasets,
+                      DEFAULT_MIN_MESSAGES)
+from dataset_writer import ShardedWriter, write_samples, manifest_path
+from pipeline import StageCache, parse_stage, write_samples_jsonl, write_analyses, outputs_unchanged
+from pattern_stats import PatternAggregates, analyze_interactions, aggregates_path
+from identity import IdentityStore
+from reply_timing import ReplyTiming
 
-def load_blocks(path, gap_minutes=30):
+STAGES = ("parse", "mapping", "samples", "dedupe", "patterns", "output")
+
+def load_blocks(path, gap_minutes=30, workers=1, use_cache=False, store=None):
     """加载聊天记录并按时间间隔分组 - 不包含群组信息"""
-    lines = [l.rstrip() for l in open(path, encoding='utf-8')]
-    blocks, cur = [], []
-    prev_ts = None
-    
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # 跳过群组和对象信息
-        if (line.startswith('消息分组:') or line.startswith('消息对象:') or 
-            line.startswith('====') or '消息记录' in line or not line or
-            line.startswith('系统消息')):
-            i += 1
-            continue
-        
-        # 检查是否是时间戳行
-        timestamp_pattern = r'^(\d{4}-\d{2}-\d{2} \d{1,2}:\d{2}:\d{2})\s+'
-        ts_match = re.match(timestamp_pattern, line)
-        
-        if ts_match:
-            timestamp = ts_match.group(1)
-            rest = line[ts_match.end():]
-            
-            # 匹配用户信息：发言者(ID)
-            user_match = re.match(r'(.+?)\((\d+)\)\s*$', rest)
-            if user_match:
-                username = user_match.group(1).strip()
-                user_id = user_match.group(2)
-                
-                # 读取消息内容
-                message_lines = []
-                j = i + 1
-                
-                while j < len(lines):
-                    next_line = lines[j].strip()
-                    
-                    if re.match(timestamp_pattern, next_line):
-                        break
-                    if (next_line.startswith('消息分组:') or 
-                        next_line.startswith('消息对象:') or 
-                        next_line.startswith('====') or
-                        next_line.startswith('系统消息')):
-                        break
-                    
-                    message_lines.append(lines[j].rstrip())
-                    j += 1
-                
-                message = '\n'.join(message_lines).strip()
-                
-                # 处理时间分组
-                try:
-                    dt = datetime.fromisoformat(timestamp)
-                    if prev_ts and (dt - prev_ts).total_seconds() > gap_minutes*60:
-                        if cur:
-                            blocks.append(cur)
-                        cur = []
-                    cur.append((user_id, username, message))
-                    prev_ts = dt
-                except:
-                    pass
-                
-                i = j
-                continue
-        
-        i += 1
-    
-    if cur:
-        blocks.append(cur)
-    return blocks
+    if store is not None:
+        # SQLite 消息库：源文件内容没变时直接从库里读出对话块
+        start = time.perf_counter()
+        if ingest_source(store, path, gap_minutes):
+            print(f"  已导入消息库 ({time.perf_counter() - start:.2f} 秒)")
+        blocks = list(store_blocks(store, path))
+        print(f"  从消息库读取 {sum(len(b[2]) for b in blocks):,} 条消息 ({time.perf_counter() - start:.3f} 秒)")
+        return [messages for _, _, messages in blocks]
+
+    if use_cache:
+        # 列式缓存：源文件内容没变时直接内存映射加载，不再解析文本
+        start = time.perf_counter()
+        with load_cache(path) as cache:
+            blocks = list(cache.iter_blocks(gap_minutes))
+            print(f"  从缓存加载 {len(cache):,} 条消息 ({time.perf_counter() - start:.3f} 秒)")
+        return [messages for _, _, messages in blocks]
+
+    stats = {}
+    if workers == 1:
+        blocks = list(iter_blocks(path, gap_minutes, stats=stats))
+    else:
+        blocks = load_blocks_parallel(path, gap_minutes, workers=workers, stats=stats)
+    print(f"  {format_throughput(stats)}")
+    return [messages for _, _, messages in blocks]
+
 
 def build_user_mapping(blocks):
-    """构建用户ID到统一名字的映射关系"""
-    # 统计每个ID使用的所有名字及其频率
-    id_names = defaultdict(Counter)
-    
-    for blk in blocks:
-        for user_id, username, message in blk:
-            if username and user_id:
-                id_names[user_id][username] += 1
-    
-    # 为每个ID选择最常用的名字
-    user_mapping = {}
-    for user_id, name_counts in id_names.items():
-        most_common_name = name_counts.most_common(1)[0][0]
-        user_mapping[user_id] = most_common_name
-        
-        # 如果一个ID有多个名字，打印出来查看
-        if len(name_counts) > 1:
-            print(f"用户ID {user_id} 有多个名字: {dict(name_counts)} -> 统一为: {most_common_name}")
-    
-    return user_mapping
-
-def make_unified_samples(blocks, user_mapping, target='3159852227', window=3):
-    """创建统一的训练样本，不包含群组信息"""
-    samples = []
-    user_interactions = defaultdict(list)
-    
-    for blk in blocks:
-        for i, (uid, username, text) in enumerate(blk):
-            if uid == target and text.strip():  # 目标用户的发言
-                # 获取上下文
-                ctx = blk[max(0, i-window):i]
-                
-                # 分析对话对象
-                conversation_partners = set()
-                for c_uid, c_username, c_text in ctx:
-                    if c_uid != target and c_uid in user_mapping:
-                        unified_name = user_mapping[c_uid]
-                        conversation_partners.add((c_uid, unified_name))
-                
-                # 构建messages格式的训练样本
-                messages = []
-                
-                # 系统消息，不包含群组信息
-                system_content = "你是雷🐷🐷，一个喜欢说'dds'、'愚蠢'、'丢大师'等词汇的QQ群聊天用户。"
-                messages.append({"role": "system", "content": system_content})
-                
-                # 添加对话历史作为用户消息
-                if ctx:
-                    context_msgs = []
-                    for c_uid, c_username, c_text in ctx:
-                        if c_text.strip() and c_uid in user_mapping:
-                            # 使用统一的名字
-                            unified_name = user_mapping[c_uid]
-                            context_msgs.append(f"{unified_name}: {c_text}")
-                    
-                    if context_msgs:
-                        user_content = "对话历史:\n" + "\n".join(context_msgs) + "\n\n请以雷🐷🐷的身份回复："
-                        messages.append({"role": "user", "content": user_content})
-                
-                # 助手回复（目标用户的实际回复）
-                messages.append({"role": "assistant", "content": text})
-                
-                # 创建样本
-                sample = {
-                    "messages": messages,
-                    "metadata": {
-                        "partners": list(conversation_partners),
-                        "timestamp": blk[i][0] if i < len(blk) else None
-                    }
-                }
-                samples.append(sample)
-                
-                # 记录与特定用户的互动模式
-                for partner_id, partner_name in conversation_partners:
-                    user_interactions[partner_name].append({
-                        "context": context_msgs if 'context_msgs' in locals() else [],
-                        "response": text
-                    })
-    
-    return samples, user_interactions
-
-def analyze_chat_patterns(user_interactions):
-    """分析用户对不同朋友的聊天模式"""
-    patterns = {}
-    for friend, interactions in user_interactions.items():
-        if len(interactions) >= 3:  # 至少要有3次互动才分析
-            responses = [inter["response"] for inter in interactions]
-            
-            # 分析特征
-            avg_length = sum(len(r) for r in responses) / len(responses)
-            emoji_count = sum(r.count('[') + r.count('🐷') + r.count('愚蠢') for r in responses)
-            
-            patterns[friend] = {
-                "interaction_count": len(interactions),
-                "avg_response_length": avg_length,
-                "emoji_usage": emoji_count / len(responses),
-                "common_words": extract_common_words(responses)
-            }
-    
-    return patterns
-
-def extract_common_words(responses):
-    """提取常用词汇"""
-    words = []
-    for response in responses:
-        words.extend([w for w in response if len(w) > 1])
-    
-    return Counter(words).most_common(5)
+    """构建用户ID到统一名字的映射关系（一次性统计，不读写身份库）"""
+    identities = IdentityStore(None)
+    identities.sync(None, blocks, None)
+    return identities.mapping()
+
+def make_unified_samples(blocks, user_mapping, target='3159852227', window=3, skip=0,
+                         token_budget=None, count_tokens=None, stats=None):
+    """创建统一的训练样本，不包含群组信息
+
+    skip: 第一个对话块开头已经生成过样本的消息数（增量模式），只作为上下文
+    token_budget: 上下文各行 token 数之和的上限，从最新的消息往前装（window 为 None 时不限条数）
+    stats: 传入字典时累加 samples / budget_hits / context_tokens / reply_timing
+    """
+    samples, interactions = make_multi_target_samples([(None, None, blk) for blk in blocks],
+                                                      load_personas([target], user_mapping), window, skip,
+                                                      token_budget, count_tokens, stats, user_mapping)
+    if stats is not None:
+        timing = ReplyTiming().update(blocks, target, skip, user_mapping)
+        stats["reply_timing"] = stats.get("reply_timing", 0) + timing
+    return samples[target], interactions[target]
+
+def analyze_chat_patterns(user_interactions, min_interactions=3):
+    """分析用户对不同朋友的聊天模式（可累加的向量化统计见 pattern_stats.py）"""
+    return analyze_interactions(user_interactions, min_interactions)
+
+def samples_stage(stages, blocks, user_mapping, params, inputs, count_tokens=None):
+    """样本阶段：输入为解析阶段和用户映射阶段的键，返回 ((样本, 互动记录, 统计), 键)"""
+    def build():
+        stats = {}
+        samples, interactions = make_unified_samples(blocks, user_mapping, params["target"], params["window"],
+                                                     token_budget=params["token_budget"], count_tokens=count_tokens, stats=stats)
+        return samples, dict(interactions), stats
+
+    sample_params = {name: params[name] for name in ("target", "window", "token_budget")}
+    return stages.run("samples", sample_params, build, inputs)
+
+def write_outputs(output_file, samples, analyses, user_mapping):
+    """输出阶段：写用户映射、训练数据和分析结果，返回 {文件: 内容哈希}"""
+    with open('user_mapping.json', 'w', encoding='utf-8') as f:
+        json.dump(user_mapping, f, ensure_ascii=False, indent=2)
+    write_samples_jsonl(output_file, samples)
+    write_analyses(analyses)
+    return {path: file_hash(path) for path in ['user_mapping.json', output_file, *analyses]}
 
 # 主处理流程
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="处理聊天记录，生成统一格式的训练数据")
+    parser.add_argument("--workers", type=int, default=1, help="并行解析的进程数（默认1为串行，0为全部CPU核心）")
+    parser.add_argument("--incremental", action="store_true", help="增量模式：只解析源文件新追加的部分，追加新样本")
+    parser.add_argument("--cache", action="store_true", help="使用导出文件旁边的列式消息缓存（内容变化时自动重建）")
+    parser.add_argument("--store", metavar="DB", help="把解析结果导入 SQLite 消息库，并从库中读取对话块")
+    parser.add_argument("--window", type=int, help="每个样本包含的上下文消息条数（默认3；指定 --token-budget 时默认不限条数）")
+    parser.add_argument("--token-budget", type=int, help="每个样本上下文的 token 预算，从最新的消息往前尽量多装")
+    parser.add_argument("--shard-mb", type=float, help="流式分片写出，每个分片的大小上限（MB）")
+    parser.add_argument("--compress", choices=["gzip", "zstd"], help="流式分片写出，并压缩分片")
+    parser.add_argument("--val-ratio", type=float, default=0.0, help="流式分片写出，按内容哈希划分验证集的比例")
+    parser.add_argument("--dedupe", type=float, nargs="?", const=0.8, metavar="THRESHOLD",
+                        help="MinHash/LSH 近似去重，相似度达到阈值（默认0.8）的样本只保留第一个")
+    parser.add_argument("--targets", help="多目标模式：逗号分隔的QQ号，或 all（发言数不少于 --min-messages 的所有用户）")
+    parser.add_argument("--personas", metavar="JSON", help="多目标模式的人设配置（名字、描述、系统提示词、输出文件）")
+    parser.add_argument("--min-messages", type=int, default=DEFAULT_MIN_MESSAGES,
+                        help=f"--targets all 时的最少发言数（默认{DEFAULT_MIN_MESSAGES}）")
+    parser.add_argument("--min-interactions", type=int, default=3, help="聊天模式分析中每个朋友至少需要的互动次数（默认3）")
+    parser.add_argument("--force", nargs="*", choices=STAGES, metavar="STAGE",
+                        help=f"忽略阶段缓存重新运行，不带参数为全部阶段（{' '.join(STAGES)}），下游阶段会跟着重跑")
+    args = parser.parse_args()
+    # 指定任一分片选项时，样本按批在进程池里生成并直接写入分片，不在内存里保留全部样本
+    stream = args.shard_mb is not None or args.compress is not None or args.val_ratio > 0
+    if args.window is None and args.token_budget is None:
+        args.window = 3
+    if args.targets and (args.incremental or stream):
+        parser.error("--targets 暂不支持和 --incremental 或分片选项一起使用")
+    workers = args.workers or None
+    store = open_store(args.store) if args.store else None
+    stages = StageCache('unified', force=True if args.force == [] else set(args.force or ()))
+    identities = IdentityStore()
+
     print("正在处理聊天记录...")
 
-    all_blocks = []
-    for filename in ['1.txt', '2.txt']:
+    sources = ['1.txt', '2.txt']
+    output_file = 'deepseek_data_unified.jsonl'
+    target_user_id = '3159852227'
+    params = {"gap_minutes": 30, "target": target_user_id, "window": args.window,
+              "token_budget": args.token_budget, "dedupe": args.dedupe}
+    if stream:
+        params.update(compress=args.compress, val_ratio=args.val_ratio)
+    count_tokens = None
+    if args.token_budget is not None:
+        from token_counter import CachedTokenCounter
+        count_tokens = CachedTokenCounter()
+    sample_stats = {}
+    dedupe = None
+    if args.dedupe is not None:
+        from dedupe import MinHasher, NearDuplicateIndex, dedupe_samples
+        try:
+            from token_counter import CachedTokenCounter
+            saved_counter = count_tokens or CachedTokenCounter()
+        except (ImportError, OSError) as e:
+            print(f"⚠️ 无法加载 tokenizer，去重只统计节省的字符数: {e}")
+            saved_counter = None
+        dedupe = NearDuplicateIndex(MinHasher(args.dedupe), saved_counter)
+    # 流式模式以分片清单代替单个输出文件
+    progress_file = manifest_path(output_file) if stream else output_file
+    checkpoints, resume = plan_sources(sources, progress_file, params, args.incremental)
+    # 完整解析时走阶段缓存：解析 -> 用户映射 -> 样本 -> 去重 -> 聊天模式 -> 输出（流式模式只缓存前两个阶段）
+    staged = checkpoints is None and not stream
+    new_checkpoints = {}
+
+    file_blocks = []  # [(对话块列表, 已处理消息数)]
+    parse_keys = []
+    for filename in sources:
         print(f"处理文件: {filename}")
-        blocks = load_blocks(filename)
-        print(f"  从 {filename} 解析出 {len(blocks)} 个对话块")
-        all_blocks.extend(blocks)
+        skip = 0
+        if checkpoints is None:
+            blocks, key = parse_stage(stages, load_blocks, filename, params["gap_minutes"],
+                                      workers=workers, use_cache=args.cache, store=store)
+            parse_keys.append(key)
+            identities.sync(filename, blocks, file_hash(filename))
+        else:
+            checkpoint = checkpoints[filename]
+            parsed, skip, new_checkpoints[filename] = parse_source(filename, params, checkpoint)
+            blocks, skip = drop_processed(parsed, skip)
+            blocks = [messages for _, _, messages in blocks]
+            # 身份库只合并新解析出的消息
+            identities.sync(filename, blocks, new_checkpoints[filename]["prefix_hash"],
+                            skip, checkpoint and checkpoint["prefix_hash"])
+        print(f"  从 {filename} 解析出 {len(blocks)} 个{'新' if resume else ''}对话块")
+        file_blocks.append((blocks, skip))
 
+    all_blocks = [blk for blocks, _ in file_blocks for blk in blocks]
     print(f"\n总共解析出 {len(all_blocks)} 个对话块")
 
-    # 构建用户映射
+    # 构建用户映射：身份库按源文件累计名字次数（增量模式下保留已有映射，只补充新出现的用户）
     print("\n构建用户ID到名字的映射关系...")
-    user_mapping = build_user_mapping(all_blocks)
+    identities.prune(sources)
+    identities.save()
+    if checkpoints is None:
+        user_mapping, mapping_key = stages.run("mapping", {}, identities.mapping, parse_keys)
+    else:
+        user_mapping = identities.mapping()
+    if resume:
+        try:
+            with open('user_mapping.json', 'r', encoding='utf-8') as f:
+                user_mapping.update(json.load(f))
+        except FileNotFoundError:
+            pass
     print(f"发现 {len(user_mapping)} 个用户")
 
     # 显示目标用户的名字
-    target_user_id = '3159852227'
     if target_user_id in user_mapping:
         print(f"目标用户(ID: {target_user_id})的统一名字: {user_mapping[target_user_id]}")
     else:
         print(f"❌ 未找到目标用户ID: {target_user_id}")
 
+    if args.targets:
+        # 多目标模式：一次遍历对话块，为每个目标用户分别生成数据集
+        with open('user_mapping.json', 'w', encoding='utf-8') as f:
+            json.dump(user_mapping, f, ensure_ascii=False, indent=2)
+        targets = select_targets(args.targets, speaker_names(all_blocks), args.min_messages)
+        personas = load_personas(targets, user_mapping, args.personas)
+        print(f"\n为 {len(personas)} 个目标用户生成训练样本:")
+        start = time.perf_counter()
+        write_persona_datasets([(None, None, blk) for blk in all_blocks], personas, output_file, params["window"],
+                               params["token_budget"], count_tokens, dedupe, sample_stats, user_mapping)
+        print(f"\n📊 总共生成了 {sample_stats.get('samples', 0)} 个训练样本 ({time.perf_counter() - start:.2f} 秒)")
+        sys.exit(0)
+
     # 生成训练样本
     print("\n生成训练样本...")
-    all_samples, all_interactions = make_unified_samples(all_blocks, user_mapping)
+    patterns_file = 'chat_patterns_unified.json'
+    # 聊天模式累计量：增量模式下只把新的互动记录合并进上次保存的累计量
+    aggregates = PatternAggregates.load(aggregates_path(patterns_file)) if resume else PatternAggregates()
+    all_samples = []
+    all_interactions = defaultdict(list)
+    first_sample = None
+    writer = None
+    if stream:
+        writer = ShardedWriter(output_file, args.shard_mb and int(args.shard_mb * 1024 * 1024),
+                               args.compress, append=resume)
+    sample_keys = []  # 各源文件样本阶段的键
+    for (blocks, skip), parse_key in zip(file_blocks, parse_keys or [None] * len(file_blocks)):
+        if staged:
+            (samples, interactions, file_stats), key = samples_stage(
+                stages, blocks, user_mapping, params, [parse_key, mapping_key], count_tokens)
+            sample_keys.append(key)
+            for name, value in file_stats.items():
+                sample_stats[name] = sample_stats.get(name, 0) + value
+            all_samples.extend(samples)
+            first_sample = first_sample or (samples[0] if samples else None)
+        elif stream:
+            first, interactions = write_samples(blocks, make_unified_samples, writer, workers=workers, skip=skip,
+                                                val_ratio=args.val_ratio, stats=sample_stats, user_mapping=user_mapping,
+                                                target=params["target"], window=params["window"],
+                                                token_budget=params["token_budget"], count_tokens=count_tokens, dedupe=dedupe,
+                                                aggregates=aggregates)
+            first_sample = first_sample or first
+        else:
+            samples, interactions = make_unified_samples(blocks, user_mapping, params["target"], params["window"], skip=skip,
+                                                         token_budget=params["token_budget"], count_tokens=count_tokens, stats=sample_stats)
+            if dedupe is not None:
+                samples = dedupe_samples(samples, dedupe)
+            all_samples.extend(samples)
+            first_sample = first_sample or (samples[0] if samples else None)
+        for friend, friend_interactions in interactions.items():
+            all_interactions[friend].extend(friend_interactions)
+
+    output_keys = sample_keys
+    dedupe_report = dedupe.report() if dedupe is not None else None
+    if dedupe is not None and staged:
+        # 去重需要按顺序看到所有文件的样本，单独作为一个阶段
+        (all_samples, dedupe_report), dedupe_key = stages.run(
+            "dedupe", {"threshold": args.dedupe},
+            lambda: (dedupe_samples(all_samples, dedupe), dedupe.report()), sample_keys)
+        output_keys = [dedupe_key]
+        first_sample = all_samples[0] if all_samples else None
+
+    if writer is not None:
+        writer.close()
 
     print(f"\n📊 数据统计:")
-    print(f"总共生成了 {len(all_samples)} 个训练样本")
+    print(f"总共生成了 {sample_stats.get('samples', 0)} 个训练样本")
+    if writer is not None:
+        for split, (count, size, shards) in writer.totals().items():
+            print(f"  {split}: {count} 个样本，{shards} 个分片，{size / (1024 * 1024):.1f} MB")
+    if args.token_budget is not None and sample_stats.get("samples"):
+        hits = sample_stats["budget_hits"]
+        print(f"上下文 token 预算 {args.token_budget}: {hits} 个样本达到预算 ({hits / sample_stats['samples']:.1%})，"
+              f"上下文共 {sample_stats['context_tokens']:,} tokens")
+
+    if dedupe_report is not None:
+        print(dedupe_report)
 
     # 验证样本质量
-    if all_samples:
-        sample = all_samples[0]
+    if first_sample:
+        sample = first_sample
         print(f"\n📝 第一个训练样本预览:")
         print(f"系统消息: {sample['messages'][0]['content']}")
         if len(sample['messages']) > 1:
@@ -235,9 +294,22 @@ if __name__ == "__main__":
         if len(sample['messages']) > 2:
             print(f"助手回复: {sample['messages'][2]['content'][:50]}...")
 
-    # 分析聊天模式
-    patterns = analyze_chat_patterns(all_interactions)
-    print(f"\n👥 发现与 {len(patterns)} 个朋友的聊天模式")
+    # 分析聊天模式：累计互动记录（流式模式已经在子进程里汇总），--min-interactions 只影响最后的筛选
+    patterns_key = None
+    if staged:
+        aggregates, patterns_key = stages.run(
+            "patterns", {},
+            lambda: PatternAggregates().update(all_interactions).add_timing(sample_stats.get("reply_timing")), sample_keys)
+    elif aggregates is not None:
+        if not stream:
+            aggregates.update(all_interactions)
+        aggregates.add_timing(sample_stats.get("reply_timing"))
+    patterns = {}
+    if aggregates is None:
+        print("\n⏭️ 没有找到上次的聊天模式累计量，增量模式下不更新聊天模式分析（去掉 --incremental 可完整重新生成）")
+    else:
+        patterns = aggregates.patterns(args.min_interactions)
+        print(f"\n👥 发现与 {len(patterns)} 个朋友的聊天模式")
 
     # 显示主要对话伙伴
     if patterns:
@@ -245,26 +317,43 @@ if __name__ == "__main__":
         print("主要对话伙伴:")
         for friend, data in sorted_friends[:5]:
             print(f"  - {friend}: {data['interaction_count']}次互动")
+        timing = aggregates.timing.summary()
+        if timing is not None and "reply_latency" in timing:
+            latency = timing["reply_latency"]
+            print(f"⏱️ 回复时延中位数 {latency['p50']:.0f} 秒（p90 {latency['p90']:.0f} 秒，共 {latency['count']} 次回复），"
+                  f"平均每轮 {timing['turn_messages']['mean']:.1f} 条消息")
 
-    # 保存用户映射关系
-    with open('user_mapping.json', 'w', encoding='utf-8') as f:
-        json.dump(user_mapping, f, ensure_ascii=False, indent=2)
+    analyses = {}
+    if aggregates is not None:
+        analyses = {patterns_file: patterns, aggregates_path(patterns_file): aggregates}
 
-    # 保存训练数据  
-    with open('deepseek_data_unified.jsonl', 'w', encoding='utf-8') as fout:
-        for sample in all_samples:
-            training_sample = {
-                "messages": sample["messages"]
-            }
-            fout.write(json.dumps(training_sample, ensure_ascii=False) + '\n')
+    if staged:
+        # 输出阶段：输出文件还在且内容没变时不重写
+        stages.run("output", {"files": ['user_mapping.json', output_file, *analyses], "min_interactions": args.min_interactions},
+                   lambda: write_outputs(output_file, all_samples, analyses, user_mapping),
+                   output_keys + [mapping_key, patterns_key], check=outputs_unchanged)
+    else:
+        # 保存用户映射关系
+        with open('user_mapping.json', 'w', encoding='utf-8') as f:
+            json.dump(user_mapping, f, ensure_ascii=False, indent=2)
 
-    # 保存分析结果
-    with open('chat_patterns_unified.json', 'w', encoding='utf-8') as f:
-        json.dump(patterns, f, ensure_ascii=False, indent=2)
+        # 保存训练数据（流式模式已经写入分片）
+        if not stream:
+            write_samples_jsonl(output_file, all_samples, append=resume)
+
+        # 保存分析结果
+        write_analyses(analyses)
+
+    # 保存增量检查点
+    for filename, checkpoint in new_checkpoints.items():
+        save_checkpoint(filename, progress_file, checkpoint)
 
     print("\n✅ 数据处理完成！")
     print("生成文件:")
     print("- user_mapping.json: 用户ID到统一名字的映射关系")
-    print("- deepseek_data_unified.jsonl: 统一后的训练数据（无群组信息）")
-    print("- chat_patterns_unified.json: 聊天模式分析")
+    if stream:
+        print(f"- {writer.manifest_path}: 统一后的训练数据分片清单（无群组信息）")
+    else:
+        print("- deepseek_data_unified.jsonl: 统一后的训练数据（无群组信息）")
+    print("- chat_patterns_unified.json: 聊天模式分析（累计量保存在 chat_patterns_unified.aggregates.json，供增量更新）")
     print(f"\n🎯 目标用户({user_mapping.get(target_user_id, '未知')})的训练样本已准备就绪！") 
\ No newline at end of file
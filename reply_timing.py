@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复时延与发言轮次统计
+- 对话块展开成按时间排列的列数组（时间戳、发言者、对话块编号），不做逐条嵌套扫描
+- 同一个人连续发出的消息算一个轮次；目标用户每个轮次的第一条消息是一次"回复"
+- 每次回复用二分查找 (np.searchsorted) 在别人的消息位置里找到它之前的最后一条，
+  时间差就是回复时延，记在那条消息的发送者名下；轮次的消息条数和持续秒数也记在他名下
+- 只统计同一对话块内的回复（块之间隔了 gap_minutes 以上，不算回复）
+- 每个朋友保存 {值: 次数} 直方图，可以相加、保存，分位数是精确的
+- 增量模式下跨过上次边界的目标轮次，上次只统计了边界前的部分：这次统计完整的轮次，
+  同时在直方图里减掉上次的那一次（次数为 -1），合并进累计量后与一次算完的结果一致
+"""
+
+from itertools import chain
+from operator import attrgetter
+import numpy as np
+
+QUANTILES = (0.25, 0.5, 0.75, 0.9)
+# 每个朋友的三个直方图：回复时延（秒）、轮次消息条数、轮次持续秒数
+FIELDS = ("latency", "turn_messages", "turn_seconds")
+
+def _encode(values):
+    """值列表 -> (编码数组, 按编码排列的不同值)"""
+    codes = {value: code for code, value in enumerate(dict.fromkeys(values))}
+    return np.fromiter(map(codes.__getitem__, values), dtype=np.int64, count=len(values)), list(codes)
+
+def timeline_arrays(blocks, target, names=None):
+    """对话块（消息列表的列表）-> (列数组, 名字列表)
+
+    names: {QQ号: 名字}，为 None 时用每条消息里的用户名（与互动记录的键一致）；
+    名字为 None 的发言者不归到任何朋友名下
+    列数组：ts、speaker（发言者编号）、name（名字编号）、block（对话块编号）、is_target
+    """
+    msgs = list(chain.from_iterable(blocks))
+    n = len(msgs)
+    sizes = np.fromiter(map(len, blocks), dtype=np.int64, count=len(blocks))
+    user_ids = list(map(attrgetter('user_id'), msgs))
+    speaker, speakers = _encode(user_ids)
+    name, name_list = _encode(list(map(attrgetter('username'), msgs)) if names is None else list(map(names.get, user_ids)))
+    columns = {
+        "ts": np.fromiter(map(attrgetter('ts'), msgs), dtype=np.int64, count=n),
+        "speaker": speaker,
+        "name": name,
+        "block": np.repeat(np.arange(len(blocks)), sizes),
+        "is_target": speaker == (speakers.index(target) if target in speakers else -1),
+    }
+    return columns, name_list
+
+def _count(histogram, value, count):
+    """histogram[value] += count，次数变成 0 的值删掉"""
+    count += histogram.get(value, 0)
+    if count:
+        histogram[value] = count
+    else:
+        histogram.pop(value, None)
+
+def _add_histogram(histogram, values):
+    values, counts = np.unique(values, return_counts=True)
+    for value, count in zip(values.tolist(), counts.tolist()):
+        _count(histogram, value, count)
+
+def histogram_summary(histogram, quantiles=QUANTILES):
+    """{值: 次数} -> {"count", "mean", "p25", ...}"""
+    from pattern_stats import histogram_quantiles
+    n = sum(histogram.values())
+    summary = {"count": n, "mean": sum(v * c for v, c in histogram.items()) / n}
+    summary.update((f"p{round(q * 100)}", v) for q, v in zip(quantiles, histogram_quantiles(histogram, quantiles)))
+    return summary
+
+class ReplyTiming:
+    """目标用户对每个朋友的回复时延和轮次长度直方图，可以相加（支持 sum() 和 stats 字典累加）"""
+
+    def __init__(self):
+        # {朋友: {字段: {值: 次数}}}，None 键是所有回复（包括块开头、没有对象的轮次）的总计
+        self.friends = {}
+
+    def _histograms(self, friend):
+        histograms = self.friends.get(friend)
+        if histograms is None:
+            histograms = self.friends[friend] = {field: {} for field in FIELDS}
+        return histograms
+
+    def update(self, blocks, target, skip=0, names=None):
+        """统计一批对话块（消息列表的列表），返回 self
+
+        skip: 第一个对话块开头已经统计过的消息数（增量模式），这些消息只用来查找回复对象，
+        从它们开始的轮次不再统计；跨过 skip 的目标轮次重新统计完整的长度，并撤销上次截断的那一次，
+        所以这时的结果只有合并进上次的累计量才有意义
+        """
+        col, name_list = timeline_arrays(blocks, target, names)
+        n = len(col["ts"])
+        if not n or not col["is_target"].any():
+            return self
+        ts, speaker, block, is_target = col["ts"], col["speaker"], col["block"], col["is_target"]
+
+        # 轮次：对话块或发言者变化的位置开始一个新轮次
+        starts = np.flatnonzero(np.r_[True, (speaker[1:] != speaker[:-1]) | (block[1:] != block[:-1])])
+        ends = np.r_[starts[1:], n] - 1
+        # 第一个对话块排在最前面，skip 就是全局位置
+        mine = is_target[starts] & (starts >= skip)
+        # 跨过边界的目标轮次：上次只看到了它的前 skip - 开头 条消息
+        crossing = np.searchsorted(starts, skip, side='right') - 1
+        crossed = 0 < skip < n and starts[crossing] < skip and is_target[starts[crossing]]
+        if crossed:
+            mine[crossing] = True
+            crossing = np.count_nonzero(mine[:crossing])  # 在选出的轮次里的位置
+        starts, ends = starts[mine], ends[mine]
+        turn_messages = ends - starts + 1
+        turn_seconds = ts[ends] - ts[starts]
+
+        # 回复对象：同一对话块内在轮次开头之前的最后一条别人的消息（二分查找）
+        others = np.flatnonzero(~is_target)
+        prev = np.searchsorted(others, starts) - 1
+        prev_pos = others[np.maximum(prev, 0)] if len(others) else np.zeros_like(starts)
+        replied = (prev >= 0) & (block[prev_pos] == block[starts])
+        latency = ts[starts] - ts[prev_pos]
+
+        total = self._histograms(None)
+        _add_histogram(total["turn_messages"], turn_messages)
+        _add_histogram(total["turn_seconds"], turn_seconds)
+        _add_histogram(total["latency"], latency[replied])
+
+        partner = col["name"][prev_pos]
+        for code in np.unique(partner[replied]).tolist():
+            friend = name_list[code]
+            if friend is None:
+                continue
+            selected = replied & (partner == code)
+            histograms = self._histograms(friend)
+            for field, values in zip(FIELDS, (latency, turn_messages, turn_seconds)):
+                _add_histogram(histograms[field], values[selected])
+
+        if crossed:
+            # 撤销上次统计的截断轮次（回复时延相同，轮次在 skip - 1 处结束）
+            start = starts[crossing]
+            truncated = (latency[crossing], skip - start, ts[skip - 1] - ts[start])
+            targets = [total]
+            if replied[crossing]:
+                friend = name_list[partner[crossing]]
+                if friend is not None:
+                    targets.append(self._histograms(friend))
+            for histograms in targets:
+                for field, value in zip(FIELDS, truncated):
+                    if field != "latency" or replied[crossing]:
+                        _count(histograms[field], int(value), -1)
+        return self
+
+    def merge(self, other):
+        """合并另一份统计，返回 self"""
+        for friend, other_histograms in other.friends.items():
+            histograms = self._histograms(friend)
+            for field, other_histogram in other_histograms.items():
+                histogram = histograms[field]
+                for value, count in other_histogram.items():
+                    _count(histogram, value, count)
+        return self
+
+    def __add__(self, other):
+        if not isinstance(other, ReplyTiming):
+            return NotImplemented
+        return ReplyTiming().merge(self).merge(other)
+
+    def __radd__(self, other):
+        if other == 0:
+            return self
+        return NotImplemented
+
+    def summary(self, friend=None):
+        """朋友（None 为总计）的 {"reply_latency": {...}, "turn_messages": {...}, "turn_seconds": {...}}，没有数据时为 None"""
+        histograms = self.friends.get(friend)
+        if not histograms or not histograms["turn_messages"]:
+            return None
+        result = {}
+        if histograms["latency"]:
+            result["reply_latency"] = histogram_summary(histograms["latency"])
+        result["turn_messages"] = histogram_summary(histograms["turn_messages"])
+        result["turn_seconds"] = histogram_summary(histograms["turn_seconds"])
+        return result
+
+    def suggested_delay(self, friend=None, quantile=0.5):
+        """给在线机器人用的回复延迟（秒）：这个朋友回复时延的分位数，没有数据时用总计"""
+        from pattern_stats import histogram_quantiles
+        for key in (friend, None):
+            histograms = self.friends.get(key)
+            if histograms and histograms["latency"]:
+                return histogram_quantiles(histograms["latency"], (quantile,))[0]
+        return None
+
+    def to_dict(self):
+        # JSON 的键只能是字符串：[[朋友, {字段: [[值, 次数], ...]}], ...]
+        return [[friend, {field: sorted(histogram.items()) for field, histogram in histograms.items()}]
+                for friend, histograms in self.friends.items()]
+
+    @classmethod
+    def from_dict(cls, data):
+        timing = cls()
+        for friend, histograms in data:
+            timing.friends[friend] = {field: dict(map(tuple, histogram)) for field, histogram in histograms.items()}
+        return timing
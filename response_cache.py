@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天回复缓存
+- 键是整个请求（模型ID、渲染好的 messages、max_tokens/temperature/stop 等采样参数）的哈希：
+  同一个朋友在同样的上下文里发来"在吗"，不再重复付费调用
+- 进程内 LRU（按键数限制容量）+ TTL（每条回复按写入时间过期）；可选磁盘上的 SQLite，跨运行共用
+- 每个键最多保存 k 条回复（samples_per_key）：存够 k 条之前照常调用 API 并把新回复加进去，
+  存够之后随机返回其中一条，保留 temperature 0.8 的多样性；k=1 就是普通缓存
+- 统计内存命中、磁盘命中、未命中、过期和淘汰次数
+"""
+
+import hashlib, json, random, sqlite3, threading, time
+from collections import OrderedDict
+
+RESPONSE_CACHE_FILE = '.response_cache.db'
+DEFAULT_CAPACITY = 10_000
+DEFAULT_TTL = 7 * 24 * 3600  # 一周
+DEFAULT_SAMPLES = 1
+
+def response_key(payload):
+    """请求的缓存键：payload 规范化 JSON（键排序）的哈希"""
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+class ResponseCache:
+    """聊天回复缓存：进程内 LRU + TTL，path 不为 None 时回复同时写入磁盘 SQLite
+
+    同步和异步的 chat 可以共用（内部加锁）；get() 返回 None 时调用方请求 API，再用 put() 存入回复
+    """
+
+    def __init__(self, path=None, capacity=DEFAULT_CAPACITY, ttl=DEFAULT_TTL, samples_per_key=DEFAULT_SAMPLES):
+        self.path = path
+        self.capacity = capacity
+        self.ttl = ttl
+        self.samples_per_key = samples_per_key
+        self.lru = OrderedDict()  # 键 -> [(写入时间, 回复), ...]
+        self.hits = self.disk_hits = self.misses = self.expired = self.evicted = 0
+        self.lock = threading.Lock()
+        self.random = random.Random()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key BLOB NOT NULL, created REAL NOT NULL, reply TEXT NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_key ON responses (key)")
+            with self._db:
+                self._db.execute("DELETE FROM responses WHERE created < ?", (time.time() - ttl,))
+
+    def _remember(self, key, samples):
+        self.lru[key] = samples
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.capacity:
+            self.lru.popitem(last=False)
+            self.evicted += 1
+
+    def _samples(self, key, now):
+        """没过期的回复列表和它是否刚从磁盘加载；内存里没有时查磁盘"""
+        samples = self.lru.get(key)
+        from_disk = False
+        if samples is None:
+            if self._db is None:
+                return [], False
+            samples = self._db.execute("SELECT created, reply FROM responses WHERE key = ? ORDER BY created",
+                                       (key,)).fetchall()
+            if not samples:
+                return [], False
+            from_disk = True
+        fresh = [sample for sample in samples if now - sample[0] < self.ttl]
+        if len(fresh) < len(samples):
+            self.expired += len(samples) - len(fresh)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("DELETE FROM responses WHERE key = ? AND created < ?", (key, now - self.ttl))
+        if fresh:
+            self._remember(key, fresh)
+        else:
+            self.lru.pop(key, None)
+        return fresh, from_disk
+
+    def get(self, key):
+        """缓存的回复（存够 k 条时随机选一条）；没有或者还没存够时返回 None"""
+        with self.lock:
+            samples, from_disk = self._samples(key, time.time())
+            if len(samples) < self.samples_per_key:
+                self.misses += 1
+                return None
+            if from_disk:
+                self.disk_hits += 1
+            else:
+                self.hits += 1
+            return self.random.choice(samples)[1]
+
+    def put(self, key, reply):
+        with self.lock:
+            now = time.time()
+            samples, _ = self._samples(key, now)
+            # 同一个键的几个请求同时未命中时，只存到 k 条为止
+            if len(samples) >= self.samples_per_key:
+                return
+            self._remember(key, samples + [(now, reply)])
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("INSERT INTO responses (key, created, reply) VALUES (?, ?, ?)", (key, now, reply))
+
+    def close(self):
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def counters(self):
+        return self.hits, self.disk_hits, self.misses
+
+    def report(self):
+        total = self.hits + self.disk_hits + self.misses
+        if not total:
+            return "回复缓存: 没有查询"
+        return (f"回复缓存: 内存命中 {self.hits:,}，磁盘命中 {self.disk_hits:,}，未命中 {self.misses:,}"
+                f"（命中率 {(self.hits + self.disk_hits) / total:.1%}），过期 {self.expired:,}，淘汰 {self.evicted:,}")
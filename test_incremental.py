@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量解析测试：最后一条消息在两次运行之间追加了内容行
+运行: python -m pytest -q test_incremental.py
+"""
+
+from incremental import parse_source, drop_processed
+
+PARAMS = {"gap_minutes": 30}
+TARGET = "3159852227"
+
+def emitted(blocks, skip):
+    """这次运行新输出的消息 (QQ号, 内容)"""
+    blocks, skip = drop_processed(blocks, skip)
+    return [(m.user_id, m.text) for _, _, messages in blocks for m in messages][skip:]
+
+def run(path, checkpoint):
+    blocks, skip, checkpoint = parse_source(str(path), PARAMS, checkpoint)
+    return emitted(blocks, skip), checkpoint
+
+def test_continuation_lines_across_checkpoint(tmp_path):
+    path = tmp_path / "chat.txt"
+    path.write_text("2024-10-08 1:04:20 迪拜之王(3113742967)\n"
+                    "什么计划\n\n"
+                    "2024-10-08 1:04:25 雷🐷🐷(3159852227)\n"
+                    "line one\n", encoding='utf-8')
+    first, checkpoint = run(path, None)
+    # 末尾的消息后面可能还有内容行，这次不输出
+    assert first == [("3113742967", "什么计划")]
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write("line two\n\n"
+                "2024-10-08 1:05:25 迪拜之王(3113742967)\n"
+                "可惜\n")
+    second, checkpoint = run(path, checkpoint)
+    assert second == [(TARGET, "line one\nline two")]
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write("\n2024-10-08 1:06:00 雷🐷🐷(3159852227)\n"
+                "dds\n")
+    third, _ = run(path, checkpoint)
+    assert third == [("3113742967", "可惜")]
+
+    # 几次增量运行输出的消息合起来和完整解析一致（除了仍然没结束的最后一条），每条只输出一次
+    full, _ = run(path, None)
+    assert first + second + third == full
+
+def test_nothing_appended(tmp_path):
+    path = tmp_path / "chat.txt"
+    path.write_text("2024-10-08 1:04:25 雷🐷🐷(3159852227)\n"
+                    "line one\n\n"
+                    "2024-10-08 1:05:25 迪拜之王(3113742967)\n"
+                    "可惜\n", encoding='utf-8')
+    first, checkpoint = run(path, None)
+    second, _ = run(path, checkpoint)
+    assert first == [(TARGET, "line one")]
+    assert second == []
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite 消息库测试：没有群组的消息重复导入、旧库的重复群组行、短查询的 LIKE 转义
+运行: python -m pytest -q test_message_store.py
+"""
+
+from message_store import open_store, ingest_source, store_blocks, search_messages
+
+CHAT = ("2024-10-08 1:04:20 迪拜之王(3113742967)\n"
+        "100%\n\n"
+        "2024-10-08 1:04:25 雷🐷🐷(3159852227)\n"
+        "a_b\n\n"
+        "2024-10-08 1:04:30 迪拜之王(3113742967)\n"
+        "ab\n")
+
+def make_store(tmp_path):
+    source = tmp_path / "chat.txt"
+    source.write_text(CHAT, encoding='utf-8')
+    return open_store(str(tmp_path / "chat.db")), str(source)
+
+def test_reingest_without_group(tmp_path):
+    conn, source = make_store(tmp_path)
+    ingest_source(conn, source)
+    ingest_source(conn, source, force=True)
+    assert conn.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 1
+    assert [(group, chat) for group, chat, _ in store_blocks(conn, source)] == [(None, None)]
+
+def test_old_duplicate_groups_are_merged(tmp_path):
+    conn, source = make_store(tmp_path)
+    ingest_source(conn, source)
+    # 旧版本的库：没有去重索引，NULL 群组的行重复插入过
+    conn.execute("DROP INDEX idx_groups_key")
+    duplicate = conn.execute("INSERT INTO groups (group_name, chat_name) VALUES (NULL, NULL)").lastrowid
+    conn.execute("UPDATE blocks SET group_id = ?", (duplicate,))
+    conn.commit()
+    conn.close()
+
+    conn = open_store(str(tmp_path / "chat.db"))
+    assert conn.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 1
+    assert len(list(store_blocks(conn, source))) == 1
+    ingest_source(conn, source, force=True)
+    assert conn.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 1
+
+def test_short_query_wildcards_are_literal(tmp_path):
+    conn, source = make_store(tmp_path)
+    ingest_source(conn, source)
+    texts = lambda query: [row[-1] for row in search_messages(conn, query)]
+    assert texts("%") == ["100%"]
+    assert texts("_") == ["a_b"]
+    assert texts("ab") == ["ab"]
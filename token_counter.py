@@ -1,77 +1,368 @@
-import json
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+训练数据 token 统计
+- 按行把 JSONL 切成分段，分段交给进程池，每个进程只加载一次编码器；预览复用统计时的结果，不重复编码
+- 汇总每个样本、每个角色的 token 数直方图，报告 p50/p95/p99/最大值和超过长度上限的样本数
+- token 数缓存（TokenCache）：键是 (编码器名, 文本) 的哈希，进程内 LRU + 磁盘上的 SQLite，
+  统计脚本、样本生成的 token 预算和去重共用，同一段文本只编码一次
+"""
+
+import argparse, bisect, hashlib, json, math, mmap, os, sqlite3, time
+from collections import Counter, OrderedDict
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
 import tiktoken
 
-def count_tokens_in_jsonl(filename):
-    """计算JSONL文件中的token数量"""
-    # 使用GPT-3.5-turbo的编码器
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-    
-    total_tokens = 0
-    total_samples = 0
-    
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024  # 每个分段约4MB
+DEFAULT_MAX_TOKENS = 4096  # gpt-3.5-turbo 微调时单个样本的上下文长度
+# OpenAI GPT-3.5-turbo微调价格 (2024年价格)
+TRAINING_COST_PER_1K_TOKENS = 0.008  # $0.008 per 1K tokens
+# OpenAI 对训练样本数的要求和建议
+MIN_SAMPLES = 10
+MAX_SAMPLES = 100000
+PERCENTILES = (0.5, 0.95, 0.99)
+PREVIEW_SAMPLES = 5
+TOKEN_CACHE_FILE = '.token_cache.db'
+DEFAULT_LRU_SIZE = 200_000
+FLUSH_EVERY = 10_000  # 攒够这么多新结果写一次磁盘
+QUERY_BATCH = 500  # 每条 SELECT ... IN (...) 的参数个数
+
+def token_key(encoding_name, text):
+    return hashlib.blake2b(f"{encoding_name}\0{text}".encode('utf-8'), digest_size=16).digest()
+
+class TokenCache:
+    """token 数缓存：进程内 LRU + 磁盘 SQLite（path 为 None 时只用内存）
+
+    新结果先放在内存里，攒够 FLUSH_EVERY 条或进程退出时写入磁盘（进程池的子进程退出时也会写）；
+    多个进程可以同时读写同一个缓存文件。
+    """
+
+    def __init__(self, path=TOKEN_CACHE_FILE, capacity=DEFAULT_LRU_SIZE):
+        self.path = path
+        self.capacity = capacity
+        self.lru = OrderedDict()
+        self.pending = {}
+        self.hits = self.disk_hits = self.misses = 0
+        self.pid = os.getpid()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=60)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS tokens (key BLOB PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID")
+            Finalize(self, self.close, exitpriority=10)
+
+    def _remember(self, key, count):
+        self.lru[key] = count
+        if len(self.lru) > self.capacity:
+            self.lru.popitem(last=False)
+
+    def counts(self, encoding, texts):
+        """一批文本的 token 数；重复的文本、缓存里有的文本都不再编码"""
+        keys = {text: token_key(encoding.name, text) for text in texts}
+        found = {}
+        missing = []
+        for text, key in keys.items():
+            count = self.lru.get(key)
+            if count is None:
+                count = self.pending.get(key)
+            if count is None:
+                missing.append(key)
+            else:
+                self.lru.move_to_end(key)
+                found[key] = count
+        self.hits += len(found)
+        if missing and self._db is not None:
+            for k in range(0, len(missing), QUERY_BATCH):
+                batch = missing[k:k + QUERY_BATCH]
+                rows = self._db.execute(
+                    f"SELECT key, count FROM tokens WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall()
+                for key, count in rows:
+                    found[key] = count
+                    self._remember(key, count)
+                self.disk_hits += len(rows)
+        for text, key in keys.items():
+            if key not in found:
+                count = found[key] = len(encoding.encode_ordinary(text))
+                self.misses += 1
+                self._remember(key, count)
+                if self._db is not None:
+                    self.pending[key] = count
+        if len(self.pending) >= FLUSH_EVERY:
+            self.flush()
+        return [found[keys[text]] for text in texts]
+
+    def count(self, encoding, text):
+        key = token_key(encoding.name, text)
+        count = self.lru.get(key)
+        if count is not None:
+            self.lru.move_to_end(key)
+            self.hits += 1
+            return count
+        return self.counts(encoding, [text])[0]
+
+    def flush(self):
+        if self.pending and self._db is not None:
+            with self._db:
+                self._db.executemany("INSERT OR IGNORE INTO tokens (key, count) VALUES (?, ?)", self.pending.items())
+            self.pending.clear()
+
+    def close(self):
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+    def counters(self):
+        return self.hits, self.disk_hits, self.misses
+
+    def report(self):
+        return format_cache_counters(self.counters())
+
+def format_cache_counters(counters):
+    hits, disk_hits, misses = counters
+    total = hits + disk_hits + misses
+    if not total:
+        return "token 缓存: 没有查询"
+    return (f"token 缓存: 内存命中 {hits:,}，磁盘命中 {disk_hits:,}，新编码 {misses:,}"
+            f"（命中率 {(hits + disk_hits) / total:.1%}）")
+
+_shared_caches = {}
+
+def shared_cache(path=TOKEN_CACHE_FILE):
+    """本进程共用的 TokenCache（每个缓存文件一个）
+
+    fork 出来的子进程不能使用父进程的 SQLite 连接，发现进程号变了就重新打开
+    """
+    cache = _shared_caches.get(path)
+    if cache is None or cache.pid != os.getpid():
+        cache = _shared_caches[path] = TokenCache(path)
+    return cache
+
+class CachedTokenCounter:
+    """带缓存的 token 计数：相同的文本只编码一次，跨运行、跨工具共用 TokenCache
+
+    可以直接传给子进程，子进程里重新加载编码器、打开同一个缓存文件。
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, cache_path=TOKEN_CACHE_FILE):
+        self.model = model
+        self.cache_path = cache_path
+        self.encoding = tiktoken.encoding_for_model(model)
+        self.cache = shared_cache(cache_path)
+
+    def __call__(self, text):
+        return self.cache.count(self.encoding, text)
+
+    def __reduce__(self):
+        return CachedTokenCounter, (self.model, self.cache_path)
+
+def split_points(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """按行切分 JSONL 文件，返回 [0, ..., 文件大小] 的偏移列表，每段约 chunk_size 字节"""
+    size = os.path.getsize(path)
+    points = [0]
+    if size:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while points[-1] + chunk_size < size:
+                pos = mm.find(b'\n', points[-1] + chunk_size)
+                if pos == -1:
+                    break
+                points.append(pos + 1)
+    points.append(size)
+    return points
+
+_encoding = None
+_cache = None
+
+def _init_worker(model=DEFAULT_MODEL, cache_path=TOKEN_CACHE_FILE):
+    """每个工作进程只加载一次编码器、打开一次缓存"""
+    global _encoding, _cache
+    _encoding = tiktoken.encoding_for_model(model)
+    _cache = shared_cache(cache_path)
+
+def _count_chunk(task):
+    """工作进程：统计文件一个字节区间内的样本
+
+    先解析整段、收集所有消息内容再统一编码；返回可以直接相加的直方图：
+    每个样本的 token 数 {token数: 样本数}、每个角色每条消息的 token 数 {角色: {token数: 消息数}}
+    """
+    path, start, end, preview = task
+    before = _cache.counters()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    lines = data.split(b'\n')
+    if lines and not lines[-1]:
+        lines.pop()
+
+    texts, roles, owners = [], [], []
+    samples = 0
+    errors = []
+    for line_num, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            sample = json.loads(line)
+        except json.JSONDecodeError as e:
+            errors.append((line_num, str(e)))
+            continue
+        for message in sample.get('messages', ()) if isinstance(sample, dict) else ():
+            texts.append(message.get('content', '') or '')
+            roles.append(message.get('role', 'unknown'))
+            owners.append(samples)
+        samples += 1
+
+    # 重复的系统提示词、[图片] 之类的文本只查一次缓存；encode_ordinary_batch 给每条消息提交一个线程池任务，
+    # 聊天消息很短时调度开销是编码本身的好几倍，并行交给进程池，缓存里直接调用底层编码
+    counts = _cache.counts(_encoding, texts)
+    per_sample = [0] * samples
+    role_tokens = {}
+    for owner, role, tokens in zip(owners, roles, counts):
+        per_sample[owner] += tokens
+        role_tokens.setdefault(role, Counter())[tokens] += 1
+
+    result = {
+        "lines": len(lines),
+        "samples": samples,
+        "tokens": sum(counts),
+        "sample_tokens": Counter(per_sample),
+        "role_tokens": role_tokens,
+        "errors": errors,
+        "preview": [(tokens, []) for tokens in per_sample[:preview]],
+        "cache": tuple(after - b for after, b in zip(_cache.counters(), before)),
+    }
+    # 预览直接用已经算好的 token 数，不再重复编码
+    for owner, role, tokens, text in zip(owners, roles, counts, texts):
+        if owner >= preview:
+            break
+        result["preview"][owner][1].append((role, tokens, text))
+    return result
+
+def count_tokens_in_jsonl(filename, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, model=DEFAULT_MODEL,
+                          cache_path=TOKEN_CACHE_FILE, stats=None):
+    """计算JSONL文件中的token数量，返回 (总token数, 样本数)
+
+    文件按行切成约 chunk_size 字节的分段，workers 为 1 时在本进程逐段统计（内存只和分段大小有关），
+    否则分给进程池（None 为全部CPU核心），每个进程只加载一次编码器。
+    cache_path: token 数缓存文件，None 表示只用进程内缓存
+    传入 stats 字典时写入 sample_tokens（每个样本的 token 数直方图）、role_tokens（每个角色的直方图）、
+    cache（缓存的 (内存命中, 磁盘命中, 新编码)）和 elapsed
+    """
     print(f"📊 正在分析文件: {filename}")
-    
+    start_time = time.perf_counter()
+
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                if line.strip():
-                    try:
-                        sample = json.loads(line)
-                        sample_tokens = 0
-                        
-                        # 计算每个消息的token数
-                        if 'messages' in sample:
-                            for message in sample['messages']:
-                                content = message.get('content', '')
-                                tokens = len(encoding.encode(content))
-                                sample_tokens += tokens
-                        
-                        total_tokens += sample_tokens
-                        total_samples += 1
-                        
-                        # 显示前几个样本的详细信息
-                        if line_num <= 5:
-                            print(f"  样本 {line_num}: {sample_tokens} tokens")
-                            if 'messages' in sample:
-                                for i, msg in enumerate(sample['messages']):
-                                    msg_tokens = len(encoding.encode(msg.get('content', '')))
-                                    role = msg.get('role', 'unknown')
-                                    content_preview = msg.get('content', '')[:50] + "..." if len(msg.get('content', '')) > 50 else msg.get('content', '')
-                                    print(f"    {role}: {msg_tokens} tokens - {content_preview}")
-                        
-                    except json.JSONDecodeError as e:
-                        print(f"⚠️ 第{line_num}行JSON解析错误: {e}")
-                        continue
-                        
+        points = split_points(filename, chunk_size)
+        tasks = [(filename, points[k], points[k + 1], PREVIEW_SAMPLES if k == 0 else 0)
+                 for k in range(len(points) - 1)]
+        if workers == 1 or len(tasks) == 1:
+            _init_worker(model, cache_path)
+            results = map(_count_chunk, tasks)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model, cache_path))
+            results = pool.map(_count_chunk, tasks)
+
+        total_tokens = total_samples = 0
+        line_offset = 0
+        sample_tokens, role_tokens = Counter(), {}
+        cache_counters = (0, 0, 0)
+        try:
+            for result in results:
+                # 显示前几个样本的详细信息
+                for k, (tokens, messages) in enumerate(result["preview"], 1):
+                    print(f"  样本 {k}: {tokens} tokens")
+                    for role, msg_tokens, content in messages:
+                        content_preview = content[:50] + "..." if len(content) > 50 else content
+                        print(f"    {role}: {msg_tokens} tokens - {content_preview}")
+                for line_num, error in result["errors"]:
+                    print(f"⚠️ 第{line_offset + line_num}行JSON解析错误: {error}")
+                line_offset += result["lines"]
+                total_tokens += result["tokens"]
+                total_samples += result["samples"]
+                sample_tokens.update(result["sample_tokens"])
+                for role, histogram in result["role_tokens"].items():
+                    role_tokens.setdefault(role, Counter()).update(histogram)
+                cache_counters = tuple(map(sum, zip(cache_counters, result["cache"])))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            elif _cache is not None:
+                _cache.flush()
+
     except FileNotFoundError:
         print(f"❌ 找不到文件: {filename}")
         return None, None
     except Exception as e:
         print(f"❌ 处理文件时出错: {e}")
         return None, None
-    
+
+    if stats is not None:
+        stats.update(sample_tokens=sample_tokens, role_tokens=role_tokens, cache=cache_counters,
+                     elapsed=time.perf_counter() - start_time)
     return total_tokens, total_samples
 
-def estimate_training_cost(total_tokens):
-    """估算训练成本"""
-    # OpenAI GPT-3.5-turbo微调价格 (2024年价格)
-    training_cost_per_1k_tokens = 0.008  # $0.008 per 1K tokens
-    
-    cost = (total_tokens / 1000) * training_cost_per_1k_tokens
+def distribution(histogram, percentiles=PERCENTILES):
+    """{token数: 次数} -> {"count", "mean", "p50", "p95", "p99", "max"}，分位数取最近秩（都是实际出现过的值）"""
+    values = sorted(histogram)
+    cumulative = list(accumulate(histogram[v] for v in values))
+    n = cumulative[-1]
+    summary = {"count": n, "mean": sum(v * histogram[v] for v in values) / n}
+    for q in percentiles:
+        rank = max(math.ceil(q * n), 1)
+        summary[f"p{round(q * 100)}"] = values[bisect.bisect_left(cumulative, rank)]
+    summary["max"] = values[-1]
+    return summary
+
+def over_limit(histogram, limit):
+    """token 数超过 limit 的样本数"""
+    return sum(count for tokens, count in histogram.items() if tokens > limit)
+
+def estimate_training_cost(total_tokens, epochs=1):
+    """估算训练成本（按训练的 token 数计费：文件 token 数 × 轮数）"""
+    cost = (total_tokens * epochs / 1000) * TRAINING_COST_PER_1K_TOKENS
     return cost
 
+def format_distribution(summary):
+    return (f"p50 {summary['p50']:,} / p95 {summary['p95']:,} / p99 {summary['p99']:,} / "
+            f"最大 {summary['max']:,}（平均 {summary['mean']:.1f}）")
+
 def main():
+    parser = argparse.ArgumentParser(description="统计训练数据的 token 数")
+    parser.add_argument("filename", nargs="?", default="deepseek_data_final.jsonl", help="JSONL 文件（默认 deepseek_data_final.jsonl）")
+    parser.add_argument("--workers", type=int, default=1, help="并行统计的进程数（默认1为单进程，0为全部CPU核心）")
+    parser.add_argument("--no-cache", action="store_true", help=f"不读写磁盘上的 token 数缓存（{TOKEN_CACHE_FILE}）")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS,
+                        help=f"单个样本的 token 上限，报告超过上限的样本数（默认{DEFAULT_MAX_TOKENS}）")
+    args = parser.parse_args()
+
     print("🔢 Token计数器 - 分析训练数据")
     print("=" * 50)
     
-    filename = "deepseek_data_final.jsonl"
-    total_tokens, total_samples = count_tokens_in_jsonl(filename)
+    filename = args.filename
+    stats = {}
+    total_tokens, total_samples = count_tokens_in_jsonl(filename, workers=args.workers or None,
+                                                        cache_path=None if args.no_cache else TOKEN_CACHE_FILE, stats=stats)
     
     if total_tokens is not None:
         print(f"\n📈 统计结果:")
         print(f"总样本数: {total_samples:,}")
         print(f"总Token数: {total_tokens:,}")
         print(f"平均每样本Token数: {total_tokens/total_samples:.1f}")
+        print(f"耗时: {stats['elapsed']:.2f} 秒，{format_cache_counters(stats['cache'])}")
+
+        # token 数分布
+        print(f"\n📐 Token分布:")
+        print(f"每个样本: {format_distribution(distribution(stats['sample_tokens']))}")
+        for role, histogram in sorted(stats["role_tokens"].items()):
+            print(f"  {role} 每条消息: {format_distribution(distribution(histogram))}")
+        too_long = over_limit(stats["sample_tokens"], args.max_tokens)
+        if too_long:
+            print(f"⚠️ {too_long:,} 个样本超过 {args.max_tokens:,} tokens 上限 ({too_long / total_samples:.2%})，训练时会被截断或拒绝")
+        else:
+            print(f"✅ 所有样本都在 {args.max_tokens:,} tokens 上限以内")
         
         # 估算成本
         cost = estimate_training_cost(total_tokens)
@@ -79,7 +370,6 @@ def main():
         print(f"GPT-3.5-turbo微调: ${cost:.2f} USD")
         
         # 文件大小信息
-        import os
         file_size = os.path.getsize(filename) / (1024 * 1024)  # MB
         print(f"\n📁 文件信息:")
         print(f"文件大小: {file_size:.1f} MB")
@@ -87,15 +377,15 @@ def main():
         
         # OpenAI限制检查
         print(f"\n⚠️ OpenAI限制检查:")
-        if total_samples < 10:
-            print("❌ 样本数量不足！OpenAI要求至少10个训练样本")
-        elif total_samples > 100000:
+        if total_samples < MIN_SAMPLES:
+            print(f"❌ 样本数量不足！OpenAI要求至少{MIN_SAMPLES}个训练样本")
+        elif total_samples > MAX_SAMPLES:
             print("⚠️ 样本数量过多！建议控制在10万以内")
         else:
             print("✅ 样本数量符合要求")
             
         if total_tokens > 50000000:  # 50M tokens
-            print("⚠️ Token数量较大，训练时间可能很长")
+            print("⚠️ Token数量较大，训练时间可能很长（可以用 dataset_budget.py 按预算挑选样本）")
         else:
             print("✅ Token数量合理")
     